@@ -1,13 +1,14 @@
+import time
 import streamlit as st
-import psycopg
 import pandas as pd
 import matplotlib.pyplot as plt
+from concurrent.futures import as_completed
 
-# Database connection
-conn = psycopg.connect(
-    host="pinniped.postgres.database.azure.com", dbname="talzaben",
-    user="talzaben", password='klVgh!KCGA'
-)
+import figure_cache
+import report_queries
+import spatial
+from query_cache import cache
+from report_runner import check_version, submit_queries
 
 # Set page configuration
 st.set_page_config(
@@ -17,59 +18,63 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
-st.set_option('deprecation.showPyplotGlobalUse', False)
+# Panels reuse cached results until a loader commits new data
+check_version()
+
 selected_week = st.selectbox("Select a Week", ["2022-09-23", "2022-09-30", "2022-10-07", "2022-10-14", "2022-10-21"])
 
+def show_figure(draw, *args, figsize=(10, 6)):
+    """
+    Show the figure drawn by draw(*args), rendered once per distinct data
+    and parameters and then served from the figure cache.
+
+    Parameters:
+    - draw: function plotting args on the current pyplot figure
+    - args: data and parameters of the figure
+    - figsize: (width, height) tuple in inches (default is (10, 6))
+    """
+    st.image(figure_cache.cache.render(draw, *args, figsize=figsize), use_container_width=True)
+
+# Each panel draws its header and widgets, yields the queries it needs, and
+# is resumed by run_panels with their results (query name -> DataFrame, shared
+# through the query cache, so panels must not modify them in place)
+
 # Function to display records loaded in a specified week and comparison with previous weeks
 def display_weekly_records():
 
     st.subheader('Hospital Records Loaded in a Specified Week and Comparison with Previous Weeks')
-    cursor = conn.cursor()
-    # Query for records in the specified week
-    cursor.execute(
-        "SELECT COUNT(*) FROM hospitalBedInformation WHERE collection_week = %s", 
-        (selected_week,)
-    )
-    records_at_week = cursor.fetchone()[0]
-
-    # Query for records in previous weeks
-    cursor.execute(
-        """
-        SELECT collection_week, COUNT(*) FROM hospitalBedInformation WHERE collection_week < %s
-        GROUP BY collection_week ORDER BY collection_week
-        """,(selected_week,))
-    records_previous_weeks = cursor.fetchall()
+    results = yield {
+        # Query for records in the specified week
+        'records_at_week': (report_queries.RECORDS_AT_WEEK, (selected_week,)),
+        # Query for records in previous weeks
+        'records_previous_weeks': (report_queries.RECORDS_PREVIOUS_WEEKS, (selected_week,)),
+    }
+    records_at_week = results['records_at_week'].iat[0, 0]
+    records_previous_weeks = results['records_previous_weeks']
 
     st.write(f"Hospital records loaded in the specified week: {records_at_week}")
     st.write("\nHospital records loaded in the previous week(s):")
 
-    if not records_previous_weeks: 
+    if records_previous_weeks.empty: 
         st.write("There are no records for previous weeks.")
-    for week, count in records_previous_weeks:
-        st.write(f"{week}: {count}")
+    for week, count in records_previous_weeks.itertuples(index=False):
+        st.write(f"{week:%Y-%m-%d}: {count}")
 
 # Function to summarize the number of beds available and used in a specified week and compared to the 4 most recent weeks
 def display_bed_statistics():
 
     st.subheader('Summarizing the Number of Adult and Pediatric Beds Available That Week, the Number Used, and the Number Used by Patients with COVID, Compared to the 4 Most Recent Weeks')
 
-    cursor = conn.cursor()
-
-    # Query for statistics in the specified week
-    cursor.execute(
-        "SELECT ROUND(sum(all_adult_hospital_beds_7_day_avg)::numeric, 2), \
-                ROUND(sum(all_pediatric_inpatient_beds_7_day_avg)::numeric, 2), \
-                ROUND(sum(all_adult_hospital_inpatient_bed_occupied_7_day_coverage)::numeric, 2), \
-                ROUND(sum(all_pediatric_inpatient_bed_occupied_7_day_avg)::numeric, 2), \
-                ROUND(sum(inpatient_beds_used_covid_7_day_avg)::numeric, 2) \
-                FROM hospitalBedInformation WHERE collection_week = %s",
-        (selected_week,)
-    )
-    week_stats = cursor.fetchone()
-
-    if week_stats is None:
+    results = yield {
+        # Query for statistics in the specified week
+        'week_stats': (report_queries.BED_STATISTICS_AT_WEEK, (selected_week,)),
+        # Query for statistics in the 4 most recent weeks
+        'recent_weeks_stats': (report_queries.BED_STATISTICS_RECENT_WEEKS, ()),
+    }
+    if results['week_stats'].empty:
         st.write("No statistics found for the specified week.")
         return
+    week_stats = results['week_stats'].iloc[0].tolist()
 
     values = {
         'Available Adult Beds': [week_stats[0]], 
@@ -80,24 +85,8 @@ def display_bed_statistics():
     }
     dataframe = pd.DataFrame(data=values)
 
-    # Query for statistics in the 4 most recent weeks
-    cursor.execute(
-       """
-       SELECT collection_week,
-              ROUND(sum(all_adult_hospital_beds_7_day_avg)::numeric, 2),
-              ROUND(sum(all_pediatric_inpatient_beds_7_day_avg)::numeric, 2),
-              ROUND(sum(all_adult_hospital_inpatient_bed_occupied_7_day_coverage)::numeric, 2),
-              ROUND(sum(all_pediatric_inpatient_bed_occupied_7_day_avg)::numeric, 2),
-              ROUND(sum(inpatient_beds_used_covid_7_day_avg)::numeric, 2)
-       FROM hospitalBedInformation
-       GROUP BY collection_week 
-       ORDER BY collection_week DESC LIMIT 4
-       """
-    )
-    recent_weeks_stats = cursor.fetchall()
-
     columns = ['Week', 'Available Adult Beds', 'Available Pediatric Beds', 'Used Adult Beds', 'Used Pediatric Beds', 'Used Beds by Patients with COVID']
-    dataframe2 = pd.DataFrame(recent_weeks_stats, columns=columns)
+    dataframe2 = results['recent_weeks_stats'].set_axis(columns, axis=1)
 
     st.write(f"\nSummary for {selected_week}:")
     st.dataframe(dataframe)
@@ -109,99 +98,52 @@ def display_bed_statistics():
 def display_quality_ratings():
 
     st.subheader('Hospital Quality Ratings and Fraction of Beds in Use')
-    cursor = conn.cursor()
-
     # Query for hospital quality ratings
-    cursor.execute(
-        """  
-        SELECT hqi.hospital_overall_rating,
-        SUM(hbi.all_adult_hospital_inpatient_bed_occupied_7_day_coverage + hbi.all_pediatric_inpatient_bed_occupied_7_day_avg) /
-        SUM(hbi.all_adult_hospital_beds_7_day_avg + hbi.all_pediatric_inpatient_beds_7_day_avg) as fraction_of_beds_in_use
-        FROM HospitalQualityInformation hqi
-        JOIN HospitalBedInformation hbi ON hqi.facility_id = hbi.hospital_fk
-        GROUP BY hqi.hospital_overall_rating
-        """
-    )
-
-    columns = [desc[0] for desc in cursor.description]
-    df = pd.DataFrame(cursor.fetchall(), columns=columns)
-
-    # Plotting
-    plt.figure(figsize=(10, 6))
+    results = yield {'quality_ratings': (report_queries.QUALITY_RATINGS, ())}
+    df = results['quality_ratings']
+
+    show_figure(plot_quality_ratings, df)
+
+def plot_quality_ratings(df):
     plt.bar(df['hospital_overall_rating'], df['fraction_of_beds_in_use'], color='skyblue')
     plt.title('Fraction of Beds in Use by Hospital Quality Rating')
     plt.xlabel('Hospital Quality Rating')
     plt.ylabel('Fraction of Beds in Use')
-    st.pyplot()
 
 # Function to display total hospital beds used per week, inclusive of all cases and COVID cases
 def display_total_bed_usage():
 
     st.subheader('Total Hospital Beds Used per Week, Inclusive of All Cases and COVID Cases')
-    cursor = conn.cursor()
-
     # Query for total hospital beds used
-    cursor.execute(
-        """
-        SELECT collection_week,
-                SUM(all_adult_hospital_inpatient_bed_occupied_7_day_coverage + all_pediatric_inpatient_bed_occupied_7_day_avg + icu_beds_used_7_day_avg) as all_cases,
-                SUM(inpatient_beds_used_covid_7_day_avg) as covid_cases
-         FROM hospitalBedInformation WHERE collection_week <= %s 
-         GROUP BY collection_week 
-         ORDER BY collection_week 
-         """, (selected_week, )
-    )
-
-    columns = [desc[0] for desc in cursor.description]
-    df = pd.DataFrame(cursor.fetchall(), columns=columns)
-
-    # Plotting
-    plt.figure(figsize=(12, 6))
-    plt.plot(df['collection_week'], df['all_cases'], label='Total Beds Used', marker='o', color='lightblue')
-    plt.title('Total Hospital Beds Used per Week (All Cases)')
-    plt.xlabel('Collection Week')
-    plt.ylabel('Number of Beds')
-    plt.xticks(rotation=45)
-    plt.legend()
-    st.pyplot()
+    results = yield {'total_bed_usage': (report_queries.TOTAL_BED_USAGE, (selected_week,))}
+    df = results['total_bed_usage']
+
+    show_figure(plot_beds_per_week, df, 'all_cases', 'Total Beds Used', 'lightblue', 'All Cases', figsize=(12, 6))
+    show_figure(plot_beds_per_week, df, 'covid_cases', 'COVID Beds Used', 'lightgreen', 'COVID Cases', figsize=(12, 6))
 
-    plt.figure(figsize=(12, 6))
-    plt.plot(df['collection_week'], df['covid_cases'], label='COVID Beds Used', marker='o', color='lightgreen')
-    plt.title('Total Hospital Beds Used per Week (COVID Cases)')
+def plot_beds_per_week(df, column, label, color, cases):
+    plt.plot(df['collection_week'], df[column], label=label, marker='o', color=color)
+    plt.title(f'Total Hospital Beds Used per Week ({cases})')
     plt.xlabel('Collection Week')
     plt.ylabel('Number of Beds')
     plt.xticks(rotation=45)
     plt.legend()
-    st.pyplot()
 
 def emergency_services_comparison():
 
     st.subheader('Comparison of Emergency Services Availability in the Top 20 States')
-    cursor = conn.cursor()
-
-    cursor.execute(
-        """
-        SELECT hl.state, COUNT(*) AS count
-        FROM HospitalQualityInformation hq
-        JOIN Hospitals h ON hq.facility_id = h.hospital_pk
-        JOIN HospitalLocations hl ON h.hospital_pk = hl.hospital_fk
-        WHERE hq.emergency_services = TRUE
-        GROUP BY hl.state
-        """
-    )
-
-    columns = [desc[0] for desc in cursor.description]
-    emergency_services_df = pd.DataFrame(cursor.fetchall(), columns = columns)
+    # The query returns the 20 states with the most hospitals with emergency services
+    results = yield {'emergency_services': (report_queries.EMERGENCY_SERVICES_BY_STATE, ())}
+    top_20_states_df = results['emergency_services']
 
-    top_20_states_df = emergency_services_df.nlargest(20, 'count')
+    show_figure(plot_emergency_services, top_20_states_df, figsize=(12, 6))
 
-    plt.figure(figsize = (12, 6))
+def plot_emergency_services(top_20_states_df):
     plt.bar(top_20_states_df["state"], top_20_states_df["count"], color = 'lightcyan')
     plt.title("Top 20 States with the Highest Availability of Emergency Services")
     plt.xlabel("State")
     plt.ylabel("Number of Hospitals with Emergency Services")
     plt.xticks(rotation = 45, ha='right')
-    st.pyplot()
 
 
 def bed_usage_by_ownership():
@@ -209,73 +151,122 @@ def bed_usage_by_ownership():
     st.subheader('Bed Usage Based on Hospital Ownership Type')
     selected_owner = st.selectbox("Select a Hospital Ownership", ['Government - Federal', 'Government - Hospital District or Authority', 'Government - Local', 'Government - State', 'Proprietary'])
 
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT hq.hospital_ownership, hbi.collection_week, SUM(hbi.all_adult_hospital_inpatient_bed_occupied_7_day_coverage + hbi.all_pediatric_inpatient_bed_occupied_7_day_avg) / SUM(hbi.all_adult_hospital_beds_7_day_avg + hbi.all_pediatric_inpatient_beds_7_day_avg) as fraction_of_beds_in_use
-        FROM HospitalQualityInformation hq
-        JOIN HospitalBedInformation hbi ON hq.facility_id = hbi.hospital_fk
-        WHERE hq.hospital_ownership = %s
-        GROUP BY hq.hospital_ownership, hbi.collection_week
-        ORDER BY hbi.collection_week
-        """, (selected_owner, ))
-        
-    columns = [desc[0] for desc in cursor.description]
-    df = pd.DataFrame(cursor.fetchall(), columns=columns)
-
-    # Plotting the data
-    plt.figure(figsize=(10, 6))
+    results = yield {'bed_usage_by_ownership': (report_queries.BED_USAGE_BY_OWNERSHIP, (selected_owner,))}
+    df = results['bed_usage_by_ownership']
+
+    show_figure(plot_bed_usage_by_ownership, df)
+
+def plot_bed_usage_by_ownership(df):
     plt.plot(df['collection_week'], df['fraction_of_beds_in_use'], color = 'violet')
     plt.title('Fraction of Beds in Use by Hospital Ownership')
     plt.xlabel('Collection Week')
     plt.ylabel('Fraction of Beds in Use')
     plt.xticks(rotation = 45, ha='right')
-    st.pyplot() 
 
 def top_and_bottom_rating():
 
     st.subheader('Top and Bottom 10 Hospitals Based on Overall Hospital Rating')
     selected_week2 = st.selectbox("Select a Week", ["2021-07-01", "2022-01-01", "2022-10-01"])
 
-    cursor = conn.cursor()
-
-    # Execute a query to count records for the previous weeks
-    cursor.execute(
-        """
-        SELECT q.hospital_overall_rating, l.state, q.data_date
-        FROM hospitalqualityinformation as q
-        INNER JOIN hospitallocations as l ON q.facility_id = l.hospital_fk
-        WHERE q.data_date = %s
-        """,
-        (selected_week2,))
-    quality_weeks = cursor.fetchall()     
-
-    df = pd.DataFrame(quality_weeks, columns=["hospital_overall_rating", "state", "data_date"])
-    df = df.dropna()
+    # Query for the top 10 and bottom 10 states by average hospital_overall_rating
+    results = yield {'state_rating_extremes': (report_queries.STATE_RATING_EXTREMES, (selected_week2,))}
+    avg_ratings = results['state_rating_extremes'].set_index('state')['average_rating']
 
-    df["hospital_overall_rating"] = pd.to_numeric(df["hospital_overall_rating"], errors='coerce')
+    top_states = avg_ratings[results['state_rating_extremes']['top'].to_numpy()]
+    bottom_states = avg_ratings[results['state_rating_extremes']['bottom'].to_numpy()]
 
-    # Calculate the average hospital_overall_rating for each state
-    avg_ratings = df.groupby("state")["hospital_overall_rating"].mean().sort_values(ascending=False)
+    show_figure(plot_top_and_bottom_states, top_states, bottom_states, selected_week2)
 
-    # Get the top 10 and bottom 10 states
-    top_states = avg_ratings.head(10)
-    bottom_states = avg_ratings.tail(10)
-
-    # Scatter plot for the top 5 states
-    plt.figure(figsize=(10, 6))
+def plot_top_and_bottom_states(top_states, bottom_states, selected_week2):
     plt.scatter(top_states.index, top_states.values, color='green', label='Top 10 States', s=100)
     plt.scatter(bottom_states.index, bottom_states.values, color='red', label='Bottom 10 States', s=100)
     plt.title(f'Average Hospital Overall Rating by State in week: {selected_week2}')
     plt.xlabel('State')
     plt.ylabel('Average Hospital Overall Rating')
     plt.legend()
-    st.pyplot()
-
-display_weekly_records()
-display_bed_statistics()
-display_quality_ratings()
-display_total_bed_usage()
-emergency_services_comparison()
-bed_usage_by_ownership()
-top_and_bottom_rating()
\ No newline at end of file
+
+def hospitals_near_location():
+
+    st.subheader('Hospitals Near a Location and Their Free Beds in the Latest Week')
+    latitude = st.number_input("Latitude", min_value=-90.0, max_value=90.0, value=40.4406, format="%.4f")
+    longitude = st.number_input("Longitude", min_value=-180.0, max_value=180.0, value=-79.9959, format="%.4f")
+    radius_km = st.slider("Radius (km)", min_value=5, max_value=500, value=50, step=5)
+
+    # Query for every hospital's coordinates and beds, indexed once per load
+    results = yield {'hospital_points': (report_queries.HOSPITAL_POINTS, ())}
+    hospitals = spatial.hospital_map(results['hospital_points'])
+
+    nearby = hospitals.within(latitude, longitude, radius_km)
+    columns = ['hospital_name', 'city', 'state', 'distance_km', 'adult_beds_free', 'icu_beds_free', 'covid_beds_used']
+    if nearby.empty:
+        st.write(f"No hospitals within {radius_km} km. The 5 nearest hospitals:")
+        st.dataframe(hospitals.nearest(latitude, longitude, 5)[columns].round(1))
+        return
+
+    st.write(f"{len(nearby)} hospitals within {radius_km} km, with {nearby['adult_beds_free'].sum():.0f} free adult beds "
+             f"and {nearby['icu_beds_free'].sum():.0f} free ICU beds in their latest week.")
+    st.map(nearby[['latitude', 'longitude']])
+    st.dataframe(nearby[columns].round(1))
+
+def run_panels(panels):
+    """
+    Draw every panel's header and widgets in page order, run the queries of
+    all panels concurrently on the pooled connections, and finish each panel
+    in its own container as soon as its queries have returned.
+
+    Parameters:
+    - panels: list of panel generator functions
+
+    Returns:
+    - list of (panel, query name, seconds, cached) tuples
+    """
+    started = []
+    for panel in panels:
+        container = st.container()
+        with container:
+            generator = panel()
+            futures = submit_queries(next(generator))
+        started.append((container, generator, futures))
+
+    panel_of = {future: index for index, (_, _, futures) in enumerate(started) for future in futures.values()}
+    remaining = [len(futures) for _, _, futures in started]
+    timings = []
+    for future in as_completed(panel_of):
+        index = panel_of[future]
+        remaining[index] -= 1
+        if remaining[index] > 0:
+            continue
+
+        container, generator, futures = started[index]
+        results = {}
+        for name, query_future in futures.items():
+            frame, seconds, cached = query_future.result()
+            results[name] = frame
+            timings.append((generator.__name__, name, seconds, cached))
+        with container:
+            try:
+                generator.send(results)
+            except StopIteration:
+                pass
+    return timings
+
+start_time = time.perf_counter()
+timings = run_panels([
+    display_weekly_records,
+    display_bed_statistics,
+    display_quality_ratings,
+    display_total_bed_usage,
+    emergency_services_comparison,
+    bed_usage_by_ownership,
+    top_and_bottom_rating,
+    hospitals_near_location,
+])
+
+st.sidebar.caption(f"Page queries: {time.perf_counter() - start_time:.2f}s")
+st.sidebar.dataframe(pd.DataFrame(
+    [(name, f"{seconds * 1000:.0f} ms", 'cache' if cached else 'database') for _, name, seconds, cached in timings],
+    columns=['Query', 'Time', 'Source']))
+st.sidebar.caption(f"Query cache: {cache.hits} hits, {cache.misses} misses, {len(cache.entries)} entries")
+figures = figure_cache.cache
+st.sidebar.caption(f"Figure cache: {figures.hits} hits, {figures.misses} misses, {len(figures.entries)} figures, "
+                   f"{figures.size / 1024 / 1024:.1f} of {figures.max_bytes / 1024 / 1024:.0f} MB, {figures.evictions} evicted")
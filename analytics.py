@@ -0,0 +1,198 @@
+import datetime
+import json
+import logging
+import os
+import threading
+
+import psycopg
+
+from db import current_load_version
+from report_data import fetch_frame
+
+# duckdb and pyarrow are optional: without them the dashboard queries Postgres
+try:
+    import duckdb
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    duckdb = None
+
+logger = logging.getLogger(__name__)
+
+
+# Parquet exports of the relations the dashboard queries (see
+# report_queries.py), one file per relation, for the DuckDB backend.
+# Created by running this module, then refreshed by the loaders after each
+# commit for as long as the directory exists.
+ANALYTICS_DIR = os.environ.get("ANALYTICS_DIR", ".analytics")
+MANIFEST = "manifest.json"
+
+# Exported relations and the loaders whose commits change them. The views
+# are exported with their rows, so DuckDB needs no copy of their SQL.
+RELATIONS = {
+    'Hospitals': ('hhs',),
+    'HospitalLocations': ('hhs',),
+    'WeeklyBedRollup': ('hhs',),
+    'HospitalBedInformation': ('hhs',),
+    'HospitalBedQuality': ('hhs', 'quality'),
+    'HospitalQualitySnapshots': ('quality',),
+}
+
+
+def available():
+    """
+    Returns:
+    - bool, whether duckdb and pyarrow are installed
+    """
+    return duckdb is not None
+
+
+def enabled():
+    """
+    Returns:
+    - bool, whether loads refresh the Parquet exports, which is when duckdb
+      and pyarrow are installed and the exports have been created
+    """
+    return available() and os.path.isdir(ANALYTICS_DIR)
+
+
+def export_relation(conn, relation):
+    """
+    Write the rows of a relation to ANALYTICS_DIR/<relation>.parquet. The
+    file is written under a temporary name and renamed, so readers never
+    see a partial file.
+
+    Returns:
+    - int, number of rows exported
+    """
+    frame = fetch_frame(conn, f"SELECT * FROM {relation}")
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    path = os.path.join(ANALYTICS_DIR, f"{relation}.parquet")
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    pq.write_table(table, temp_path)
+    os.replace(temp_path, path)
+    return table.num_rows
+
+
+def export(conn, loader=None):
+    """
+    Export the dashboard relations changed by a loader, or all of them,
+    and record the load version they were exported at in the manifest.
+    Exports are serialized with a transaction-level advisory lock, so
+    concurrent loads leave the files of the last one to commit.
+
+    Parameters:
+    - conn: psycopg connection, with no transaction in progress
+    - loader: str (optional), 'hhs' or 'quality' (default is None, which
+      exports every relation)
+
+    Returns:
+    - dict, relation -> number of rows exported
+    """
+    os.makedirs(ANALYTICS_DIR, exist_ok=True)
+    exported = {}
+    with conn.transaction(), conn.cursor() as curr:
+        curr.execute("SELECT pg_advisory_xact_lock(hashtext('AnalyticsExport'))")
+        for relation, loaders in RELATIONS.items():
+            if loader is None or loader in loaders:
+                exported[relation] = export_relation(conn, relation)
+        load_version = current_load_version(curr)
+
+        manifest_path = os.path.join(ANALYTICS_DIR, MANIFEST)
+        manifest = {'relations': {}}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        exported_at = datetime.datetime.now().isoformat(timespec='seconds')
+        manifest['load_version'] = load_version
+        for relation, n_rows in exported.items():
+            manifest['relations'][relation] = {'rows': n_rows, 'exported_at': exported_at}
+        temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, manifest_path)
+    return exported
+
+
+def refresh(conn, loader):
+    """
+    Refresh the exports after a committed load, if they are enabled. The
+    load is not undone when this fails: the error is logged and the exports
+    stay at the previous load until the next refresh.
+
+    Parameters:
+    - conn: psycopg connection, with no transaction in progress
+    - loader: str, 'hhs' or 'quality'
+    """
+    if not enabled():
+        return
+    try:
+        export(conn, loader)
+    except (psycopg.Error, OSError) as e:
+        logger.error(f"Refreshing the analytics exports failed: {e}")
+
+
+class DuckDBBackend:
+    """
+    Runs the dashboard queries in process with DuckDB, over the Parquet
+    exports, without a database server. Each relation is a view over its
+    file, so refreshed exports are read on the next query.
+    """
+
+    def __init__(self, path=ANALYTICS_DIR):
+        if not available():
+            raise RuntimeError("The DuckDB backend needs duckdb and pyarrow installed")
+        if not os.path.exists(os.path.join(path, MANIFEST)):
+            raise RuntimeError(f"No analytics exports in {path}, run python analytics.py first")
+        self.path = path
+        self.connection = duckdb.connect()
+        for relation in RELATIONS:
+            parquet_path = os.path.join(path, f"{relation}.parquet")
+            # Exports made before a relation was added lack it until the next export
+            if not os.path.exists(parquet_path):
+                continue
+            parquet_path = parquet_path.replace("'", "''")
+            self.connection.execute(f"CREATE VIEW {relation} AS SELECT * FROM read_parquet('{parquet_path}')")
+
+    def load_version(self):
+        """
+        Returns:
+        - int, load version the exports were last refreshed at (see
+          db.current_load_version)
+        """
+        with open(os.path.join(self.path, MANIFEST)) as f:
+            return json.load(f)['load_version']
+
+    def fetch(self, query, params=()):
+        """
+        Run a dashboard query. Its %s placeholders become DuckDB's ?.
+
+        Returns:
+        - pandas df, the query result
+        """
+        # DuckDB connections are not thread-safe, each query gets its own cursor
+        cursor = self.connection.cursor()
+        try:
+            return cursor.execute(query.replace('%s', '?'), list(params)).df()
+        finally:
+            cursor.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from db import get_conninfo
+
+    parser = argparse.ArgumentParser(description="Export the dashboard's relations to Parquet for the DuckDB backend.")
+    parser.parse_args()
+
+    if not available():
+        print("duckdb and pyarrow are not installed, nothing to export.")
+    else:
+        start_time = time.perf_counter()
+        with psycopg.connect(get_conninfo()) as conn:
+            exported = export(conn)
+        for relation, n_rows in exported.items():
+            print(f"{relation}: {n_rows} rows")
+        print(f"Exported to {ANALYTICS_DIR} in {time.perf_counter() - start_time:.2f}s")
@@ -0,0 +1,203 @@
+import glob
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import psycopg
+from psycopg_pool import ConnectionPool
+
+from db import get_conninfo
+from load_hhs import load_hhs_data, DIMENSION_TABLES
+from load_quality import load_quality_data
+
+
+HHS_FILE_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2})-hhs-data\.csv$")
+QUALITY_FILE_PATTERN = re.compile(r"Hospital_General_Information-(\d{4}-\d{2})\.csv$")
+
+# Connection pool of the current worker process, opened by init_worker
+pool = None
+
+
+def infer_load(csv_file):
+    """
+    Work out which loader a file belongs to and the date to load it for from
+    its name.
+
+    Parameters:
+    - csv_file: str, path to a YYYY-MM-DD-hhs-data.csv or
+      Hospital_General_Information-YYYY-MM.csv file
+
+    Returns:
+    - tuple, ('hhs', 'YYYY-MM-DD') or ('quality', 'YYYY-MM-01'), or None if
+      the name matches neither pattern
+    """
+    name = os.path.basename(csv_file)
+    match = HHS_FILE_PATTERN.search(name)
+    if match:
+        return 'hhs', match.group(1)
+    match = QUALITY_FILE_PATTERN.search(name)
+    if match:
+        return 'quality', f"{match.group(1)}-01"
+    return None
+
+
+def collect_files(paths):
+    """
+    Expand directories and glob patterns into the loadable files they contain.
+
+    Parameters:
+    - paths: str list, directories, glob patterns or file paths
+
+    Returns:
+    - list of (csv_file, kind, date) tuples sorted by date, files whose names
+      are not recognised by infer_load are left out
+    """
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            files.update(glob.glob(os.path.join(path, "*.csv")))
+        else:
+            files.update(glob.glob(path))
+
+    loads = []
+    for csv_file in files:
+        load = infer_load(csv_file)
+        if load is None:
+            print(f"Skipping {csv_file}: file name does not match a known data set")
+        else:
+            loads.append((csv_file, *load))
+    return sorted(loads, key=lambda load: (load[2], load[1]))
+
+
+def rejects_file(csv_file):
+    """
+    Path of the rejects file for one input file, so concurrent loads do not
+    overwrite each other's rejects.
+    """
+    return os.path.join("invalid_data", os.path.basename(csv_file).replace(".csv", "-rejects.csv"))
+
+
+def init_worker(conninfo):
+    """
+    Open the connection pool of a worker process. Its connections are reused
+    for every file the worker loads.
+    """
+    global pool
+    pool = ConnectionPool(conninfo, min_size=1, max_size=1, open=True)
+
+
+def load_file(csv_file, kind, date):
+    """
+    Load one file in a worker process. HHS files only load their
+    HospitalBedInformation rows here; the hospital dimensions have already
+    been loaded by load_dimensions.
+
+    Returns:
+    - dict, 'file', 'rows', 'inserted' and 'seconds' of the load, with
+      'rows' set to None if the load failed
+    """
+    start_time = time.perf_counter()
+    with pool.connection() as conn:
+        if kind == 'hhs':
+            result = load_hhs_data(csv_file, conn, bulk=True, tables=('HospitalBedInformation',),
+                                   rejects_path=rejects_file(csv_file))
+        else:
+            result = load_quality_data(csv_file, conn, date, rejects_path=rejects_file(csv_file))
+    result = result or {'rows': None, 'inserted': 0}
+    return {'file': csv_file, 'rows': result['rows'], 'inserted': result['inserted'],
+            'seconds': time.perf_counter() - start_time}
+
+
+def load_files(loads):
+    """
+    Load several files one after the other in a worker process. CMS quality
+    snapshots go through this so that HospitalQualityHistory receives them
+    in date order.
+
+    Parameters:
+    - loads: list of (csv_file, kind, date) tuples, in the order to load them
+
+    Returns:
+    - dict list, per-file results (see load_file)
+    """
+    return [load_file(*load) for load in loads]
+
+
+def load_dimensions(conn, loads):
+    """
+    Load the Hospitals and HospitalLocations rows of the HHS files one file
+    at a time, oldest week first, so the parallel fact loads never race to
+    insert the same hospital.
+
+    Parameters:
+    - conn: psycopg connection
+    - loads: list of (csv_file, kind, date) tuples from collect_files
+    """
+    for csv_file, kind, date in loads:
+        if kind == 'hhs':
+            load_hhs_data(csv_file, conn, bulk=True, tables=DIMENSION_TABLES,
+                          rejects_path=rejects_file(csv_file).replace("-rejects.csv", "-dimension-rejects.csv"))
+
+
+def backfill(paths, workers=4):
+    """
+    Load every HHS and CMS quality file found under paths, running the files
+    concurrently in a process pool with one pooled connection per worker.
+    The quality snapshots are loaded one after the other, oldest first,
+    alongside the HHS files.
+
+    Parameters:
+    - paths: str list, directories, glob patterns or file paths
+    - workers: int, number of worker processes (default is 4)
+
+    Returns:
+    - dict list, per-file results (see load_file)
+    """
+    loads = collect_files(paths)
+    if not loads:
+        print("No files to load.")
+        return []
+
+    conninfo = get_conninfo()
+    start_time = time.perf_counter()
+    with psycopg.connect(conninfo) as conn:
+        load_dimensions(conn, loads)
+    dimension_seconds = time.perf_counter() - start_time
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(conninfo,)) as executor:
+        futures = [executor.submit(load_file, *load) for load in loads if load[1] == 'hhs']
+        futures.append(executor.submit(load_files, [load for load in loads if load[1] == 'quality']))
+        for future in as_completed(futures):
+            result = future.result()
+            results.extend(result if isinstance(result, list) else [result])
+    total_seconds = time.perf_counter() - start_time
+
+    print()
+    print(f"{'file':<45}{'rows':>8}{'inserted':>10}{'seconds':>9}{'rows/sec':>10}")
+    for result in sorted(results, key=lambda result: result['file']):
+        if result['rows'] is None:
+            print(f"{os.path.basename(result['file']):<45}{'FAILED':>8}")
+            continue
+        print(f"{os.path.basename(result['file']):<45}{result['rows']:>8}{result['inserted']:>10}"
+              f"{result['seconds']:>9.2f}{result['rows'] / result['seconds']:>10.0f}")
+    total_rows = sum(result['rows'] or 0 for result in results)
+    print(f"Dimensions loaded in {dimension_seconds:.2f}s")
+    print(f"Loaded {total_rows} rows from {len(results)} files in {total_seconds:.2f}s "
+          f"({total_rows / total_seconds:.0f} rows/sec)")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load every HHS and CMS quality file in the given directories or globs.")
+    parser.add_argument("paths", nargs="+", help="directories, glob patterns or files, e.g. hhs_data/ hospital_data/")
+    parser.add_argument("--workers", type=int, default=4, help="number of files loaded at the same time")
+    args = parser.parse_args()
+
+    results = backfill(args.paths, workers=args.workers)
+    if any(result['rows'] is None for result in results):
+        sys.exit(1)
@@ -0,0 +1,71 @@
+"""
+Compare the throughput of the per-row and COPY-based HHS load paths.
+
+Each mode loads the same weekly file into its own empty schema (created by
+the migrations in migrations.py) so that neither run sees the other's rows
+as duplicates. Point it at a scratch database, never at the
+shared one:
+
+    python benchmarks/bench_hhs_load.py <conninfo> hhs_data/2022-09-23-hhs-data.csv
+"""
+import os
+import sys
+import time
+
+import psycopg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from load_hhs import load_hhs_data
+from migrations import migrate
+
+
+def run_mode(conn, csv_file, bulk):
+    """
+    Load csv_file into a fresh schema and time it.
+
+    Parameters:
+    - conn: psycopg connection to a scratch database
+    - csv_file: str, path to an HHS weekly file
+    - bulk: bool, passed through to load_hhs_data
+
+    Returns:
+    - float, seconds taken by load_hhs_data
+    """
+    schema = "bench_copy" if bulk else "bench_row"
+    with conn.cursor() as curr:
+        curr.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        curr.execute(f"CREATE SCHEMA {schema}")
+        curr.execute(f"SET search_path TO {schema}")
+    conn.commit()
+    migrate(conn)
+
+    start_time = time.perf_counter()
+    load_hhs_data(csv_file, conn, bulk=bulk)
+    elapsed = time.perf_counter() - start_time
+
+    with conn.cursor() as curr:
+        curr.execute(f"DROP SCHEMA {schema} CASCADE")
+        curr.execute("SET search_path TO DEFAULT")
+    conn.commit()
+    return elapsed
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python benchmarks/bench_hhs_load.py <conninfo> <csv_file>")
+        sys.exit(1)
+
+    conninfo, csv_file = sys.argv[1], sys.argv[2]
+    with open(csv_file, encoding="utf-8") as f:
+        n_rows = sum(1 for _ in f) - 1
+
+    results = {}
+    with psycopg.connect(conninfo) as conn:
+        for bulk in (False, True):
+            results["copy" if bulk else "row"] = run_mode(conn, csv_file, bulk)
+
+    print()
+    print(f"{'mode':<6}{'seconds':>10}{'rows/sec':>12}")
+    for mode, elapsed in results.items():
+        print(f"{mode:<6}{elapsed:>10.2f}{n_rows / elapsed:>12.0f}")
+    print(f"speedup: {results['row'] / results['copy']:.1f}x")
@@ -0,0 +1,212 @@
+"""
+Time the loaders through a TCP proxy that delays all traffic, to show how
+their load time depends on the round-trip time (RTT) to the database, like
+the remote Azure host, and what pipeline mode saves.
+
+For each RTT a throwaway database is created on the server of <conninfo>
+(see run_benchmarks.scratch_database, a local Postgres, never the shared
+one). The first --rows rows of a synthetic HHS week and quality snapshot are
+then loaded through the proxy, once with the default inserts and once with
+pipeline=True. The round trips of each load are estimated from how much
+slower it gets per millisecond of RTT: the row-by-row HHS inserts cost about
+one per row, the pipelined ones about one per batch. tests/test_latency.py
+checks that much with the same proxy; this script is for the timings.
+
+    python benchmarks/bench_latency.py postgresql://localhost/postgres --rtt 0 5 20 --rows 1000
+"""
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import pandas as pd
+import psycopg
+from psycopg.conninfo import conninfo_to_dict, make_conninfo
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks import synthetic
+from benchmarks.run_benchmarks import scratch_database
+from load_hhs import load_hhs_data
+from load_quality import load_quality_data
+
+
+class DelayProxy:
+    """
+    TCP proxy running in a background thread, forwarding every connection
+    to the upstream server with half the round-trip time added in each
+    direction. Only latency is added: the bytes read in one go are forwarded
+    together once their delay has passed, in order.
+    """
+
+    def __init__(self, upstream, rtt_ms):
+        """
+        Parameters:
+        - upstream: (host, port) tuple, or path of a Unix socket
+        - rtt_ms: float, round-trip time to add in ms
+        """
+        self.upstream = upstream
+        self.delay = rtt_ms / 2000
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+
+    def __enter__(self):
+        started = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(started,), daemon=True)
+        self.thread.start()
+        started.wait()
+        return self
+
+    def __exit__(self, *exc_info):
+        asyncio.run_coroutine_threadsafe(self.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def run(self, started):
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, '127.0.0.1', 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        started.set()
+        self.loop.run_forever()
+        self.loop.close()
+
+    async def close(self):
+        """
+        Stop listening and drop the connections still open.
+        """
+        self.server.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def handle(self, client_reader, client_writer):
+        if isinstance(self.upstream, str):
+            server_reader, server_writer = await asyncio.open_unix_connection(self.upstream)
+        else:
+            server_reader, server_writer = await asyncio.open_connection(*self.upstream)
+        try:
+            await asyncio.gather(self.forward(client_reader, server_writer), self.forward(server_reader, client_writer))
+        except asyncio.CancelledError:
+            # Dropped by close
+            client_writer.close()
+            server_writer.close()
+
+    async def forward(self, reader, writer):
+        """
+        Copy reader to writer, each read being written self.delay seconds later.
+        """
+        queue = asyncio.Queue()
+
+        async def send():
+            while True:
+                due, data = await queue.get()
+                await asyncio.sleep(max(0.0, due - self.loop.time()))
+                if not data:
+                    writer.close()
+                    return
+                writer.write(data)
+                await writer.drain()
+
+        sender = asyncio.ensure_future(send())
+        while True:
+            try:
+                data = await reader.read(1 << 16)
+            except ConnectionError:
+                data = b''
+            queue.put_nowait((self.loop.time() + self.delay, data))
+            if not data:
+                break
+        await sender
+
+
+def upstream_address(conninfo):
+    """
+    Returns:
+    - (host, port) tuple, or the path of the Unix socket, of the server of conninfo
+    """
+    params = conninfo_to_dict(conninfo)
+    host = (params.get('host') or 'localhost').split(',')[0]
+    port = int((params.get('port') or '5432').split(',')[0])
+    if host.startswith('/'):
+        return os.path.join(host, f".s.PGSQL.{port}")
+    return host, port
+
+
+def sample_files(data_dir, n_rows, seed):
+    """
+    Write the first n_rows rows of a synthetic HHS week and quality snapshot.
+
+    Returns:
+    - str, path of the HHS file
+    - (date, path) of the quality file
+    """
+    files = synthetic.generate(data_dir, scale=1, weeks=1, snapshots=1, seed=seed)
+    (_, hhs_path, _), = files['hhs']
+    (date, quality_path, _), = files['quality']
+    for path in (hhs_path, quality_path):
+        pd.read_csv(path, dtype=object, nrows=n_rows).to_csv(path, index=False)
+    return hhs_path, (date, quality_path)
+
+
+def time_loads(conninfo, hhs_path, quality, pipeline, rejects_dir):
+    """
+    Load the HHS file, then the quality snapshot, through conninfo.
+
+    Returns:
+    - dict, loader name -> seconds, or None if the load failed
+    """
+    date, quality_path = quality
+    seconds = {}
+    with psycopg.connect(conninfo) as conn, contextlib.redirect_stdout(io.StringIO()):
+        for loader, load in (
+                ('hhs', lambda: load_hhs_data(hhs_path, conn, pipeline=pipeline,
+                                              rejects_path=os.path.join(rejects_dir, 'hhs.csv'))),
+                ('quality', lambda: load_quality_data(quality_path, conn, date.isoformat(), pipeline=pipeline,
+                                                      rejects_path=os.path.join(rejects_dir, 'quality.csv')))):
+            start_time = time.perf_counter()
+            result = load()
+            seconds[loader] = time.perf_counter() - start_time if result else None
+    return seconds
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time the loaders with and without pipeline mode at several RTTs.")
+    parser.add_argument("conninfo", help="connection string of a database on a server where scratch databases can be created")
+    parser.add_argument("--rtt", type=float, nargs="+", default=[0, 5, 20], help="round-trip times to add in ms (default 0 5 20)")
+    parser.add_argument("--rows", type=int, default=1000, help="rows of each file to load (default 1000)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the generated files")
+    args = parser.parse_args()
+
+    upstream = upstream_address(args.conninfo)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench_latency_") as data_dir:
+        hhs_path, quality = sample_files(data_dir, args.rows, args.seed)
+        for rtt in args.rtt:
+            for pipeline in (False, True):
+                mode = 'pipeline' if pipeline else 'default'
+                with scratch_database(args.conninfo, f"bench_latency_{os.getpid()}") as conninfo, \
+                        DelayProxy(upstream, rtt) as proxy:
+                    proxied = make_conninfo(conninfo, host='127.0.0.1', hostaddr='', port=proxy.port)
+                    for loader, seconds in time_loads(proxied, hhs_path, quality, pipeline, data_dir).items():
+                        results[loader, mode, rtt] = seconds
+                        print(f"{loader:<8} {mode:<9} RTT {rtt:>5.1f} ms: "
+                              + ("failed" if seconds is None else f"{seconds:.2f}s"))
+
+    # Extra seconds per ms of RTT, i.e. the number of round trips that wait on the network
+    print(f"\n{'loader':<9}{'mode':<10}" + ''.join(f"{f'{rtt:g} ms':>10}" for rtt in args.rtt) + f"{'round trips':>13}")
+    for loader in ('hhs', 'quality'):
+        for mode in ('default', 'pipeline'):
+            times = [results[loader, mode, rtt] for rtt in args.rtt]
+            line = f"{loader:<9}{mode:<10}" + ''.join(f"{'-' if t is None else f'{t:.2f}s':>10}" for t in times)
+            low, high = min(args.rtt), max(args.rtt)
+            if high > low and None not in times:
+                trips = (results[loader, mode, high] - results[loader, mode, low]) / ((high - low) / 1000)
+                line += f"{trips:>13.0f}"
+            print(line)
+    print(f"({args.rows} rows per file, round trips estimated from the slowest and fastest RTT)")
@@ -0,0 +1,134 @@
+"""
+Print the query plans of the loaders' lookups and the dashboard queries, to
+check that they are served by the indexes created in migrations.py.
+
+The sample parameters (latest week, a few hospitals, latest quality
+snapshot) are read from the database, so load some data first. Statistics
+are refreshed with ANALYZE before the plans are taken. Every statement runs
+in one transaction that is rolled back at the end, so --analyze (which
+executes the statements) leaves the data unchanged.
+
+Sequential scans are expected on small tables such as the rollups, and for
+the dashboard aggregates that read most of a table; the summary at the end
+is there to spot them on the lookups that should be selective:
+
+    python benchmarks/explain_queries.py <conninfo> [--analyze]
+
+tests/test_query_plans.py checks the indexes and rollups the plans use, with
+sequential scans turned off.
+"""
+import os
+import re
+import sys
+
+import psycopg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import report_queries
+from load_hhs import EXISTING_KEYS_QUERY
+from rollups import ROLLUP_TABLES, WEEKLY_ROLLUP_INSERT, STATE_ROLLUP_INSERT
+
+
+def sample_parameters(curr):
+    """
+    Pick realistic parameters for the queries from the loaded data.
+
+    Parameters:
+    - curr: psycopg cursor
+
+    Returns:
+    - dict, 'week', 'hospital_ids' (hospitals of that week), 'quality_date',
+      'facility_ids' (hospital ids of that snapshot) and 'ownership'
+    """
+    curr.execute("SELECT MAX(collection_week) FROM HospitalBedInformation")
+    week = curr.fetchone()[0]
+    curr.execute("SELECT hospital_id FROM HospitalBedInformation WHERE collection_week = %s LIMIT 100", (week,))
+    hospital_ids = [hospital_id for (hospital_id,) in curr.fetchall()]
+    curr.execute("SELECT MAX(data_date) FROM HospitalQualityInformation")
+    quality_date = curr.fetchone()[0]
+    curr.execute("SELECT hospital_id FROM HospitalQualityInformation WHERE data_date = %s LIMIT 100", (quality_date,))
+    facility_ids = [hospital_id for (hospital_id,) in curr.fetchall()]
+    curr.execute("SELECT hospital_ownership FROM HospitalQualityInformation WHERE hospital_ownership IS NOT NULL LIMIT 1")
+    row = curr.fetchone()
+    return {'week': week, 'hospital_ids': hospital_ids, 'quality_date': quality_date, 'facility_ids': facility_ids,
+            'ownership': row[0] if row else None}
+
+
+def queries(params):
+    """
+    Returns:
+    - list of (name, query, query parameters) tuples to explain
+    """
+    week = params['week']
+    facility_ids = params['facility_ids']
+    return [
+        # Loaders
+        ('load_hhs: existing keys', EXISTING_KEYS_QUERY, {'ids': params['hospital_ids'], 'weeks': [week]}),
+        ('load_hhs: refresh weekly rollup', WEEKLY_ROLLUP_INSERT, ([week],)),
+        ('load_hhs: refresh state rollup', STATE_ROLLUP_INSERT, ([week],)),
+        # Built the same way as check_duplicate_ids in load_quality.py
+        ('load_quality: duplicate ids',
+         "SELECT hospital_id FROM HospitalQualityInformation WHERE hospital_id = ANY(%s) AND data_date = %s",
+         (facility_ids, params['quality_date'])),
+        ('load_quality: close intervals',
+         "UPDATE HospitalQualityHistory SET valid_to = %s WHERE valid_to IS NULL AND hospital_id = ANY(%s)",
+         (params['quality_date'], facility_ids)),
+        # Dashboard
+        ('report: records at week', report_queries.RECORDS_AT_WEEK, (week,)),
+        ('report: records previous weeks', report_queries.RECORDS_PREVIOUS_WEEKS, (week,)),
+        ('report: bed statistics at week', report_queries.BED_STATISTICS_AT_WEEK, (week,)),
+        ('report: bed statistics recent weeks', report_queries.BED_STATISTICS_RECENT_WEEKS, ()),
+        ('report: quality ratings', report_queries.QUALITY_RATINGS, ()),
+        ('report: total bed usage', report_queries.TOTAL_BED_USAGE, (week,)),
+        ('report: emergency services by state', report_queries.EMERGENCY_SERVICES_BY_STATE, ()),
+        ('report: bed usage by ownership', report_queries.BED_USAGE_BY_OWNERSHIP, (params['ownership'],)),
+        ('report: state rating extremes', report_queries.STATE_RATING_EXTREMES, (params['quality_date'],)),
+        ('report: hospital points', report_queries.HOSPITAL_POINTS, ()),
+    ]
+
+
+def explain_all(conn, analyze=False):
+    """
+    Print the plan of every query and a summary of the scans it uses.
+
+    Parameters:
+    - conn: psycopg connection
+    - analyze: bool, run EXPLAIN ANALYZE instead of EXPLAIN (default is False)
+
+    Returns:
+    - list of (name, str list of sequential scans) tuples
+    """
+    summary = []
+    with conn.cursor() as curr:
+        curr.execute("ANALYZE")
+        params = sample_parameters(curr)
+        if analyze:
+            # The rollup inserts below are executed, so clear the rows they recompute
+            for table in ROLLUP_TABLES:
+                curr.execute(f"DELETE FROM {table} WHERE collection_week = %s", (params['week'],))
+        for name, query, query_params in queries(params):
+            curr.execute(f"EXPLAIN {'(ANALYZE, BUFFERS) ' if analyze else ''}{query}", query_params)
+            plan = [line for (line,) in curr.fetchall()]
+            print(f"=== {name}")
+            print("\n".join(plan))
+            print()
+            seq_scans = sorted(set(re.findall(r"Seq Scan on (\w+)", "\n".join(plan))))
+            summary.append((name, seq_scans))
+    conn.rollback()
+
+    print(f"{'query':<40}sequential scans")
+    for name, seq_scans in summary:
+        print(f"{name:<40}{', '.join(seq_scans) or '-'}")
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="EXPLAIN the loader and dashboard queries.")
+    parser.add_argument("conninfo", help="connection string of a database with data loaded")
+    parser.add_argument("--analyze", action="store_true", help="run EXPLAIN ANALYZE (rolled back afterwards)")
+    args = parser.parse_args()
+
+    with psycopg.connect(args.conninfo) as conn:
+        explain_all(conn, analyze=args.analyze)
@@ -0,0 +1,287 @@
+"""
+Check that checkpointed loads (see checkpoints.py) survive a dropped
+connection and end with the same rows as a load that was never interrupted.
+
+Synthetic files (see synthetic.py) are loaded into two throwaway databases
+on the server of <conninfo>: once plainly, and once with checkpoint=True
+while a second connection terminates the loading backend as soon as the
+given numbers of rows of a file are committed. With --before-checkpoint the
+backend is terminated instead when the loader is about to save the
+checkpoint reaching those rows, after the chunk's rows were written but
+before the checkpoint is. Each interrupted load is started again until it
+completes. The tables, the rejects files and the returned counts of the two
+runs are then compared, and the script exits with 1 if any differ:
+
+    python benchmarks/fault_injection.py postgresql://localhost/postgres --kill-after 1500 3500
+    python benchmarks/fault_injection.py postgresql://localhost/postgres --kill-after 1500 3500 --before-checkpoint
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import psycopg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import checkpoints
+import load_hhs
+import load_quality
+from benchmarks import synthetic
+from benchmarks.run_benchmarks import scratch_database
+from load_hhs import load_hhs_data
+from load_quality import load_quality_data
+
+# Tables compared between the runs, without their serial ids, which the
+# transactions rolled back by the interruptions leave gaps in. The hospital
+# ids the other tables store are compared as the CCNs they stand for, and
+# floating point columns are rounded, since the ids differ between the runs
+# and with them the order the rollups add up their rows in.
+COMPARED_TABLES = ('HospitalKeys', 'Hospitals', 'HospitalLocations', 'HospitalBedInformation', 'WeeklyBedRollup',
+                   'WeeklyStateBedRollup', 'HospitalQualityInformation', 'HospitalQualityHistory', 'QualitySnapshots')
+
+# Decimal places floating point columns are compared to
+FLOAT_DIGITS = 6
+
+# How often the killer polls the checkpoint of the load, in seconds
+POLL_SECONDS = 0.005
+
+# Longest wait for a terminated backend to exit, in milliseconds
+TERMINATE_TIMEOUT_MS = 5000
+
+# Loader modules whose save_checkpoint is wrapped with --before-checkpoint
+LOADER_MODULES = (load_hhs, load_quality)
+
+
+def table_digest(conn, table):
+    """
+    Returns:
+    - (int, str) tuple, number of rows and md5 of the sorted rows of a
+      table, leaving out its serial columns, with the CCN of each
+      hospital_id and floating point columns rounded to FLOAT_DIGITS
+    """
+    with conn.cursor() as curr:
+        curr.execute('''
+            SELECT column_name, data_type FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = lower(%s)
+              AND COALESCE(column_default, '') NOT LIKE 'nextval%%'
+            ORDER BY ordinal_position''', (table,))
+        columns = []
+        for column, data_type in curr.fetchall():
+            if column == 'hospital_id':
+                columns.append("(SELECT k.ccn FROM HospitalKeys k WHERE k.hospital_id = t.hospital_id)")
+            elif data_type in ('double precision', 'real'):
+                columns.append(f"round(t.{column}::numeric, {FLOAT_DIGITS})")
+            else:
+                columns.append(f"t.{column}")
+        columns = ', '.join(columns)
+        curr.execute(f'''
+            SELECT COUNT(*), md5(COALESCE(string_agg(row_text, E'\\n' ORDER BY row_text), ''))
+            FROM (SELECT ROW({columns})::text AS row_text FROM {table} t) AS rows''')
+        return curr.fetchone()
+
+
+class Killer(threading.Thread):
+    """
+    Terminates the backend of a load once its checkpoint reaches a row
+    count, from a connection of its own.
+    """
+
+    def __init__(self, conninfo, loader, backend_pid, rows):
+        super().__init__(daemon=True)
+        self.conninfo = conninfo
+        self.loader = loader
+        self.backend_pid = backend_pid
+        self.rows = rows
+        self.stopped = threading.Event()
+        self.killed_at = None
+
+    def run(self):
+        with psycopg.connect(self.conninfo, autocommit=True) as conn:
+            while not self.stopped.is_set():
+                row = conn.execute("SELECT rows_done FROM LoadCheckpoints WHERE loader = %s",
+                                   (self.loader,)).fetchone()
+                if row is not None and row[0] >= self.rows:
+                    conn.execute("SELECT pg_terminate_backend(%s)", (self.backend_pid,))
+                    self.killed_at = row[0]
+                    return
+                time.sleep(POLL_SECONDS)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class CheckpointKiller:
+    """
+    Terminates the backend of a load when the loader is about to save a
+    checkpoint reaching a row count, so the rows of the chunk are written
+    but neither they nor the checkpoint may be committed. The loaders'
+    save_checkpoint is wrapped between start and stop.
+    """
+
+    def __init__(self, conninfo, loader, backend_pid, rows):
+        self.conninfo = conninfo
+        self.loader = loader
+        self.backend_pid = backend_pid
+        self.rows = rows
+        self.killed_at = None
+
+    def save_checkpoint(self, curr, loader, content_hash, file_name, rows_done, options, state):
+        if self.killed_at is None and loader == self.loader and rows_done >= self.rows:
+            with psycopg.connect(self.conninfo, autocommit=True) as conn:
+                conn.execute("SELECT pg_terminate_backend(%s, %s)", (self.backend_pid, TERMINATE_TIMEOUT_MS))
+            self.killed_at = rows_done
+        checkpoints.save_checkpoint(curr, loader, content_hash, file_name, rows_done, options, state)
+
+    def start(self):
+        for module in LOADER_MODULES:
+            module.save_checkpoint = self.save_checkpoint
+
+    def stop(self):
+        for module in LOADER_MODULES:
+            module.save_checkpoint = checkpoints.save_checkpoint
+
+
+def load_file(conninfo, loader, load, kill_after=(), before_checkpoint=False):
+    """
+    Load a file, terminating the connection at each of the row counts of
+    kill_after and starting the load again on a new one.
+
+    Parameters:
+    - conninfo: str, connection string of the database
+    - loader: str, 'hhs' or 'quality', the name the load is checkpointed under
+    - load: function taking a connection and running the load
+    - kill_after: int list, row counts to interrupt the load at
+    - before_checkpoint: bool, interrupt the load right before it saves the
+      checkpoint reaching the row count instead of once it is committed
+      (default is False)
+
+    Returns:
+    - dict, the result of the load that completed
+    - int list, rows of the checkpoint when the load was interrupted
+    """
+    interruptions = []
+    pending = sorted(kill_after)
+    while True:
+        with psycopg.connect(conninfo) as conn:
+            killer = None
+            if pending:
+                killer = (CheckpointKiller if before_checkpoint else Killer)(conninfo, loader, conn.info.backend_pid,
+                                                                            pending.pop(0))
+                killer.start()
+            try:
+                result = load(conn)
+            except psycopg.OperationalError:
+                result = None
+            if killer is not None:
+                killer.stop()
+                if killer.killed_at is not None:
+                    interruptions.append(killer.killed_at)
+        if result is not None:
+            return result, interruptions
+        if killer is None or killer.killed_at is None:
+            raise RuntimeError(f"The {loader} load failed without being interrupted")
+
+
+def run(conninfo, files, work_dir, checkpoint, kill_after=(), chunksize=None, bulk=False, before_checkpoint=False):
+    """
+    Load the HHS files, then the quality snapshots, keeping each file's
+    rejects under work_dir.
+
+    Returns:
+    - dict, file -> (load result, rows committed at each interruption)
+    """
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for week, path, _ in files['hhs']:
+            rejects_path = os.path.join(work_dir, f"{os.path.basename(path)}.rejects")
+            results[path] = load_file(conninfo, 'hhs', lambda conn: load_hhs_data(
+                path, conn, bulk=bulk, chunksize=chunksize, rejects_path=rejects_path, checkpoint=checkpoint),
+                kill_after if checkpoint else (), before_checkpoint)
+        for date, path, _ in files['quality']:
+            rejects_path = os.path.join(work_dir, f"{os.path.basename(path)}.rejects")
+            results[path] = load_file(conninfo, 'quality', lambda conn: load_quality_data(
+                path, conn, date.isoformat(), rejects_path=rejects_path, checkpoint=checkpoint),
+                kill_after if checkpoint else (), before_checkpoint)
+    return results
+
+
+def compare(reference, interrupted):
+    """
+    Print the differences between the two runs.
+
+    Parameters:
+    - reference, interrupted: dict, 'conninfo', rejects 'dir' and 'results'
+      of a run
+
+    Returns:
+    - int, number of differences
+    """
+    differences = 0
+    with psycopg.connect(reference['conninfo']) as reference_conn, \
+            psycopg.connect(interrupted['conninfo']) as interrupted_conn:
+        for table in COMPARED_TABLES:
+            expected, actual = table_digest(reference_conn, table), table_digest(interrupted_conn, table)
+            same = expected == actual
+            differences += not same
+            print(f"{table:<30}{expected[0]:>10} rows  {'same' if same else f'DIFFERENT ({actual[0]} rows)'}")
+        n_checkpoints = interrupted_conn.execute("SELECT COUNT(*) FROM LoadCheckpoints").fetchone()[0]
+        if n_checkpoints:
+            print(f"{n_checkpoints} checkpoint(s) left in LoadCheckpoints")
+            differences += 1
+
+    for path, (expected, _) in reference['results'].items():
+        actual, interruptions = interrupted['results'][path]
+        name = os.path.basename(path)
+        if expected != actual:
+            print(f"{name}: returned {actual}, expected {expected}")
+            differences += 1
+        with open(os.path.join(reference['dir'], f"{name}.rejects"), 'rb') as f:
+            expected_rejects = f.read()
+        with open(os.path.join(interrupted['dir'], f"{name}.rejects"), 'rb') as f:
+            actual_rejects = f.read()
+        if expected_rejects != actual_rejects:
+            print(f"{name}: the rejects differ")
+            differences += 1
+        print(f"{name}: interrupted at {', '.join(map(str, interruptions)) or 'no'} checkpointed rows")
+    return differences
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Interrupt checkpointed loads and compare them with uninterrupted ones.")
+    parser.add_argument("conninfo", help="connection string of a database on a server where scratch databases can be created")
+    parser.add_argument("--kill-after", type=int, nargs="+", default=[1500, 3500],
+                        help="committed rows of each file to drop the connection at (default 1500 3500)")
+    parser.add_argument("--chunksize", type=int, help="stream the HHS files in chunks of this many rows")
+    parser.add_argument("--bulk", action="store_true", help="load the HHS files through COPY")
+    parser.add_argument("--before-checkpoint", action="store_true",
+                        help="drop the connection after a chunk's rows are written, before its checkpoint is")
+    parser.add_argument("--weeks", type=int, default=2, help="weekly HHS files (default 2)")
+    parser.add_argument("--snapshots", type=int, default=2, help="quality snapshots (default 2)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the generated files")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        files = synthetic.generate(os.path.join(work_dir, 'data'), weeks=args.weeks, snapshots=args.snapshots,
+                                   seed=args.seed)
+        with scratch_database(args.conninfo, "fault_injection_reference") as reference_conninfo, \
+                scratch_database(args.conninfo, "fault_injection_interrupted") as interrupted_conninfo:
+            runs = {}
+            for name, conninfo, checkpoint in (('reference', reference_conninfo, False),
+                                               ('interrupted', interrupted_conninfo, True)):
+                run_dir = os.path.join(work_dir, name)
+                os.makedirs(run_dir)
+                runs[name] = {'conninfo': conninfo, 'dir': run_dir,
+                              'results': run(conninfo, files, run_dir, checkpoint, args.kill_after,
+                                             args.chunksize, args.bulk, args.before_checkpoint)}
+            differences = compare(runs['reference'], runs['interrupted'])
+
+    if differences:
+        print(f"{differences} difference(s) between the interrupted and the uninterrupted loads")
+        sys.exit(1)
+    print("The interrupted loads match the uninterrupted ones.")
@@ -0,0 +1,294 @@
+"""
+Time the loaders and the dashboard queries on synthetic data (see
+synthetic.py) and save the results as JSON, so runs can be compared and
+regressions caught.
+
+For each scale a throwaway database is created on the server of <conninfo>,
+which must allow CREATE DATABASE (e.g. a local Postgres, never the shared
+one), migrated, loaded with load_hhs_data and load_quality_data, queried
+with every report_queries.py query, and dropped at the end. The results
+hold rows/sec of each load, p50/p95 latency of each query and the peak RSS
+of each phase:
+
+    python benchmarks/run_benchmarks.py postgresql://localhost/postgres --scale 1 10 100
+    python benchmarks/run_benchmarks.py postgresql://localhost/postgres --compare benchmarks/results/<baseline>.json
+"""
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import psycopg
+from psycopg.conninfo import make_conninfo
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks import synthetic
+from benchmarks.explain_queries import sample_parameters, queries
+from instrumentation import reset_peak_rss, peak_rss_mb
+from load_hhs import load_hhs_data
+from load_quality import load_quality_data
+from migrations import migrate
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Latency changes smaller than this are noise for the queries served by the
+# rollups, which take a fraction of a millisecond, and never flagged by compare
+LATENCY_FLOOR_MS = 1.0
+
+
+@contextlib.contextmanager
+def scratch_database(admin_conninfo, name, keep=False):
+    """
+    Create an empty, migrated database and drop it afterwards.
+
+    Parameters:
+    - admin_conninfo: str, connection string of a database on the same server
+    - name: str, name of the database to create
+    - keep: bool, leave the database in place for inspection (default is False)
+
+    Yields:
+    - str, connection string of the new database
+    """
+    with psycopg.connect(admin_conninfo, autocommit=True) as admin:
+        admin.execute(f"DROP DATABASE IF EXISTS {name}")
+        admin.execute(f"CREATE DATABASE {name}")
+    conninfo = make_conninfo(admin_conninfo, dbname=name)
+    try:
+        with psycopg.connect(conninfo) as conn, contextlib.redirect_stdout(io.StringIO()):
+            migrate(conn)
+        yield conninfo
+    finally:
+        if not keep:
+            with psycopg.connect(admin_conninfo, autocommit=True) as admin:
+                admin.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+
+
+def time_loads(conn, files, load, verbose=False):
+    """
+    Load files one after the other and time each load.
+
+    Parameters:
+    - conn: psycopg connection
+    - files: list of (date, path, rows) tuples from synthetic.generate
+    - load: function taking (date, path) and loading the file through conn
+    - verbose: bool, show the loaders' output (default is False)
+
+    Returns:
+    - dict, per-file results and their 'total'
+    """
+    results = []
+    for date, path, n_rows in files:
+        reset_peak_rss()
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+            outcome = load(date, path)
+        elapsed = time.perf_counter() - start_time
+        results.append({
+            'file': os.path.basename(path),
+            'rows': n_rows,
+            'inserted': outcome['inserted'] if outcome else None,
+            'failed': outcome is None,
+            'seconds': round(elapsed, 3),
+            'rows_per_sec': round(n_rows / elapsed, 1),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        })
+    n_rows = sum(result['rows'] for result in results)
+    seconds = sum(result['seconds'] for result in results)
+    return {
+        'files': results,
+        'total': {
+            'rows': n_rows,
+            'seconds': round(seconds, 3),
+            'rows_per_sec': round(n_rows / seconds, 1) if seconds else None,
+            'peak_rss_mb': max((result['peak_rss_mb'] for result in results), default=None),
+        },
+    }
+
+
+def time_queries(conn, repeat):
+    """
+    Run each dashboard query repeat times, after one untimed run to warm the
+    caches, and summarize its latency.
+
+    Parameters:
+    - conn: psycopg connection
+    - repeat: int, timed runs per query
+
+    Returns:
+    - dict, query name -> rows returned, p50, p95 and max latency in ms
+    """
+    results = {}
+    with conn.cursor() as curr:
+        curr.execute("ANALYZE")
+        params = sample_parameters(curr)
+        for name, query, query_params in queries(params):
+            if not name.startswith('report: '):
+                continue
+            reset_peak_rss()
+            curr.execute(query, query_params)
+            n_rows = len(curr.fetchall())
+            latencies = []
+            for _ in range(repeat):
+                start_time = time.perf_counter()
+                curr.execute(query, query_params)
+                curr.fetchall()
+                latencies.append((time.perf_counter() - start_time) * 1000)
+            results[name[len('report: '):]] = {
+                'rows': n_rows,
+                'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+                'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+                'max_ms': round(max(latencies), 3),
+                'peak_rss_mb': round(peak_rss_mb(), 1),
+            }
+    conn.rollback()
+    return results
+
+
+def run_scale(admin_conninfo, scale, args):
+    """
+    Generate the files of one scale, and time their loads and the dashboard
+    queries in a scratch database.
+
+    Returns:
+    - dict, results of the scale
+    """
+    with tempfile.TemporaryDirectory(prefix=f"bench_{scale}x_") as data_dir:
+        start_time = time.perf_counter()
+        files = synthetic.generate(data_dir, scale=scale, weeks=args.weeks, snapshots=args.snapshots,
+                                   sentinel_rate=args.sentinel_rate, negative_rate=args.negative_rate,
+                                   duplicate_rate=args.duplicate_rate, seed=args.seed)
+        print(f"scale {scale}x: generated {files['hospitals']} hospitals in {time.perf_counter() - start_time:.1f}s")
+
+        rejects_dir = os.path.join(data_dir, 'rejects')
+        os.makedirs(rejects_dir)
+        with scratch_database(admin_conninfo, f"bench_{scale}x_{os.getpid()}", args.keep) as conninfo, \
+                psycopg.connect(conninfo) as conn:
+            hhs = time_loads(conn, files['hhs'], lambda week, path: load_hhs_data(
+                path, conn, bulk=args.bulk, chunksize=args.chunksize,
+                rejects_path=os.path.join(rejects_dir, 'hhs.csv')), args.verbose)
+            print(f"scale {scale}x: HHS loads {hhs['total']['rows_per_sec']:.0f} rows/sec")
+            quality = time_loads(conn, files['quality'], lambda date, path: load_quality_data(
+                path, conn, date.isoformat(), rejects_path=os.path.join(rejects_dir, 'quality.csv')), args.verbose)
+            print(f"scale {scale}x: quality loads {quality['total']['rows_per_sec']:.0f} rows/sec")
+            report = time_queries(conn, args.repeat)
+            print(f"scale {scale}x: {len(report)} queries timed")
+
+    return {'hospitals': files['hospitals'], 'hhs_load': hhs, 'quality_load': quality, 'queries': report}
+
+
+def environment(conninfo):
+    """
+    Returns:
+    - dict, versions and settings the results depend on
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(RESULTS_DIR)).stdout.strip() or None
+    except OSError:
+        commit = None
+    with psycopg.connect(conninfo) as conn:
+        server_version = conn.execute("SHOW server_version").fetchone()[0]
+    return {'git_commit': commit, 'python': platform.python_version(), 'postgres': server_version,
+            'machine': platform.machine(), 'cpus': os.cpu_count()}
+
+
+def compare(baseline, results, threshold):
+    """
+    Print the change of every metric against a previous run and flag the
+    ones worse by more than threshold.
+
+    Parameters:
+    - baseline: dict, results of the previous run
+    - results: dict, results of this run
+    - threshold: float, relative change counted as a regression, e.g. 0.2
+
+    Returns:
+    - int, number of regressions
+    """
+    metrics = []
+    for scale, current in results['scales'].items():
+        previous = baseline['scales'].get(scale)
+        if previous is None:
+            continue
+        for load in ('hhs_load', 'quality_load'):
+            # Lower throughput is worse, hence the inverted ratio
+            metrics.append((f"{scale}x {load} rows/sec", previous[load]['total']['rows_per_sec'],
+                            current[load]['total']['rows_per_sec'], True))
+            metrics.append((f"{scale}x {load} peak RSS MB", previous[load]['total']['peak_rss_mb'],
+                            current[load]['total']['peak_rss_mb'], False))
+        for name, timing in current['queries'].items():
+            if name in previous['queries']:
+                metrics.append((f"{scale}x {name} p95 ms", previous['queries'][name]['p95_ms'], timing['p95_ms'], False))
+
+    regressions = 0
+    print(f"\n{'metric':<55}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name, before, after, higher_is_better in metrics:
+        if not before or after is None:
+            continue
+        change = after / before - 1
+        worse = -change if higher_is_better else change
+        noise = name.endswith(' ms') and after - before < LATENCY_FLOOR_MS
+        flag = ' REGRESSION' if worse > threshold and not noise else ''
+        regressions += bool(flag)
+        print(f"{name:<55}{before:>12.1f}{after:>12.1f}{change:>+9.0%}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the loaders and dashboard queries on synthetic data.")
+    parser.add_argument("conninfo", help="connection string of a database on a server where scratch databases can be created")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1], help="scales to run, e.g. 1 10 100 (default 1)")
+    parser.add_argument("--weeks", type=int, default=2, help="weekly HHS files per scale (default 2)")
+    parser.add_argument("--snapshots", type=int, default=2, help="quality snapshots per scale (default 2)")
+    parser.add_argument("--sentinel-rate", type=float, default=0.02, help="share of -999999 / 'Not Available' values")
+    parser.add_argument("--negative-rate", type=float, default=0.01, help="share of rows with a negative value")
+    parser.add_argument("--duplicate-rate", type=float, default=0.01, help="share of rows written twice")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the generated files")
+    parser.add_argument("--bulk", action="store_true", help="load the HHS files through COPY")
+    parser.add_argument("--chunksize", type=int, help="stream the HHS files in chunks of this many rows")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs of each query (default 20)")
+    parser.add_argument("--output", help="JSON file to write (default is benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON file of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative change counted as a regression by --compare (default 0.2)")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch databases")
+    parser.add_argument("--verbose", action="store_true", help="show the loaders' output")
+    args = parser.parse_args()
+
+    created = datetime.datetime.now()
+    results = {
+        'created': created.isoformat(timespec='seconds'),
+        'environment': environment(args.conninfo),
+        'settings': {key: value for key, value in vars(args).items()
+                     if key not in ('conninfo', 'output', 'compare', 'threshold', 'keep', 'verbose')},
+        'scales': {},
+    }
+    for scale in args.scale:
+        results['scales'][str(scale)] = run_scale(args.conninfo, scale, args)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{created:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    print(f"\n{'scale':<7}{'query':<32}{'p50 ms':>10}{'p95 ms':>10}")
+    for scale, scale_results in results['scales'].items():
+        for name, timing in scale_results['queries'].items():
+            print(f"{scale + 'x':<7}{name:<32}{timing['p50_ms']:>10.2f}{timing['p95_ms']:>10.2f}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print(f"{regressions} regression(s) above {args.threshold:.0%}")
+            sys.exit(1)
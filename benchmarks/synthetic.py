@@ -0,0 +1,318 @@
+"""
+Generate synthetic HHS weekly files and CMS Hospital General Information
+files for the benchmarks. The headers are read from the real files in
+hhs_data/ and hospital_data/, and a configurable share of the rows carries
+the -999999 sentinel, negative values or duplicate keys, so every loader
+path gets exercised.
+
+Scale 1 has as many hospitals as a real weekly file (BASE_HOSPITALS), scale
+10 and 100 ten and a hundred times more. The files are written in chunks, so
+memory stays flat at any scale, and the same seed always gives the same files:
+
+    python benchmarks/synthetic.py <output_dir> --scale 10 --weeks 4 --snapshots 2
+"""
+import csv
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Real files whose headers the generated files copy
+HHS_TEMPLATE = os.path.join(REPO_DIR, 'hhs_data', '2022-09-23-hhs-data.csv')
+QUALITY_TEMPLATE = os.path.join(REPO_DIR, 'hospital_data', 'Hospital_General_Information-2022-10.csv')
+
+# Hospitals at scale 1, about the number of rows of a real weekly file
+BASE_HOSPITALS = 5000
+
+# Rows generated and written at a time
+CHUNK_ROWS = 50000
+
+FIRST_WEEK = datetime.date(2022, 9, 23)
+FIRST_SNAPSHOT = datetime.date(2022, 1, 1)
+SENTINEL = -999999
+
+STATES = [
+    'AK', 'AL', 'AR', 'AZ', 'CA', 'CO', 'CT', 'DC', 'DE', 'FL', 'GA', 'HI', 'IA', 'ID', 'IL', 'IN', 'KS', 'KY',
+    'LA', 'MA', 'MD', 'ME', 'MI', 'MN', 'MO', 'MS', 'MT', 'NC', 'ND', 'NE', 'NH', 'NJ', 'NM', 'NV', 'NY', 'OH',
+    'OK', 'OR', 'PA', 'PR', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VA', 'VT', 'WA', 'WI', 'WV', 'WY',
+]
+HOSPITAL_TYPES = ['Acute Care Hospitals', 'Critical Access Hospitals', 'Psychiatric', 'Childrens',
+                  'Acute Care - Department of Defense']
+HOSPITAL_OWNERSHIPS = [
+    'Voluntary non-profit - Private', 'Proprietary', 'Government - Hospital District or Authority',
+    'Government - Local', 'Voluntary non-profit - Other', 'Voluntary non-profit - Church', 'Government - State',
+    'Physician', 'Government - Federal', 'Department of Defense', 'Tribal',
+]
+
+# Bed metrics read by load_hhs.py, one of which is made negative in the
+# rows picked by negative_rate
+LOADED_BED_COLUMNS = [
+    'all_adult_hospital_beds_7_day_avg', 'all_pediatric_inpatient_beds_7_day_avg',
+    'all_adult_hospital_inpatient_bed_occupied_7_day_coverage', 'all_pediatric_inpatient_bed_occupied_7_day_avg',
+    'total_icu_beds_7_day_avg', 'icu_beds_used_7_day_avg', 'inpatient_beds_used_covid_7_day_avg',
+    'staffed_icu_adult_patients_confirmed_covid_7_day_avg'
+]
+
+
+def read_header(path):
+    """
+    Returns:
+    - str list, column names of a CSV file
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        return next(csv.reader(f))
+
+
+def generate_hospitals(n_hospitals, seed=0):
+    """
+    Draw the hospitals shared by every generated file.
+
+    Parameters:
+    - n_hospitals: int, number of hospitals
+    - seed: int, random seed (default is 0)
+
+    Returns:
+    - pandas df, one row per hospital with its key, address, location,
+      number of beds and quality attributes
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.arange(n_hospitals)
+    longitude = rng.uniform(-124, -67, n_hospitals).round(6)
+    latitude = rng.uniform(25, 49, n_hospitals).round(6)
+    return pd.DataFrame({
+        'hospital_pk': [f"{10001 + i:06d}" for i in ids],
+        'hospital_name': [f"SYNTHETIC HOSPITAL {i}" for i in ids],
+        'address': [f"{100 + i % 9000} MAIN STREET" for i in ids],
+        'city': [f"CITY {i % 997}" for i in ids],
+        'state': rng.choice(STATES, n_hospitals),
+        'zip': [f"{z:05d}" for z in rng.integers(1000, 99999, n_hospitals)],
+        'fips_code': [f"{f:05d}" for f in rng.integers(1001, 56045, n_hospitals)],
+        'geocoded_hospital_address': [f"POINT ({lon} {lat})" for lon, lat in zip(longitude, latitude)],
+        'beds': rng.integers(10, 800, n_hospitals),
+        'hospital_type': rng.choice(HOSPITAL_TYPES, n_hospitals),
+        'hospital_ownership': rng.choice(HOSPITAL_OWNERSHIPS, n_hospitals),
+        'emergency_services': rng.choice(['Yes', 'No'], n_hospitals, p=[0.8, 0.2]),
+        'rating': rng.integers(1, 6, n_hospitals),
+    })
+
+
+def add_duplicates(df, rng, duplicate_rate):
+    """
+    Append copies of a random share of the rows, which the loaders must
+    reject as duplicate keys.
+
+    Returns:
+    - pandas df, df followed by the copies
+    """
+    copies = df[rng.random(len(df)) < duplicate_rate]
+    return pd.concat([df, copies], ignore_index=True) if len(copies) else df
+
+
+def hhs_chunk(hospitals, week, header, rng, sentinel_rate, negative_rate, duplicate_rate):
+    """
+    Build the rows of one chunk of hospitals for a weekly HHS file.
+
+    Parameters:
+    - hospitals: pandas df, rows of generate_hospitals
+    - week: date, collection week
+    - header: str list, columns of the HHS file
+    - rng: numpy Generator
+    - sentinel_rate: float, share of the numeric values replaced by -999999
+    - negative_rate: float, share of the rows with a negative bed metric
+    - duplicate_rate: float, share of the rows written twice
+
+    Returns:
+    - pandas df, rows with the columns of header
+    """
+    n = len(hospitals)
+    beds = hospitals['beds'].to_numpy()
+    data = {
+        'hospital_pk': hospitals['hospital_pk'].to_numpy(),
+        'collection_week': week.isoformat(),
+        'state': hospitals['state'].to_numpy(),
+        'ccn': hospitals['hospital_pk'].to_numpy(),
+        'hospital_name': hospitals['hospital_name'].to_numpy(),
+        'address': hospitals['address'].to_numpy(),
+        'city': hospitals['city'].to_numpy(),
+        'zip': hospitals['zip'].to_numpy(),
+        'hospital_subtype': np.where(beds < 25, 'Critical Access Hospitals', 'Short Term'),
+        'fips_code': hospitals['fips_code'].to_numpy(),
+        'is_metro_micro': np.where(beds < 25, 'FALSE', 'TRUE'),
+        'geocoded_hospital_address': hospitals['geocoded_hospital_address'].to_numpy(),
+        'hhs_ids': [f"[C{pk}-A]" for pk in hospitals['hospital_pk']],
+    }
+
+    # Averages scaled to the hospital's beds, sums over the 7 days, coverage in days
+    numeric = [column for column in header if column not in data and column.endswith(('_avg', '_sum', '_coverage'))]
+    values = (rng.random((n, len(numeric))) * beds[:, None]).round(1)
+    for j, column in enumerate(numeric):
+        if column.endswith('_sum'):
+            values[:, j] = (values[:, j] * 7).round()
+        elif column.endswith('_coverage'):
+            values[:, j] = 7
+    values[rng.random(values.shape) < sentinel_rate] = SENTINEL
+
+    negative_rows = np.flatnonzero(rng.random(n) < negative_rate)
+    negative_columns = [numeric.index(column) for column in LOADED_BED_COLUMNS if column in numeric]
+    if len(negative_rows) and negative_columns:
+        picked = rng.choice(negative_columns, len(negative_rows))
+        values[negative_rows, picked] = -rng.integers(1, 100, len(negative_rows))
+
+    data.update(zip(numeric, values.T))
+    df = pd.DataFrame(data).reindex(columns=header)
+    return add_duplicates(df, rng, duplicate_rate)
+
+
+def add_quality_history(hospitals, snapshots, rng, change_rate):
+    """
+    Draw the rating and ownership of every hospital at each snapshot, each
+    snapshot changing those of change_rate of the hospitals, and add them as
+    rating_<snapshot> and ownership_<snapshot> columns.
+    """
+    rating = hospitals['rating'].to_numpy().copy()
+    ownership = hospitals['hospital_ownership'].to_numpy().copy()
+    for snapshot in range(snapshots):
+        if snapshot > 0:
+            changed = rng.random(len(hospitals)) < change_rate
+            rating[changed] = rng.integers(1, 6, changed.sum())
+            ownership[changed] = rng.choice(HOSPITAL_OWNERSHIPS, changed.sum())
+        hospitals[f'rating_{snapshot}'] = rating.copy()
+        hospitals[f'ownership_{snapshot}'] = ownership.copy()
+
+
+def quality_chunk(hospitals, snapshot, header, rng, sentinel_rate, negative_rate, duplicate_rate):
+    """
+    Build the rows of one chunk of hospitals for a Hospital General
+    Information file.
+
+    Parameters:
+    - hospitals: pandas df, rows of generate_hospitals with the columns of
+      add_quality_history
+    - snapshot: int, number of the snapshot, 0 for the first
+    - header: str list, columns of the quality file
+    - rng: numpy Generator
+    - sentinel_rate: float, share of the ratings written as 'Not Available'
+    - negative_rate: float, share of the rows with a negative rating
+    - duplicate_rate: float, share of the rows written twice
+
+    Returns:
+    - pandas df, rows with the columns of header
+    """
+    n = len(hospitals)
+    rating = hospitals[f'rating_{snapshot}'].to_numpy().astype(object)
+    rating[rng.random(n) < sentinel_rate] = 'Not Available'
+    negative = rng.random(n) < negative_rate
+    rating[negative] = -rng.integers(1, 6, negative.sum())
+
+    data = {
+        'Facility ID': hospitals['hospital_pk'].to_numpy(),
+        'Facility Name': hospitals['hospital_name'].to_numpy(),
+        'Address': hospitals['address'].to_numpy(),
+        'City': hospitals['city'].to_numpy(),
+        'State': hospitals['state'].to_numpy(),
+        'ZIP Code': hospitals['zip'].to_numpy(),
+        'County Name': 'SYNTHETIC',
+        'Phone Number': '(555) 555-0100',
+        'Hospital Type': hospitals['hospital_type'].to_numpy(),
+        'Hospital Ownership': hospitals[f'ownership_{snapshot}'].to_numpy(),
+        'Emergency Services': hospitals['emergency_services'].to_numpy(),
+        'Meets criteria for promoting interoperability of EHRs': 'Y',
+        'Hospital overall rating': rating,
+    }
+    df = pd.DataFrame(data).reindex(columns=header)
+    return add_duplicates(df, rng, duplicate_rate)
+
+
+def write_chunks(path, hospitals, build_chunk):
+    """
+    Write a CSV file chunk by chunk.
+
+    Parameters:
+    - path: str, file to write
+    - hospitals: pandas df, rows of generate_hospitals
+    - build_chunk: function taking a slice of hospitals and returning the
+      rows to write for it
+
+    Returns:
+    - int, number of rows written
+    """
+    n_rows = 0
+    for start in range(0, len(hospitals), CHUNK_ROWS):
+        df = build_chunk(hospitals.iloc[start:start + CHUNK_ROWS])
+        df.to_csv(path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+        n_rows += len(df)
+    return n_rows
+
+
+def generate(output_dir, scale=1, weeks=2, snapshots=2, sentinel_rate=0.02, negative_rate=0.01,
+             duplicate_rate=0.01, change_rate=0.1, seed=0):
+    """
+    Write the weekly HHS files and quality snapshots of one scale, named like
+    the real files so backfill.py can read their dates.
+
+    Parameters:
+    - output_dir: str, directory to write the files to (created if needed)
+    - scale: int, multiple of BASE_HOSPITALS hospitals (default is 1)
+    - weeks: int, number of weekly HHS files, from FIRST_WEEK (default is 2)
+    - snapshots: int, number of quality snapshots, three months apart from
+      FIRST_SNAPSHOT (default is 2)
+    - sentinel_rate: float, share of -999999 / 'Not Available' values (default is 0.02)
+    - negative_rate: float, share of rows with a negative value (default is 0.01)
+    - duplicate_rate: float, share of rows written twice (default is 0.01)
+    - change_rate: float, share of hospitals whose quality attributes change
+      at each snapshot (default is 0.1)
+    - seed: int, random seed (default is 0)
+
+    Returns:
+    - dict, 'hospitals' count, and 'hhs' and 'quality' lists of
+      (date, path, rows) tuples in date order
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    hospitals = generate_hospitals(BASE_HOSPITALS * scale, seed)
+    rng = np.random.default_rng(seed + 1)
+
+    hhs_header = read_header(HHS_TEMPLATE)
+    hhs_files = []
+    for i in range(weeks):
+        week = FIRST_WEEK + datetime.timedelta(weeks=i)
+        path = os.path.join(output_dir, f"{week.isoformat()}-hhs-data.csv")
+        n_rows = write_chunks(path, hospitals, lambda chunk: hhs_chunk(
+            chunk, week, hhs_header, rng, sentinel_rate, negative_rate, duplicate_rate))
+        hhs_files.append((week, path, n_rows))
+
+    quality_header = read_header(QUALITY_TEMPLATE)
+    add_quality_history(hospitals, snapshots, rng, change_rate)
+    quality_files = []
+    for i in range(snapshots):
+        month = FIRST_SNAPSHOT.month - 1 + 3 * i
+        date = FIRST_SNAPSHOT.replace(year=FIRST_SNAPSHOT.year + month // 12, month=month % 12 + 1)
+        path = os.path.join(output_dir, f"Hospital_General_Information-{date:%Y-%m}.csv")
+        n_rows = write_chunks(path, hospitals, lambda chunk: quality_chunk(
+            chunk, i, quality_header, rng, sentinel_rate, negative_rate, duplicate_rate))
+        quality_files.append((date, path, n_rows))
+
+    return {'hospitals': len(hospitals), 'hhs': hhs_files, 'quality': quality_files}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate synthetic HHS and CMS quality files.")
+    parser.add_argument("output_dir", help="directory to write the files to")
+    parser.add_argument("--scale", type=int, default=1, help="multiple of the hospitals of a real file (default 1)")
+    parser.add_argument("--weeks", type=int, default=2, help="number of weekly HHS files (default 2)")
+    parser.add_argument("--snapshots", type=int, default=2, help="number of quality snapshots (default 2)")
+    parser.add_argument("--sentinel-rate", type=float, default=0.02, help="share of -999999 / 'Not Available' values")
+    parser.add_argument("--negative-rate", type=float, default=0.01, help="share of rows with a negative value")
+    parser.add_argument("--duplicate-rate", type=float, default=0.01, help="share of rows written twice")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    files = generate(args.output_dir, scale=args.scale, weeks=args.weeks, snapshots=args.snapshots,
+                     sentinel_rate=args.sentinel_rate, negative_rate=args.negative_rate,
+                     duplicate_rate=args.duplicate_rate, seed=args.seed)
+    for date, path, n_rows in files['hhs'] + files['quality']:
+        print(f"{path}: {n_rows} rows")
@@ -0,0 +1,131 @@
+import psycopg
+from psycopg.types.json import Jsonb
+
+from db import get_conninfo
+
+
+# Checkpointed loads commit a file in bounded chunks instead of one
+# transaction. With each chunk they save, in the same transaction, how far
+# into the file they got and their running state in LoadCheckpoints (see
+# migration 11 in migrations.py), keyed by the loader and the file's content
+# hash (see parse_cache.content_hash). Loading the same content again resumes
+# after the last committed chunk, under any file name. The final transaction
+# of the load deletes its checkpoint.
+
+
+def read_checkpoint(curr, loader, content_hash, options):
+    """
+    Look up the checkpoint of an interrupted load of a file.
+
+    Parameters:
+    - curr: psycopg cursor
+    - loader: str, name of the loader, e.g. 'hhs' or 'quality'
+    - content_hash: str, sha1 of the file's content
+    - options: dict, the load options that change what is written, which
+      must match those the checkpoint was saved with
+
+    Returns:
+    - (int, dict) tuple, number of rows of the file already committed and
+      the state saved with them, or None if there is no checkpoint
+
+    Raises:
+    - ValueError: If the checkpoint was saved by a load with other options
+    """
+    curr.execute("SELECT rows_done, state FROM LoadCheckpoints WHERE loader = %s AND content_hash = %s",
+                 (loader, content_hash))
+    row = curr.fetchone()
+    if row is None:
+        return None
+    rows_done, state = row
+    if state.get('options') != options:
+        raise ValueError(f"The checkpoint of this file was saved with the options {state.get('options')}, not "
+                         f"{options}; resume with those or discard it with python checkpoints.py --discard "
+                         f"{loader} {content_hash}")
+    return rows_done, state
+
+
+def save_checkpoint(curr, loader, content_hash, file_name, rows_done, options, state):
+    """
+    Record how far a load got. Call inside the transaction of the chunk it
+    describes, right before its commit.
+
+    Parameters:
+    - curr: psycopg cursor
+    - loader: str, name of the loader
+    - content_hash: str, sha1 of the file's content
+    - file_name: str, loaded file
+    - rows_done: int, number of rows of the file committed with this chunk
+    - options: dict, the load options (see read_checkpoint)
+    - state: dict, JSON-serializable running state of the loader
+    """
+    curr.execute('''
+        INSERT INTO LoadCheckpoints (loader, content_hash, file_name, rows_done, state)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (loader, content_hash) DO UPDATE
+        SET file_name = EXCLUDED.file_name, rows_done = EXCLUDED.rows_done, state = EXCLUDED.state,
+            updated_at = CURRENT_TIMESTAMP''',
+                 (loader, content_hash, file_name, rows_done, Jsonb(dict(state, options=options))))
+
+
+def clear_checkpoint(curr, loader, content_hash):
+    """
+    Delete the checkpoint of a load, in its final transaction.
+    """
+    curr.execute("DELETE FROM LoadCheckpoints WHERE loader = %s AND content_hash = %s", (loader, content_hash))
+
+
+def discard_checkpoint(conn, loader, content_hash):
+    """
+    Give up on an interrupted load: drop the staging tables it created and
+    delete its checkpoint, so loading the file starts over. The chunks it
+    committed to other tables stay.
+
+    Parameters:
+    - conn: psycopg connection
+    - loader: str, name of the loader
+    - content_hash: str, sha1 of the file's content
+    """
+    with conn.cursor() as curr:
+        curr.execute("SELECT state FROM LoadCheckpoints WHERE loader = %s AND content_hash = %s",
+                     (loader, content_hash))
+        row = curr.fetchone()
+        if row is None:
+            print(f"No checkpoint for {loader} {content_hash}.")
+            return
+        for staging in row[0].get('staging_tables', {}).values():
+            curr.execute(f"DROP TABLE IF EXISTS {staging}")
+        clear_checkpoint(curr, loader, content_hash)
+    conn.commit()
+    print(f"Discarded the checkpoint of {loader} {content_hash}.")
+
+
+def list_checkpoints(curr):
+    """
+    Returns:
+    - list of (loader, content hash, file name, rows done, updated at)
+      tuples, oldest first
+    """
+    curr.execute('''
+        SELECT loader, content_hash, file_name, rows_done, updated_at
+        FROM LoadCheckpoints ORDER BY started_at''')
+    return curr.fetchall()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="List or discard the checkpoints of interrupted loads.")
+    parser.add_argument("--discard", nargs=2, metavar=("LOADER", "CONTENT_HASH"),
+                        help="drop the staging tables and the checkpoint of an interrupted load")
+    args = parser.parse_args()
+
+    with psycopg.connect(get_conninfo()) as conn:
+        if args.discard:
+            discard_checkpoint(conn, *args.discard)
+        else:
+            with conn.cursor() as curr:
+                checkpoints = list_checkpoints(curr)
+            if not checkpoints:
+                print("No interrupted loads.")
+            for loader, content_hash, file_name, rows_done, updated_at in checkpoints:
+                print(f"{loader:<10}{content_hash}  {rows_done:>8} rows  {updated_at:%Y-%m-%d %H:%M:%S}  {file_name}")
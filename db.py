@@ -0,0 +1,146 @@
+import contextlib
+import logging
+import os
+
+import psycopg
+from psycopg.conninfo import make_conninfo
+
+
+# Module logger, so logging from the HHS loader does not configure the root logger
+logger = logging.getLogger(__name__)
+
+# Shared team database; DATABASE_URL points the scripts at another one (e.g. a local Postgres)
+DB_HOST = "pinniped.postgres.database.azure.com"
+
+
+def get_conninfo():
+    """
+    Build the connection string used by the loaders and the dashboard.
+
+    Returns:
+    - str, the DATABASE_URL environment variable if it is set, otherwise the
+      shared database with the credentials from credentials.py
+    """
+    if os.environ.get("DATABASE_URL"):
+        return os.environ["DATABASE_URL"]
+
+    from credentials import DB_USER, DB_PASSWORD
+    return make_conninfo(host=DB_HOST, dbname=DB_USER, user=DB_USER, password=DB_PASSWORD)
+
+
+def record_ingest(curr, loader, file_name, rows_inserted):
+    """
+    Log a load in IngestLog. Call inside the load's transaction, right before
+    the commit, so that caches keyed on the load version (see
+    current_load_version) are invalidated exactly when the new rows become visible.
+
+    Parameters:
+    - curr: psycopg cursor
+    - loader: str, name of the loader, e.g. 'hhs' or 'quality'
+    - file_name: str, loaded file
+    - rows_inserted: int, number of rows the load inserted
+    """
+    curr.execute("INSERT INTO IngestLog (loader, file_name, rows_inserted) VALUES (%s, %s, %s)",
+                 (loader, file_name, rows_inserted))
+
+
+def lock_hospitals(curr):
+    """
+    Take, until the end of the transaction, the lock serializing the writes
+    that lock Hospitals in concurrent loads: the dimension upserts, and the
+    partition attaches, whose foreign key check blocks writes to Hospitals.
+    Without it a load upserting hospitals and a load attaching a week each
+    wait for the other.
+
+    Parameters:
+    - curr: psycopg cursor
+    """
+    curr.execute("SELECT pg_advisory_xact_lock(hashtext('Hospitals'))")
+
+
+def current_load_version(curr):
+    """
+    Returns:
+    - int, number of committed loads. Unlike MAX(ingest_id), it moves on
+      every commit even when concurrent loads commit out of id order.
+    """
+    curr.execute("SELECT COUNT(*) FROM IngestLog")
+    return curr.fetchone()[0]
+
+
+@contextlib.contextmanager
+def savepoint(curr, pipeline=None):
+    """
+    Run the block in a savepoint that is rolled back if the block fails.
+
+    In pipeline mode the savepoint statements are queued with the block's and
+    the block ends with a single sync, which raises its errors, so a block
+    costs one round trip. conn.transaction() would sync several times.
+
+    Parameters:
+    - curr: psycopg cursor
+    - pipeline: psycopg Pipeline (optional), active pipeline of curr's connection
+    """
+    if pipeline is None:
+        with curr.connection.transaction():
+            yield
+        return
+
+    try:
+        curr.execute("SAVEPOINT pipelined_block")
+        yield
+        curr.execute("RELEASE SAVEPOINT pipelined_block")
+        pipeline.sync()
+    except psycopg.Error:
+        # Leave the aborted pipeline, then undo the block
+        with contextlib.suppress(psycopg.Error):
+            pipeline.sync()
+        curr.execute("ROLLBACK TO SAVEPOINT pipelined_block")
+        curr.execute("RELEASE SAVEPOINT pipelined_block")
+        raise
+
+
+def batch_insert_rows(curr, insert_query, rows, indices, pipeline=None):
+    """
+    Perform batch inserts for a list of rows.
+
+    The batch runs inside a savepoint. If it fails, it is split in halves that
+    are retried recursively, each in its own savepoint, until the failing rows
+    are isolated. A batch with a few bad rows therefore costs about
+    log2(batch size) extra round trips per bad row instead of one per row.
+
+    In pipeline mode the savepoint, the inserts and the release are queued
+    and a batch costs a single round trip (see savepoint), which is what
+    matters on a high-latency connection.
+
+    Parameters:
+    - curr: psycopg cursor
+    - insert_query: str, SQL insert query
+    - rows: list of tuples, rows to be inserted
+    - indices: list, index of each row in the original df, used to report
+      the failed rows
+    - pipeline: psycopg Pipeline (optional), active pipeline of curr's connection
+
+    Returns:
+    - int, number of successfully inserted rows
+    - int, number of failures for inserting rows
+    - int list, list that keeps track of indicies of the failed rows
+    """
+    try:
+        with savepoint(curr, pipeline):
+            curr.executemany(insert_query, rows)
+        return len(rows), 0, []
+
+    except psycopg.Error as batch_error:
+        # A lost connection fails every half the same way, there are no rows to isolate
+        if curr.connection.closed:
+            raise
+        if len(rows) == 1:
+            logger.error(f"Error inserting row {indices[0]} in the batch: {batch_error}")
+            return 0, 1, [indices[0]]
+
+        # Retry each half separately to isolate the failing rows
+        middle = len(rows) // 2
+        left = batch_insert_rows(curr, insert_query, rows[:middle], indices[:middle], pipeline)
+        right = batch_insert_rows(curr, insert_query, rows[middle:], indices[middle:], pipeline)
+        return left[0] + right[0], left[1] + right[1], left[2] + right[2]
@@ -0,0 +1,108 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+import matplotlib.pyplot as plt
+import pandas as pd
+
+
+# pyplot's current figure is global, so figures are drawn one at a time,
+# also across dashboard sessions
+render_lock = threading.Lock()
+
+
+def digest(*parts):
+    """
+    Hash the data and parameters a figure is drawn from.
+
+    Parameters:
+    - parts: query rows, DataFrames, Series or any value whose repr spells
+      it out in full (DataFrames are hashed by content, since their repr is
+      truncated)
+
+    Returns:
+    - str, sha1 hex digest
+    """
+    sha = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, (pd.DataFrame, pd.Series)):
+            frame = part.to_frame() if isinstance(part, pd.Series) else part
+            sha.update(repr((list(frame.columns), [str(dtype) for dtype in frame.dtypes])).encode('utf-8'))
+            sha.update(pd.util.hash_pandas_object(part, index=True).values.tobytes())
+        else:
+            sha.update(repr(part).encode('utf-8'))
+        # Separator, so that parts cannot run into each other
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+class FigureCache:
+    """
+    Memory-bounded LRU cache of rendered figures, shared by every dashboard
+    session.
+
+    Entries are the PNG or SVG bytes of a figure, keyed by the drawing
+    function and a hash of the data and parameters it was called with, so
+    a panel whose query result has not changed skips matplotlib entirely.
+    Unlike the query cache, nothing needs to be dropped when a load is
+    committed: new data hashes to a new key, and the figures of the old
+    data are evicted once they are the least recently used.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def render(self, draw, *args, figsize=(10, 6), format='png', dpi=200):
+        """
+        Return the rendered figure of draw(*args), drawing it only if it is
+        not cached.
+
+        Parameters:
+        - draw: function plotting args on the current pyplot figure
+        - args: data and parameters the figure depends on (see digest)
+        - figsize: (width, height) tuple in inches (default is (10, 6))
+        - format: str, 'png' or 'svg' (default is 'png')
+        - dpi: int, resolution of PNG figures (default is 200, like st.pyplot)
+
+        Returns:
+        - bytes, the rendered figure
+        """
+        key = digest(draw.__module__, draw.__qualname__, figsize, format, dpi, *args)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        with render_lock:
+            figure = plt.figure(figsize=figsize)
+            try:
+                draw(*args)
+                buffer = io.BytesIO()
+                figure.savefig(buffer, format=format, dpi=dpi, bbox_inches='tight')
+            finally:
+                plt.close(figure)
+        image = buffer.getvalue()
+
+        with self.lock:
+            # A figure larger than the whole cache is returned but not kept
+            if key not in self.entries and len(image) <= self.max_bytes:
+                self.entries[key] = image
+                self.size += len(image)
+                while self.size > self.max_bytes:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted)
+                    self.evictions += 1
+        return image
+
+
+# Module-level so that it outlives Streamlit reruns, like query_cache.cache
+cache = FigureCache()
@@ -0,0 +1,72 @@
+import pandas as pd
+
+from db import lock_hospitals
+
+
+# HospitalKeys (see migration 12 in migrations.py) gives every hospital seen
+# by either loader a compact integer hospital_id, which the fact tables store
+# instead of the text CCN, so their joins, indexes and unique constraints
+# compare integers. The HHS hospital_pk and the CMS Facility ID are
+# normalized first, so that the two sources agree on the key of a hospital.
+# Migration 12 normalizes the keys loaded before it the same way.
+
+
+def normalize_ccn(values):
+    """
+    Normalize CMS Certification Numbers (CCNs). Surrounding whitespace is
+    removed, numbers read as floats lose their '.0', and all-digit keys
+    shorter than six characters get their leading zeros back, e.g. 10001
+    becomes '010001'. Other keys, such as the hashed hospital_pk of HHS
+    hospitals without a CCN, are kept as they are.
+
+    Parameters:
+    - values: pandas Series, raw hospital_pk or Facility ID values
+
+    Returns:
+    - pandas Series, normalized keys as str, None for missing or empty values
+    """
+    ccns = values.astype('string').str.strip()
+    ccns = ccns.str.replace(r'^(\d+)\.0*$', r'\1', regex=True)
+    ccns = ccns.where(~ccns.str.fullmatch(r'\d{1,5}').fillna(False), ccns.str.zfill(6))
+    return ccns.astype(object).where(ccns.notna() & (ccns != ''), None)
+
+
+class KeyMap:
+    """
+    Map of normalized CCNs to hospital ids for one load. HospitalKeys is read
+    into memory on the first lookup. After that a chunk costs no round trip
+    unless it has new keys, which are then added in bulk. The ids of the
+    keys a load adds are only valid once it commits, so a map is not reused
+    after its load fails.
+    """
+
+    def __init__(self):
+        self.ids = None
+
+    def resolve(self, curr, ccns):
+        """
+        Look up the hospital ids of a chunk's keys, adding the new keys to
+        HospitalKeys. The new keys are inserted under the lock of the
+        hospital writes (see db.lock_hospitals), so loads adding the same
+        keys never wait for each other's uncommitted rows in opposite orders.
+
+        Parameters:
+        - curr: psycopg cursor
+        - ccns: pandas Series, keys normalized by normalize_ccn
+
+        Returns:
+        - pandas Series, int hospital ids with the index of ccns, None for
+          missing keys
+        """
+        if self.ids is None:
+            curr.execute("SELECT ccn, hospital_id FROM HospitalKeys")
+            self.ids = dict(curr.fetchall())
+
+        new = sorted(set(ccns.dropna()) - self.ids.keys())
+        if new:
+            lock_hospitals(curr)
+            curr.execute("INSERT INTO HospitalKeys (ccn) SELECT unnest(%s::varchar[]) ON CONFLICT (ccn) DO NOTHING",
+                         (new,))
+            curr.execute("SELECT ccn, hospital_id FROM HospitalKeys WHERE ccn = ANY(%s)", (new,))
+            self.ids.update(curr.fetchall())
+        return pd.Series([self.ids.get(ccn) for ccn in ccns], index=ccns.index, dtype=object)
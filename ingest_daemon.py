@@ -0,0 +1,306 @@
+import datetime
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import psycopg
+
+import backfill
+from backfill import infer_load, init_worker, rejects_file
+from db import get_conninfo
+from load_hhs import load_hhs_data
+from load_quality import load_quality_data
+from parse_cache import content_hash
+
+
+# Directories watched when none are given
+WATCHED_DIRS = ["hhs_data", "hospital_data"]
+
+# Seconds a file must go unmodified before it is loaded, so files still
+# being copied into a watched directory are not read half-written
+SETTLE_SECONDS = 5
+
+# Retry schedule of failed loads: the n-th retry waits RETRY_BASE_SECONDS *
+# 2**(n-1), at most RETRY_MAX_SECONDS, and a file is abandoned after
+# MAX_ATTEMPTS failed attempts until its content changes
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 3600
+MAX_ATTEMPTS = 5
+
+
+def ledger_entries(curr, hashes):
+    """
+    Fetch the ledger rows of the given file contents.
+
+    Parameters:
+    - curr: psycopg cursor
+    - hashes: str list, content hashes of the files found
+
+    Returns:
+    - dict, (loader, content_hash) -> (status, attempts, next_attempt_at)
+    """
+    curr.execute('''
+        SELECT loader, content_hash, status, attempts, next_attempt_at
+        FROM IngestLedger WHERE content_hash = ANY(%s)''', (hashes,))
+    return {(loader, file_hash): (status, attempts, next_attempt_at)
+            for loader, file_hash, status, attempts, next_attempt_at in curr.fetchall()}
+
+
+def start_attempt(curr, csv_file, kind, date, file_hash):
+    """
+    Record in the ledger that a file is being loaded.
+
+    Returns:
+    - int, number of the attempt, 1 for the first load of this content
+    """
+    curr.execute('''
+        INSERT INTO IngestLedger (loader, content_hash, file_name, data_date, status, attempts, started_at)
+        VALUES (%s, %s, %s, %s, 'loading', 1, CURRENT_TIMESTAMP)
+        ON CONFLICT (loader, content_hash) DO UPDATE
+        SET file_name = EXCLUDED.file_name, status = 'loading', attempts = IngestLedger.attempts + 1,
+            started_at = CURRENT_TIMESTAMP, finished_at = NULL, next_attempt_at = NULL
+        RETURNING attempts''', (kind, file_hash, csv_file, date))
+    return curr.fetchone()[0]
+
+
+def finish_attempt(curr, kind, file_hash, attempt, result=None, error=None, max_attempts=MAX_ATTEMPTS,
+                   retry_base=RETRY_BASE_SECONDS, retry_max=RETRY_MAX_SECONDS):
+    """
+    Record the outcome of a load in the ledger, and when it failed, the
+    time of the next attempt.
+
+    Parameters:
+    - curr: psycopg cursor
+    - kind: str, 'hhs' or 'quality'
+    - file_hash: str, content hash of the file
+    - attempt: int, number of the attempt (see start_attempt)
+    - result: dict (optional), return value of the loader if it succeeded
+    - error: str (optional), why the load failed
+    - max_attempts, retry_base, retry_max: retry schedule (see RETRY_BASE_SECONDS)
+
+    Returns:
+    - str, new status: 'loaded', 'failed' or 'abandoned'
+    """
+    if result is not None:
+        status, retry_at = 'loaded', None
+    elif attempt >= max_attempts:
+        status, retry_at = 'abandoned', None
+    else:
+        delay = min(retry_base * 2 ** (attempt - 1), retry_max)
+        status, retry_at = 'failed', datetime.datetime.now() + datetime.timedelta(seconds=delay)
+    result = result or {}
+    curr.execute('''
+        UPDATE IngestLedger
+        SET status = %s, rows_read = %s, rows_inserted = %s, rows_rejected = %s, error = %s,
+            finished_at = CURRENT_TIMESTAMP, next_attempt_at = %s
+        WHERE loader = %s AND content_hash = %s''',
+        (status, result.get('rows'), result.get('inserted'), result.get('rejected'), error, retry_at, kind, file_hash))
+    return status
+
+
+def ingest_file(csv_file, kind, date):
+    """
+    Load one file in a worker process, through the worker's pooled
+    connection (see backfill.init_worker). HHS files are loaded in bulk.
+    Both loaders are checkpointed, so the retry of a load that was cut off,
+    e.g. by a dropped connection, resumes where it stopped.
+
+    Returns:
+    - dict, the loader's result ('rows', 'inserted' and 'rejected')
+
+    Raises:
+    - Exception: The error of a failed load, recorded in the ledger by run
+    """
+    with backfill.pool.connection() as conn:
+        if kind == 'hhs':
+            return load_hhs_data(csv_file, conn, bulk=True, rejects_path=rejects_file(csv_file), checkpoint=True,
+                                 raise_errors=True)
+        return load_quality_data(csv_file, conn, date, rejects_path=rejects_file(csv_file), checkpoint=True,
+                                 raise_errors=True)
+
+
+def scan(paths, settle=SETTLE_SECONDS, ignored=None):
+    """
+    List the loadable files in the watched paths that have not been modified
+    for settle seconds.
+
+    Parameters:
+    - paths: str list, directories or glob patterns to watch
+    - settle: float, seconds a file must go unmodified
+    - ignored: set (optional), names already reported as not matching a
+      data set, updated in place so each is reported once
+
+    Returns:
+    - list of (csv_file, kind, date) tuples sorted by date
+    """
+    ignored = set() if ignored is None else ignored
+    files = set()
+    for path in paths:
+        files.update(glob.glob(os.path.join(path, "*.csv") if os.path.isdir(path) else path))
+
+    loads = []
+    now = time.time()
+    for csv_file in files:
+        load = infer_load(csv_file)
+        if load is None:
+            if csv_file not in ignored:
+                print(f"Ignoring {csv_file}: file name does not match a known data set")
+                ignored.add(csv_file)
+        elif now - os.path.getmtime(csv_file) >= settle:
+            loads.append((csv_file, *load))
+    return sorted(loads, key=lambda load: (load[2], load[1]))
+
+
+def run(paths, workers=2, interval=30, settle=SETTLE_SECONDS, max_attempts=MAX_ATTEMPTS,
+        retry_base=RETRY_BASE_SECONDS, retry_max=RETRY_MAX_SECONDS, once=False):
+    """
+    Watch paths and load every new HHS and CMS quality file, recording each
+    file's content hash, row counts and outcome in IngestLedger.
+
+    Every interval seconds the paths are scanned. A file whose content is
+    already in the ledger as loaded (or abandoned) is skipped without being
+    loaded again, whatever its name. Hashes are kept per file size and
+    modification time, so unchanged files are only read once. New files are
+    loaded by a pool of workers worker processes. Quality snapshots are
+    loaded one at a time, oldest first, so HospitalQualityHistory receives
+    them in date order, while HHS weeks are loaded concurrently. A failed
+    load is retried with exponential backoff, and given up after
+    max_attempts attempts.
+
+    Parameters:
+    - paths: str list, directories or glob patterns to watch
+    - workers: int, number of files loaded at the same time (default is 2)
+    - interval: float, seconds between two scans (default is 30)
+    - settle: float, seconds a file must go unmodified before it is loaded
+    - max_attempts, retry_base, retry_max: retry schedule (see RETRY_BASE_SECONDS)
+    - once: bool, exit once the files found are loaded or waiting for a
+      retry, instead of watching forever (default is False)
+
+    Returns:
+    - dict, number of files per outcome ('loaded', 'failed', 'abandoned')
+    """
+    conninfo = get_conninfo()
+    outcomes = {'loaded': 0, 'failed': 0, 'abandoned': 0}
+    in_flight = {}
+    ignored = set()
+    print(f"Watching {', '.join(paths)} with {workers} workers")
+
+    with psycopg.connect(conninfo, autocommit=True) as conn, conn.cursor() as curr, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(conninfo,)) as executor:
+        try:
+            while True:
+                loads = scan(paths, settle, ignored)
+                hashes = {csv_file: content_hash(csv_file) for csv_file, _, _ in loads}
+                ledger = ledger_entries(curr, sorted(set(hashes.values())))
+                busy = {(kind, file_hash) for _, kind, _, file_hash, _ in in_flight.values()}
+
+                pending = []
+                quality_blocked = any(kind == 'quality' for _, kind, _, _, _ in in_flight.values())
+                for csv_file, kind, date in loads:
+                    key = (kind, hashes[csv_file])
+                    status, _, next_attempt_at = ledger.get(key, (None, 0, None))
+                    if key in busy or status in ('loaded', 'abandoned'):
+                        continue
+                    if status == 'failed' and next_attempt_at > datetime.datetime.now():
+                        # Newer snapshots wait for this one's retry, to keep the date order
+                        quality_blocked = quality_blocked or kind == 'quality'
+                        continue
+                    if kind == 'quality':
+                        # Snapshots are loaded one at a time, oldest first (loads are sorted by date)
+                        if quality_blocked:
+                            continue
+                        quality_blocked = True
+                    busy.add(key)
+                    pending.append((csv_file, kind, date, hashes[csv_file]))
+
+                for csv_file, kind, date, file_hash in pending:
+                    if len(in_flight) >= workers:
+                        break
+                    attempt = start_attempt(curr, csv_file, kind, date, file_hash)
+                    print(f"Loading {csv_file} ({kind} {date}, attempt {attempt})")
+                    future = executor.submit(ingest_file, csv_file, kind, date)
+                    in_flight[future] = (csv_file, kind, date, file_hash, attempt)
+
+                if once and not in_flight:
+                    break
+
+                done, _ = wait(in_flight, timeout=interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    csv_file, kind, date, file_hash, attempt = in_flight.pop(future)
+                    try:
+                        result, error = future.result(), None
+                    except Exception as e:
+                        result, error = None, str(e) or type(e).__name__
+                    status = finish_attempt(curr, kind, file_hash, attempt, result, error,
+                                            max_attempts, retry_base, retry_max)
+                    outcomes[status] += 1
+                    if result is not None:
+                        print(f"Loaded {csv_file}: {result['rows']} rows, {result['inserted']} inserted, "
+                              f"{result['rejected']} rejected")
+                    else:
+                        print(f"Failed {csv_file} (attempt {attempt}, {status}): {error}")
+
+        except KeyboardInterrupt:
+            print(f"Stopping, waiting for {len(in_flight)} load(s) in progress")
+            for future, (csv_file, kind, date, file_hash, attempt) in in_flight.items():
+                try:
+                    result, error = future.result(), None
+                except Exception as e:
+                    result, error = None, str(e) or type(e).__name__
+                outcomes[finish_attempt(curr, kind, file_hash, attempt, result, error,
+                                        max_attempts, retry_base, retry_max)] += 1
+
+    return outcomes
+
+
+def print_ledger(conn, limit=20):
+    """
+    Print the most recent ledger rows.
+
+    Parameters:
+    - conn: psycopg connection
+    - limit: int, number of rows to print (default is 20)
+    """
+    rows = conn.execute('''
+        SELECT file_name, loader, data_date, status, attempts, rows_read, rows_inserted, rows_rejected,
+               COALESCE(finished_at, started_at), next_attempt_at, error
+        FROM IngestLedger ORDER BY COALESCE(finished_at, started_at) DESC LIMIT %s''', (limit,)).fetchall()
+    print(f"{'file':<45}{'status':<11}{'tries':>6}{'rows':>8}{'inserted':>10}{'rejected':>10}  finished")
+    for file_name, loader, data_date, status, attempts, n_rows, inserted, rejected, finished, retry_at, error in rows:
+        print(f"{os.path.basename(file_name):<45}{status:<11}{attempts:>6}{n_rows if n_rows is not None else '-':>8}"
+              f"{inserted if inserted is not None else '-':>10}{rejected if rejected is not None else '-':>10}"
+              f"  {finished:%Y-%m-%d %H:%M:%S}")
+        if retry_at is not None:
+            print(f"    next attempt at {retry_at:%Y-%m-%d %H:%M:%S}")
+        if error:
+            print(f"    {error}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Watch directories and load new HHS and CMS quality files as they arrive.")
+    parser.add_argument("paths", nargs="*", default=WATCHED_DIRS,
+                        help="directories or glob patterns to watch (default is hhs_data and hospital_data)")
+    parser.add_argument("--workers", type=int, default=2, help="number of files loaded at the same time (default 2)")
+    parser.add_argument("--interval", type=float, default=30, help="seconds between two scans (default 30)")
+    parser.add_argument("--settle", type=float, default=SETTLE_SECONDS,
+                        help=f"seconds a file must go unmodified before it is loaded (default {SETTLE_SECONDS})")
+    parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS,
+                        help=f"attempts before a failing file is given up (default {MAX_ATTEMPTS})")
+    parser.add_argument("--retry-base", type=float, default=RETRY_BASE_SECONDS,
+                        help=f"seconds before the first retry, doubled for each further one (default {RETRY_BASE_SECONDS})")
+    parser.add_argument("--retry-max", type=float, default=RETRY_MAX_SECONDS,
+                        help=f"longest wait between two attempts in seconds (default {RETRY_MAX_SECONDS})")
+    parser.add_argument("--once", action="store_true", help="load the files found and exit instead of watching")
+    parser.add_argument("--status", action="store_true", help="print the latest ledger rows and exit")
+    args = parser.parse_args()
+
+    if args.status:
+        with psycopg.connect(get_conninfo()) as conn:
+            print_ledger(conn)
+    else:
+        outcomes = run(args.paths, args.workers, args.interval, args.settle, args.max_attempts,
+                       args.retry_base, args.retry_max, args.once)
+        print(f"{outcomes['loaded']} loaded, {outcomes['failed']} failed, {outcomes['abandoned']} abandoned")
@@ -0,0 +1,244 @@
+import contextlib
+import contextvars
+import cProfile
+import datetime
+import io
+import json
+import logging
+import os
+import pstats
+import resource
+import sys
+import time
+from collections import Counter, defaultdict
+
+import psycopg
+
+from logging_module import setup_metrics_logging
+
+
+# Run of the loader executing in this thread or task, if any. The loaders'
+# helpers report through the module functions below, which do nothing
+# outside a run, so they need no extra parameter.
+current_run = contextvars.ContextVar('current_run', default=None)
+
+
+def reset_peak_rss():
+    """
+    Start measuring the peak RSS from now on. Only Linux can reset the
+    peak, elsewhere it stays the peak of the whole process.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """
+    Returns:
+    - float, peak resident set size in MB since reset_peak_rss
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kB on Linux
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def counting_cursor_factory(run, base=psycopg.Cursor):
+    """
+    Build a cursor class counting the statements sent to the server, each
+    execute, executemany and COPY being one round trip.
+
+    Parameters:
+    - run: LoadRun, run whose round_trips are incremented
+    - base: cursor class to extend (default is psycopg.Cursor)
+
+    Returns:
+    - type, cursor class to set as the connection's cursor_factory
+    """
+    class CountingCursor(base):
+        def execute(self, *args, **kwargs):
+            run.round_trips += 1
+            return super().execute(*args, **kwargs)
+
+        def executemany(self, *args, **kwargs):
+            run.round_trips += 1
+            return super().executemany(*args, **kwargs)
+
+        def copy(self, *args, **kwargs):
+            run.round_trips += 1
+            return super().copy(*args, **kwargs)
+
+    return CountingCursor
+
+
+class LoadRun:
+    """
+    Timers and counters of one loader run, written as a single JSON record
+    to the 'metrics' logger (see logging_module.setup_metrics_logging) when
+    the run ends.
+    """
+
+    def __init__(self, loader, file_name):
+        self.loader = loader
+        self.file_name = file_name
+        self.started_at = datetime.datetime.now()
+        self.phases = defaultdict(float)
+        self.counters = Counter()
+        self.rejects = Counter()
+        self.values = {}
+        self.round_trips = 0
+        self.status = 'ok'
+
+    def record(self, seconds):
+        """
+        Returns:
+        - dict, the metrics record of the run
+        """
+        return {
+            'loader': self.loader,
+            'file': self.file_name,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'status': self.status,
+            'seconds': round(seconds, 3),
+            'phases': {name: round(value, 3) for name, value in self.phases.items()},
+            **self.counters,
+            **self.values,
+            'rejects': dict(self.rejects),
+            'round_trips': self.round_trips,
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        }
+
+
+@contextlib.contextmanager
+def load_run(loader, file_name, conn=None, profile=None):
+    """
+    Instrument a loader run: time it, count the round trips made through
+    conn, optionally profile it, and emit its metrics record at the end,
+    also when it fails.
+
+    Parameters:
+    - loader: str, name of the loader, e.g. 'hhs'
+    - file_name: str, file being loaded
+    - conn: psycopg connection (optional), whose cursors are counted during
+      the run
+    - profile: str (optional), file to write cProfile stats of the run to,
+      readable with pstats or snakeviz
+
+    Yields:
+    - LoadRun, the run, also reachable through the module functions
+    """
+    run = LoadRun(loader, file_name)
+    token = current_run.set(run)
+    if conn is not None:
+        cursor_factory = conn.cursor_factory
+        conn.cursor_factory = counting_cursor_factory(run, cursor_factory)
+    profiler = cProfile.Profile() if profile else None
+    reset_peak_rss()
+    start_time = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield run
+    except BaseException:
+        run.status = 'failed'
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile)
+            run.values['profile'] = os.path.abspath(profile)
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(15)
+            logging.debug(summary.getvalue())
+        if conn is not None:
+            conn.cursor_factory = cursor_factory
+        current_run.reset(token)
+        setup_metrics_logging().info(json.dumps(run.record(time.perf_counter() - start_time), default=str))
+
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    Add the time spent in the block to a phase of the current run.
+
+    Parameters:
+    - name: str, phase name, e.g. 'parse' or 'commit'
+    """
+    run = current_run.get()
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        if run is not None:
+            run.phases[name] += time.perf_counter() - start_time
+
+
+def timed_iter(name, iterable):
+    """
+    Add the time spent producing each item, e.g. parsing a CSV chunk, to a
+    phase of the current run.
+
+    Parameters:
+    - name: str, phase name
+    - iterable: iterable to time
+
+    Returns:
+    - iterator over the items of iterable
+    """
+    iterator = iter(iterable)
+    while True:
+        with phase(name):
+            item = next(iterator, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
+
+
+def count(name, n=1):
+    """
+    Add n to a counter of the current run, e.g. 'rows_read'.
+    """
+    run = current_run.get()
+    if run is not None:
+        run.counters[name] += int(n)
+
+
+def count_rejects(rejects):
+    """
+    Count the reason codes of rejected rows in the current run.
+
+    Parameters:
+    - rejects: dict, row index -> list of reason codes (see validation.add_reject)
+    """
+    run = current_run.get()
+    if run is not None:
+        for reasons in rejects.values():
+            run.rejects.update(reasons)
+
+
+def set_value(name, value):
+    """
+    Store a JSON-serializable value in the record of the current run, e.g.
+    the rows inserted per table.
+    """
+    run = current_run.get()
+    if run is not None:
+        run.values[name] = value
+
+
+def set_status(status):
+    """
+    Mark the current run, e.g. 'failed' when a loader handles its own error.
+    """
+    run = current_run.get()
+    if run is not None:
+        run.status = status
@@ -1,189 +1,692 @@
 import pandas as pd
 import numpy as np
 import psycopg
+import datetime
+import os
+import re
 import time
-from credentials import DB_USER, DB_PASSWORD
+import analytics
+import parse_cache
+from checkpoints import read_checkpoint, save_checkpoint, clear_checkpoint
+from db import get_conninfo, record_ingest, batch_insert_rows, lock_hospitals
+from hospital_keys import KeyMap, normalize_ccn
+from instrumentation import load_run, phase, timed_iter, count, count_rejects, set_value, set_status
+from partitions import partition_exists, create_staging_partition, attach_partition
+from rollups import refresh_rollups
+from validation import negative, missing, apply_rules, add_reject, write_rejects
 
 
-def check_duplicate_id(curr, table_name, column_name, value, column_name2 = None, value2 = None):
+# Tables filled by load_hhs_data. Hospitals and HospitalLocations are the
+# dimensions shared by every weekly file.
+TABLES = ('Hospitals', 'HospitalLocations', 'HospitalBedInformation')
+DIMENSION_TABLES = ('Hospitals', 'HospitalLocations')
+
+# Bed metrics that are loaded into HospitalBedInformation and must not be negative
+BED_COLUMNS = [
+    'all_adult_hospital_beds_7_day_avg', 'all_pediatric_inpatient_beds_7_day_avg',
+    'all_adult_hospital_inpatient_bed_occupied_7_day_coverage', 'all_pediatric_inpatient_bed_occupied_7_day_avg',
+    'total_icu_beds_7_day_avg', 'icu_beds_used_7_day_avg', 'inpatient_beds_used_covid_7_day_avg',
+    'staffed_icu_adult_patients_confirmed_covid_7_day_avg'
+]
+
+# Columns loaded into Hospitals and HospitalLocations, kept as strings
+HOSPITAL_COLUMNS = ['hospital_pk', 'hospital_name', 'state', 'address', 'city', 'zip', 'fips_code', 'geocoded_hospital_address']
+
+# Hash of a hospital's attributes, stored in Hospitals.fingerprint so repeats
+# of an unchanged hospital are skipped without comparing every column.
+# Migration 8 computes it the same way for the hospitals loaded before it.
+HOSPITAL_FINGERPRINT = f"md5(ROW({', '.join(f'{column}::text' for column in HOSPITAL_COLUMNS[1:])})::text)"
+
+# geocoded_hospital_address is a WKT point, 'POINT (<longitude> <latitude>)'.
+# Migration 10 parses the locations loaded before it with the same pattern.
+POINT_PATTERN = r'^\s*POINT\s*\(\s*(-?\d+(?:\.\d*)?)\s+(-?\d+(?:\.\d*)?)\s*\)\s*$'
+
+# A row failing any of these rules is not loaded into Hospitals and HospitalLocations
+DIMENSION_RULES = [missing('hospital_pk'), missing('hospital_name')]
+
+# A row failing any of these rules is not loaded into HospitalBedInformation,
+# which is partitioned by collection_week
+BED_RULES = [negative(column) for column in BED_COLUMNS] + [missing('collection_week')]
+
+# Compact dtypes for the streaming reader, which only parses the columns above
+CHUNK_DTYPES = {
+    **{column: str for column in HOSPITAL_COLUMNS},
+    'state': 'category',
+    **{column: 'float32' for column in BED_COLUMNS},
+    'collection_week': str,
+}
+
+# Insert of one bed row into HospitalBedInformation or a staging partition
+BED_INSERT_QUERY = f'''
+    INSERT INTO {{bed_table}} (hospital_id, collection_week, {', '.join(BED_COLUMNS)})
+    VALUES ({', '.join(['%s'] * (len(BED_COLUMNS) + 2))})'''
+
+# Bed rows per savepoint in pipeline mode, see insert_rows
+PIPELINE_BATCH_SIZE = 500
+
+# Rows committed per transaction by checkpointed loads without a chunksize
+CHECKPOINT_ROWS = 2000
+
+# Keys of a file's bed rows already in HospitalBedInformation, see load_existing_keys
+EXISTING_KEYS_QUERY = '''
+    SELECT hospital_id, collection_week FROM HospitalBedInformation
+    WHERE hospital_id = ANY(%(ids)s) AND collection_week = ANY(%(weeks)s)'''
+
+
+def prepare_hhs_frame(raw_df):
+    """
+    Build the typed frame used for validation and inserts from the rows as
+    read from the file.
+
+    Parameters:
+    - raw_df: pandas df, HHS file read with dtype=object, or a chunk from
+      read_hhs_chunks (whose dtypes are kept)
+
+    Returns:
+    - pandas df, hospital columns as strings with hospital_pk normalized
+      (see hospital_keys.normalize_ccn), bed metrics as floats with the
+      -999999 sentinel replaced by NaN and collection_week as dates
+    """
+    df = raw_df[HOSPITAL_COLUMNS].copy()
+    df['hospital_pk'] = normalize_ccn(df['hospital_pk'])
+    for column in BED_COLUMNS:
+        df[column] = pd.to_numeric(raw_df[column], errors='coerce').replace(-999999, np.nan)
+    df['collection_week'] = pd.to_datetime(raw_df['collection_week'], format = '%Y-%m-%d').dt.date
+    return df
+
+
+def read_hhs_chunks(csv_file, chunksize):
+    """
+    Stream an HHS file in fixed-size chunks, parsing only the columns that are
+    loaded, with compact dtypes and the -999999 sentinel read as missing.
+    When pyarrow is installed the chunks are sliced from the file's typed
+    entry in the parse cache (see parse_cache.py) instead.
+
+    Parameters:
+    - csv_file: str, path to the CSV file containing HHS data
+    - chunksize: int, number of rows per chunk
+
+    Returns:
+    - iterator of pandas df, chunks indexed by their row number in the file
+    """
+    sentinel = ['-999999', '-999999.0']
+    return parse_cache.read_chunks(csv_file, list(CHUNK_DTYPES), chunksize, dtypes=CHUNK_DTYPES,
+                                   na_values={column: sentinel for column in BED_COLUMNS})
+
+
+def to_db_frame(df):
+    """
+    Convert a typed frame to the Python values passed to psycopg.
+
+    float32 bed metrics are converted through their shortest decimal
+    representation so that e.g. 5.4 is stored as 5.4 rather than
+    5.400000095367432, and missing values become None.
+
+    Parameters:
+    - df: pandas df, output of prepare_hhs_frame
+
+    Returns:
+    - pandas df, object columns with missing values as None
+    """
+    df = df.copy()
+    for column in BED_COLUMNS:
+        if df[column].dtype == np.float32:
+            df[column] = df[column].astype(str).astype('float64')
+    return df.astype(object).where(df.notna(), None)
+
+
+def parse_points(addresses):
+    """
+    Parse the coordinates of geocoded_hospital_address values. Missing
+    addresses, addresses that are not a point and coordinates out of range
+    give NaN, the location is then stored without coordinates.
+
+    Parameters:
+    - addresses: pandas Series of str, geocoded_hospital_address values
+
+    Returns:
+    - pandas df, float 'latitude' and 'longitude' columns with the index of addresses
+    """
+    points = addresses.str.extract(POINT_PATTERN, flags=re.IGNORECASE).astype('float64')
+    points.columns = ['longitude', 'latitude']
+    valid = points['latitude'].between(-90, 90) & points['longitude'].between(-180, 180)
+    return points[['latitude', 'longitude']].where(valid)
+
+
+def load_existing_keys(curr, df, bed_tables=None):
+    """
+    Fetch, in a single query, the keys of the file's bed rows that are
+    already present in HospitalBedInformation.
+
+    Parameters:
+    - curr: psycopg cursor
+    - df: pandas df, preprocessed HHS data
+    - bed_tables: dict (optional), week -> staging partition the week's bed
+      rows go to instead of HospitalBedInformation (see load_hhs_data)
+
+    Returns:
+    - set of (hospital_id, collection_week) tuples
+    """
+    bed_tables = bed_tables or {}
+    hospital_ids = df['hospital_id'].dropna().unique().tolist()
+    weeks = [week for week in df['collection_week'].dropna().unique().tolist() if week not in bed_tables]
+    curr.execute(EXISTING_KEYS_QUERY, {'ids': hospital_ids, 'weeks': weeks})
+
+    existing = set(curr.fetchall())
+
+    # Rows already staged by earlier chunks of the same load
+    for staging in set(bed_tables.values()):
+        curr.execute(f"SELECT hospital_id, collection_week FROM {staging} WHERE hospital_id = ANY(%s)", (hospital_ids,))
+        existing.update(curr.fetchall())
+    return existing
+
+
+def new_counts():
+    """
+    Create the per-table counters reported at the end of a load: rows
+    inserted ('success'), rows updated (only Hospitals and HospitalLocations
+    rows are updated) and rows skipped as duplicates or failed ('errors').
+
+    Returns:
+    - dict, table name -> {'success': int, 'updated': int, 'errors': int}
+    """
+    return {table: {'success': 0, 'updated': 0, 'errors': 0} for table in TABLES}
+
+
+def add_counts(total, counts):
+    """
+    Add the per-table counts of one chunk to the running totals.
+
+    Parameters:
+    - total: dict, running totals (see new_counts), updated in place
+    - counts: dict, counts of a chunk
+    """
+    for table, table_counts in counts.items():
+        for key, value in table_counts.items():
+            total[table][key] += value
+
+
+def merge_hospitals(curr, df):
+    """
+    Apply the hospitals of a preprocessed HHS DataFrame to Hospitals and
+    HospitalLocations in bulk. Every weekly file repeats the same hospitals,
+    so the latest row of each hospital_pk is streamed into a temporary table
+    with COPY and compared to the stored fingerprint (see
+    HOSPITAL_FINGERPRINT). Only new hospitals and hospitals whose attributes
+    changed are written, with one INSERT ... ON CONFLICT per table. Repeats
+    of an unchanged hospital are not duplicates and are neither counted nor
+    rejected.
+
+    WeeklyStateBedRollup groups the bed rows by the hospitals' current
+    state, so the weeks already rolled up for a hospital whose state
+    changes are refreshed in the same transaction.
+
+    Parameters:
+    - curr: psycopg cursor
+    - df: pandas df, preprocessed HHS data with missing values as None and
+      the hospital_id of each row (see hospital_keys.KeyMap)
+
+    Returns:
+    - dict, Hospitals and HospitalLocations inserted ('success'), 'updated'
+      and rejected ('errors') counts (see new_counts)
+    - dict, row index -> reason codes of the rows failing DIMENSION_RULES
+    """
+    counts = {table: {'success': 0, 'updated': 0, 'errors': 0} for table in DIMENSION_TABLES}
+    rejects = {}
+    reasons = apply_rules(df, DIMENSION_RULES)
+    for index, reason in reasons.dropna().items():
+        add_reject(rejects, index, reason)
+        # The row is dropped from both tables
+        for table in DIMENSION_TABLES:
+            counts[table]['errors'] += 1
+
+    # A file covering several weeks gives each hospital the attributes of its latest week
+    hospitals = (df[reasons.isna()].sort_values('collection_week', kind='stable', na_position='first')
+                 .drop_duplicates('hospital_pk', keep='last'))
+
+    hospitals = hospitals[HOSPITAL_COLUMNS + ['hospital_id']].join(parse_points(hospitals['geocoded_hospital_address'].astype(object)))
+    hospitals = hospitals.astype(object).where(hospitals.notna(), None)
+
+    curr.execute(f'''
+        CREATE TEMPORARY TABLE hospital_staging (
+            {', '.join(f"{column} VARCHAR(255)" for column in HOSPITAL_COLUMNS)},
+            hospital_id INTEGER,
+            latitude DOUBLE PRECISION,
+            longitude DOUBLE PRECISION
+        ) ON COMMIT DROP''')
+    with curr.copy(f"COPY hospital_staging ({', '.join(HOSPITAL_COLUMNS)}, hospital_id, latitude, longitude) FROM STDIN") as copy:
+        for row in hospitals.itertuples(index=False, name=None):
+            copy.write_row(row)
+
+    lock_hospitals(curr)
+    # Weeks with bed rows of hospitals that move to another state, read before the upsert changes it
+    curr.execute('''
+        SELECT ARRAY(
+            SELECT DISTINCT b.collection_week FROM HospitalBedInformation b
+            WHERE b.hospital_id IN (
+                SELECT l.hospital_id FROM hospital_staging s JOIN HospitalLocations l ON l.hospital_fk = s.hospital_pk
+                WHERE l.state IS DISTINCT FROM s.state))''')
+    moved_weeks = curr.fetchone()[0]
+
+    # Both upserts run in one statement so they see the same changed rows.
+    # xmax is 0 for a row version created by an insert, not by an update.
+    curr.execute(f'''
+        WITH changed AS (
+            SELECT s.*, {HOSPITAL_FINGERPRINT} AS fingerprint FROM hospital_staging s
+        ), changed_hospitals AS (
+            SELECT c.* FROM changed c LEFT JOIN Hospitals h ON h.hospital_pk = c.hospital_pk
+            WHERE h.fingerprint IS DISTINCT FROM c.fingerprint
+        ), hospitals AS (
+            INSERT INTO Hospitals (hospital_pk, hospital_id, hospital_name, fingerprint)
+            SELECT hospital_pk, hospital_id, hospital_name, fingerprint FROM changed_hospitals
+            ON CONFLICT (hospital_pk) DO UPDATE
+            SET hospital_name = EXCLUDED.hospital_name, fingerprint = EXCLUDED.fingerprint
+            RETURNING xmax = 0 AS inserted
+        ), locations AS (
+            INSERT INTO HospitalLocations (hospital_fk, hospital_id, state, address, city, zip, fips_code,
+                                           geocoded_hospital_address, latitude, longitude)
+            SELECT hospital_pk, hospital_id, state, address, city, zip, fips_code, geocoded_hospital_address, latitude, longitude
+            FROM changed_hospitals
+            ON CONFLICT (hospital_fk) DO UPDATE
+            SET state = EXCLUDED.state, address = EXCLUDED.address, city = EXCLUDED.city, zip = EXCLUDED.zip,
+                fips_code = EXCLUDED.fips_code, geocoded_hospital_address = EXCLUDED.geocoded_hospital_address,
+                latitude = EXCLUDED.latitude, longitude = EXCLUDED.longitude
+            RETURNING xmax = 0 AS inserted
+        )
+        SELECT 'Hospitals', inserted, count(*) FROM hospitals GROUP BY inserted
+        UNION ALL
+        SELECT 'HospitalLocations', inserted, count(*) FROM locations GROUP BY inserted''')
+    for table, inserted, n_rows in curr.fetchall():
+        counts[table]['success' if inserted else 'updated'] += n_rows
+
+    curr.execute("DROP TABLE hospital_staging")
+    if moved_weeks:
+        refresh_rollups(curr, moved_weeks)
+    return counts, rejects
+
+
+def insert_rows(curr, df, reasons, bed_tables=None, pipeline=False):
     """
-    Check if there is a duplicate entry in the specified table based on the provided column(s) and value(s).
+    Insert the bed rows of a preprocessed HHS DataFrame one at a time.
+    Duplicates (keys already in the table or repeated within the file) are
+    resolved against a key set fetched once per file instead of one query
+    per row.
+
+    In pipeline mode the rows are sent in batches of PIPELINE_BATCH_SIZE
+    instead, each in a savepoint and queued in psycopg pipeline mode, so a
+    batch costs one round trip rather than one per row. A failing batch is
+    split until the failing rows are isolated (see db.batch_insert_rows).
 
     Parameters:
     - curr: psycopg cursor
-    - table_name: str, name of the table to check for duplicates
-    - column_name: str, name of the column to check for duplicates
-    - value: value to check for in the specified column
-    - column_name2: str (optional), name of the second column to check for duplicates (default is None)
-    - value2: value (optional), value to check for in the second column (default is None)
+    - df: pandas df, preprocessed HHS data with missing values as None
+    - reasons: pandas Series, reason code of the rows failing BED_RULES or
+      DIMENSION_RULES (see apply_rules)
+    - bed_tables: dict (optional), week -> staging partition the week's bed
+      rows go to instead of HospitalBedInformation (see load_hhs_data)
+    - pipeline: bool, send the rows in batches in pipeline mode (default is False)
 
     Returns:
-    - bool, True if a duplicate entry exists, False otherwise
+    - dict, HospitalBedInformation success/error counts (see new_counts)
+    - dict, row index -> reason codes of the rows that were skipped or failed
     """
-    if column_name2 is None:
-        query = f"SELECT COUNT(*) FROM {table_name} WHERE {column_name} = %s"
-        curr.execute(query, (value,))
-    else:
-        value2 = str(value2)
-        query = f"SELECT COUNT(*) FROM {table_name} WHERE {column_name} = %s AND {column_name2} = %s"
-        curr.execute(query, (value, value2))
+    bed_tables = bed_tables or {}
+    counts = {'success': 0, 'updated': 0, 'errors': 0}
+    rejects = {}
+    # Rows and their indices per target table, inserted at the end in pipeline mode
+    pending = {}
+    with phase('duplicate_check'):
+        existing = load_existing_keys(curr, df, bed_tables)
 
-    count = curr.fetchone()[0]
-    return count > 0
+    with phase('insert'):
+        for index, row in df.iterrows():
+            hospital_id = row['hospital_id']
+            bed_key = (hospital_id, row['collection_week'])
 
+            try:
+                # Insert into HospitalBedInformation table
+                if bed_key not in existing:
+                    if reasons[index] is not None:
+                        print(f"Skipping row {index} due to {reasons[index]}")
+                        add_reject(rejects, index, reasons[index])
+                    else:
+                        bed_table = bed_tables.get(row['collection_week'], 'HospitalBedInformation')
+                        values = (hospital_id, row['collection_week'], *(row[column] for column in BED_COLUMNS))
+                        if pipeline:
+                            rows, indices = pending.setdefault(bed_table, ([], []))
+                            rows.append(values)
+                            indices.append(index)
+                        else:
+                            curr.execute(BED_INSERT_QUERY.format(bed_table=bed_table), values)
+                            counts['success'] += 1
+                        existing.add(bed_key)
+                else:
+                    print(f"Skipping row {index} due to duplicate ID and date in row: {row['hospital_pk']}, {row['collection_week']}")
+                    counts['errors'] += 1
+                    add_reject(rejects, index, 'duplicate_bed_week')
+            except Exception as e:
+                print(f"Error inserting data into HospitalBedInformation for row {index}: {e}")
+                add_reject(rejects, index, 'error_bed_week')
+
+        if pending:
+            with curr.connection.pipeline() as batch_pipeline:
+                for bed_table, (rows, indices) in pending.items():
+                    for i in range(0, len(rows), PIPELINE_BATCH_SIZE):
+                        n_success, n_fail, failed_ind = batch_insert_rows(
+                            curr, BED_INSERT_QUERY.format(bed_table=bed_table),
+                            rows[i:i + PIPELINE_BATCH_SIZE], indices[i:i + PIPELINE_BATCH_SIZE], batch_pipeline)
+                        counts['success'] += n_success
+                        for index in failed_ind:
+                            add_reject(rejects, index, 'error_bed_week')
+
+    return counts, rejects
 
-def load_hhs_data(csv_file, conn):
+
+def copy_insert_rows(curr, df, reasons, bed_tables=None):
+    """
+    Insert the bed rows of a preprocessed HHS DataFrame in bulk: every row is
+    streamed into a temporary staging table with COPY, then each target table
+    is filled with a single INSERT ... SELECT that skips keys that already
+    exist in the table or that are repeated within the file.
+
+    Parameters:
+    - curr: psycopg cursor
+    - df: pandas df, preprocessed HHS data with missing values as None
+    - reasons: pandas Series, reason code of the rows failing BED_RULES or
+      DIMENSION_RULES (see apply_rules)
+    - bed_tables: dict (optional), week -> staging partition the week's bed
+      rows go to instead of HospitalBedInformation (see load_hhs_data)
+
+    Returns:
+    - dict, HospitalBedInformation success/error counts (see new_counts)
+    - dict, row index -> reason codes of the rows that were skipped or failed
+    """
+    bed_tables = bed_tables or {}
+
+    # Rows failing a bed rule are never loaded into HospitalBedInformation
+    valid_beds = reasons.isna().to_numpy()
+
+    with phase('copy'):
+        curr.execute(f'''
+            CREATE TEMPORARY TABLE hhs_staging (
+                row_ind INTEGER,
+                hospital_id INTEGER,
+                collection_week DATE,
+                {', '.join(f"{column} FLOAT" for column in BED_COLUMNS)},
+                valid_beds BOOLEAN
+            ) ON COMMIT DROP''')
+
+        copy_columns = ['hospital_id'] + BED_COLUMNS + ['collection_week']
+        with curr.copy(f"COPY hhs_staging (row_ind, {', '.join(copy_columns)}, valid_beds) FROM STDIN") as copy:
+            for row_ind, row, valid in zip(df.index, df[copy_columns].itertuples(index=False, name=None), valid_beds):
+                copy.write_row((int(row_ind), *row, bool(valid)))
+
+        # Without statistics the planner expects a handful of rows per merge and
+        # joins the candidates to the inserted rows with a quadratic nested loop
+        curr.execute("ANALYZE hhs_staging")
+
+    # Staged weeks are merged into their staging partition, every other week
+    # into HospitalBedInformation
+    bed_targets = [(bed_table, f"collection_week = DATE '{week.isoformat()}'") for week, bed_table in bed_tables.items()]
+    staged_weeks = ', '.join(f"DATE '{week.isoformat()}'" for week in bed_tables)
+    bed_targets.append(('HospitalBedInformation', f"collection_week NOT IN ({staged_weeks})" if bed_tables else 'TRUE'))
+
+    rejects = {}
+    for index, reason in reasons.dropna().items():
+        add_reject(rejects, index, reason)
+
+    inserted_ind = set()
+    for bed_table, week_condition in bed_targets:
+        # The first occurrence of every new key is inserted, all other rows are duplicates
+        with phase('insert'):
+            curr.execute(f'''
+                WITH candidates AS (
+                    SELECT DISTINCT ON (hospital_id, collection_week) * FROM hhs_staging s
+                    WHERE valid_beds AND {week_condition} AND NOT EXISTS (
+                        SELECT 1 FROM {bed_table} t WHERE t.hospital_id = s.hospital_id AND t.collection_week = s.collection_week)
+                    ORDER BY hospital_id, collection_week, row_ind
+                ), inserted AS (
+                    INSERT INTO {bed_table} (hospital_id, collection_week, {', '.join(BED_COLUMNS)})
+                    SELECT hospital_id, collection_week, {', '.join(BED_COLUMNS)} FROM candidates
+                    RETURNING hospital_id, collection_week
+                )
+                SELECT c.row_ind FROM candidates c JOIN inserted USING (hospital_id, collection_week)''')
+            inserted_ind.update(row[0] for row in curr.fetchall())
+
+    duplicates = df.index[valid_beds & ~df.index.isin(inserted_ind)]
+    counts = {'success': len(inserted_ind), 'updated': 0, 'errors': len(duplicates)}
+    for index in duplicates:
+        add_reject(rejects, index, 'duplicate_bed_week')
+
+    curr.execute("DROP TABLE hhs_staging")
+    return counts, rejects
+
+
+def load_hhs_data(csv_file, conn, bulk=False, chunksize=None, tables=TABLES, rejects_path="invalid_data/hhs.csv",
+                  replace=False, profile=None, pipeline=False, checkpoint=False, raise_errors=False):
     """
     Load HHS (Health and Human Services) data from a CSV file into a PostgreSQL database.
 
+    The bed rows of a week that has no HospitalBedInformation partition yet
+    are loaded into a standalone staging table, which is attached as the
+    week's partition right before the commit (see partitions.py). Rows of
+    weeks that already have a partition are inserted into it directly.
+
+    The time spent in each phase, the row and reject counts, the round trips
+    and the peak memory of the load are written as one JSON record to
+    load_metrics.jsonl (see instrumentation.py).
+
     Parameters:
     - csv_file: str, path to the CSV file containing HHS data
     - conn: psycopg connection, connection to the PostgreSQL database
+    - bulk: bool, stream the rows through COPY into a staging table and merge
+      them with set-based statements instead of inserting them row by row
+      (default is False)
+    - chunksize: int (optional), read the file in chunks of this many rows,
+      parsing only the loaded columns, and send each chunk to the database
+      before reading the next so memory stays flat regardless of file size.
+      Rejects then hold the loaded columns only. (default is None, which
+      reads the whole file at once)
+    - tables: str tuple, tables to load, e.g. DIMENSION_TABLES to only load
+      the hospitals of a file (default is all of TABLES). Hospitals and
+      HospitalLocations share one fingerprint, so either one loads both.
+    - rejects_path: str, CSV file the rejected rows are written to
+      (default is invalid_data/hhs.csv)
+    - replace: bool, stage every week of the file, and swap the staged rows
+      in for the existing partitions of those weeks (default is False)
+    - profile: str (optional), file to write cProfile stats of the load to
+    - pipeline: bool, send the row-by-row inserts in batches in psycopg
+      pipeline mode, for remote databases with high latency (see
+      insert_rows). Bulk loads already use a few statements per file.
+      (default is False)
+    - checkpoint: bool, commit each chunk (of chunksize rows, or
+      CHECKPOINT_ROWS without one) with a checkpoint of the load, so the
+      transactions stay small and loading the file again after an
+      interruption resumes after the last committed chunk (see
+      checkpoints.py). The staging tables are kept until the final
+      transaction attaches them, so the new weeks still appear at once;
+      the hospitals and the rows of weeks that already had a partition are
+      visible chunk by chunk. (default is False)
+    - raise_errors: bool, re-raise the error of a failed load after rolling
+      it back, instead of printing it and returning None (default is False)
+
+    Returns:
+    - dict, 'rows' processed, 'inserted' HospitalBedInformation rows, rows
+      'rejected' and the per-table 'counts' (see new_counts), or None if the
+      load failed
 
     Raises:
-    - ValueError: If data loading fails
+    - Exception: The error of a failed load, if raise_errors is set
     """
-    df = pd.read_csv(csv_file)
+    with load_run('hhs', csv_file, conn, profile):
+        if chunksize is None:
+            # The raw rows are kept for the rejects file so the CSV is only parsed once
+            with phase('parse'):
+                raw_df = parse_cache.read_csv(csv_file)
+            if checkpoint:
+                chunks = (raw_df.iloc[start:start + CHECKPOINT_ROWS] for start in range(0, len(raw_df), CHECKPOINT_ROWS))
+            else:
+                chunks = [raw_df]
+        else:
+            chunks = timed_iter('parse', read_hhs_chunks(csv_file, chunksize))
 
-    # Do necessary processing on the DataFrame (e.g., handle -999 values, parse dates)
-    df.replace(-999999, None, inplace=True) 
-    df.replace({np.nan: None}, inplace=True)
+        counts = new_counts()
+        n_rows = 0
+        n_rejected = 0
+        weeks = set()
+        bed_tables = {}
+        keys = KeyMap()
+        start_time = time.time()
+        try:
+            # Create a cursor and open a transaction
+            with conn.cursor() as curr:
+                if checkpoint:
+                    content_hash = parse_cache.content_hash(csv_file)
+                    options = {'tables': list(tables), 'replace': replace}
+                    saved = read_checkpoint(curr, 'hhs', content_hash, options)
+                    if saved is not None:
+                        n_rows, state = saved
+                        counts = state['counts']
+                        n_rejected = state['rejected']
+                        weeks = {datetime.date.fromisoformat(week) for week in state['weeks']}
+                        bed_tables = {datetime.date.fromisoformat(week): staging
+                                      for week, staging in state['staging_tables'].items()}
+                        # Drop the rejects of the chunk that was not committed
+                        if os.path.exists(rejects_path):
+                            os.truncate(rejects_path, min(state['rejects_bytes'], os.path.getsize(rejects_path)))
+                        print(f"Resuming the load of {csv_file} after row {n_rows}.")
 
-    df = df.astype(float, errors='ignore')
-    df['collection_week'] = pd.to_datetime(df['collection_week'], format = '%Y-%m-%d').dt.date
+                for chunk in chunks:
+                    if checkpoint:
+                        # Skip the rows committed before the load was interrupted
+                        chunk = chunk[chunk.index >= n_rows]
+                        if chunk.empty:
+                            continue
 
-    hospitals_success_count = 0
-    hospitals_error_count = 0
+                    # Do necessary processing on the DataFrame (e.g., handle -999 values, parse dates)
+                    with phase('preprocess'):
+                        df = prepare_hhs_frame(chunk)
+                        reasons = apply_rules(df, BED_RULES)
+                        db_df = to_db_frame(df)
 
-    hospitallocation_success_count = 0
-    hospitallocation_error_count = 0
+                    # Look up the integer keys the rows are stored under
+                    with phase('hospital_keys'):
+                        db_df['hospital_id'] = keys.resolve(curr, db_df['hospital_pk'])
 
-    hospitalbedinformation_success_count = 0
-    hospitalbedinformation_error_count = 0
+                    # Stage the bed rows of weeks seen for the first time
+                    if 'HospitalBedInformation' in tables:
+                        with phase('stage_partitions'):
+                            for week in set(df['collection_week'].dropna()) - weeks:
+                                if replace or not partition_exists(curr, week):
+                                    bed_tables[week] = create_staging_partition(curr, week, replace and partition_exists(curr, week),
+                                                                                suffix=f"_load_{content_hash[:8]}" if checkpoint else '')
+                        weeks.update(df['collection_week'].dropna())
 
-    invalid_row_ind = []
-    start_time = time.time()
-    try:
-        # Create a cursor and open a transaction
-        with conn.cursor() as curr:
-            # Insert data into the database
-            for index, row in df.iterrows():
-                # print(f"Processing row {index}")
-
-                try:
-                    # Insert into Hospitals table
-                    if not check_duplicate_id(curr, 'Hospitals', 'hospital_pk', row['hospital_pk']):
-                        curr.execute(''' INSERT INTO Hospitals (hospital_pk, hospital_name) VALUES (%s, %s)''', 
-                            (row['hospital_pk'], row['hospital_name']))
-                        hospitals_success_count += 1
-                    else:
-                        print(f"Skipping row {index} due to duplicate ID in row: {row['hospital_pk']}")
-                        hospitals_error_count += 1
-                        invalid_row_ind.append(index)
-                except Exception as e:
-                    print(f"Error inserting data into Hospitals for row {index}: {e}")
-                    invalid_row_ind.append(index)
-
-                try:
-                    # Insert into HospitalLocations table
-                    if not check_duplicate_id(curr, 'HospitalLocations', 'hospital_fk', row['hospital_pk']):
-                        curr.execute(''' INSERT INTO HospitalLocations (hospital_fk, state, address, city, zip, fips_code, geocoded_hospital_address) VALUES (%s, %s, %s, %s, %s, %s, %s)''', 
-                            (row['hospital_pk'], row['state'], row['address'], row['city'], row['zip'], row['fips_code'], row['geocoded_hospital_address']))
-                        hospitallocation_success_count += 1
-                    else: 
-                        print(f"Skipping row {index} due to duplicate ID in row: {row['hospital_pk']}")
-                        hospitallocation_error_count += 1
-                        invalid_row_ind.append(index)
-                except Exception as e:
-                    print(f"Error inserting data into HospitalLocations for row {index}: {e}")
-                    invalid_row_ind.append(index)
-
-                try:
-                    # Insert into HospitalBedInformation table
-                    if not check_duplicate_id(curr, 'HospitalBedInformation', 'hospital_fk', row['hospital_pk'], 'collection_week', row['collection_week']):
-                        if (row['all_adult_hospital_beds_7_day_avg'] is not None) and (int(row['all_adult_hospital_beds_7_day_avg']) < 0):
-                            print(f"Skipping row {index} due to 'all_adult_hospital_beds_7_day_avg' less than 0")
-                            invalid_row_ind.append(index)
-                        elif (row['all_pediatric_inpatient_beds_7_day_avg'] is not None) and (int(row['all_pediatric_inpatient_beds_7_day_avg']) < 0):
-                            print(f"Skipping row {index} due to 'all_pediatric_inpatient_beds_7_day_avg' less than 0")
-                            invalid_row_ind.append(index)
-                        elif (row['all_adult_hospital_inpatient_bed_occupied_7_day_coverage'] is not None) and (int(row['all_adult_hospital_inpatient_bed_occupied_7_day_coverage']) < 0):
-                            print(f"Skipping row {index} due to 'all_adult_hospital_inpatient_bed_occupied_7_day_coverage' less than 0")
-                            invalid_row_ind.append(index)
-                        elif (row['all_pediatric_inpatient_bed_occupied_7_day_avg'] is not None) and (int(row['all_pediatric_inpatient_bed_occupied_7_day_avg']) < 0):
-                            print(f"Skipping row {index} due to 'all_pediatric_inpatient_bed_occupied_7_day_avg' less than 0")
-                            invalid_row_ind.append(index)
-                        elif (row['total_icu_beds_7_day_avg'] is not None) and (int(row['total_icu_beds_7_day_avg']) < 0):
-                            print(f"Skipping row {index} due to 'total_icu_beds_7_day_avg' less than 0")
-                            invalid_row_ind.append(index)
-                        elif (row['icu_beds_used_7_day_avg'] is not None) and (int(row['icu_beds_used_7_day_avg']) < 0):
-                            print(f"Skipping row {index} due to 'icu_beds_used_7_day_avg' less than 0")
-                            invalid_row_ind.append(index)
-                        elif (row['inpatient_beds_used_covid_7_day_avg']is not None) and (int(row['inpatient_beds_used_covid_7_day_avg']) < 0):
-                            print(f"Skipping row {index} due to 'inpatient_beds_used_covid_7_day_avg' less than 0")
-                            invalid_row_ind.append(index)
-                        elif (row['staffed_icu_adult_patients_confirmed_covid_7_day_avg'] is not None) and (int(row['staffed_icu_adult_patients_confirmed_covid_7_day_avg']) < 0):
-                            print(f"Skipping row {index} due to 'staffed_icu_adult_patients_confirmed_covid_7_day_avg' less than 0")
-                            invalid_row_ind.append(index)
+                    # Apply the new and changed hospitals, then insert the bed rows
+                    rejects = {}
+                    if any(table in tables for table in DIMENSION_TABLES):
+                        with phase('dimensions'):
+                            dimension_counts, rejects = merge_hospitals(curr, db_df)
+                        add_counts(counts, dimension_counts)
+                    if 'HospitalBedInformation' in tables:
+                        # The bed rows of a hospital that is not merged would reference no hospital
+                        reasons = reasons.where(reasons.notna(), apply_rules(db_df, DIMENSION_RULES))
+                        if bulk:
+                            bed_counts, bed_rejects = copy_insert_rows(curr, db_df, reasons, bed_tables)
                         else:
-                            curr.execute(''' INSERT INTO HospitalBedInformation (hospital_fk, collection_week, all_adult_hospital_beds_7_day_avg, all_pediatric_inpatient_beds_7_day_avg, 
-                                all_adult_hospital_inpatient_bed_occupied_7_day_coverage, all_pediatric_inpatient_bed_occupied_7_day_avg, 
-                                total_icu_beds_7_day_avg, icu_beds_used_7_day_avg, inpatient_beds_used_covid_7_day_avg, 
-                                staffed_icu_adult_patients_confirmed_covid_7_day_avg)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''', 
-                            (row['hospital_pk'], row['collection_week'], row['all_adult_hospital_beds_7_day_avg'], row['all_pediatric_inpatient_beds_7_day_avg'],
-                            row['all_adult_hospital_inpatient_bed_occupied_7_day_coverage'], row['all_pediatric_inpatient_bed_occupied_7_day_avg'],
-                            row['total_icu_beds_7_day_avg'], row['icu_beds_used_7_day_avg'], row['inpatient_beds_used_covid_7_day_avg'],
-                            row['staffed_icu_adult_patients_confirmed_covid_7_day_avg']))
-                            hospitalbedinformation_success_count += 1
-                    else: 
-                        print(f"Skipping row {index} due to duplicate ID and date in row: {row['hospital_pk']}, {row['collection_week']}")
-                        hospitalbedinformation_error_count += 1
-                        invalid_row_ind.append(index)
-                except Exception as e:
-                    print(f"Error inserting data into HospitalBedInformation for row {index}: {e}")
-                    invalid_row_ind.append(index)
-
-            # Commit the changes
-            conn.commit()
-            end_time = time.time()
-            print(end_time - start_time)
-            
-            # Write out csv file that includes original rows that are invalid
-            with open("invalid_data/hhs.csv", "w", encoding="utf-8") as f:
-                orig_df = pd.read_csv(csv_file, dtype=object)
-                f.write(orig_df.iloc[invalid_row_ind].to_csv(index=False, lineterminator='\r'))
-
-            print("Data loaded successfully.")
-            print(f"Total rows processed: {len(df)}")
-            print(f"Successful Hospitals inserts: {hospitals_success_count}, Errors: {hospitals_error_count}")
-            print(f"Successful HospitalLocations inserts: {hospitallocation_success_count}, Errors: {hospitallocation_error_count}")
-            print(f"Successful HospitalBedInformation inserts: {hospitalbedinformation_success_count}, Errors: {hospitalbedinformation_error_count}")
-
-    except Exception as e:
-        print(f"Error: {e}")
-        # Rollback the transaction in case of an error
-        conn.rollback()
-        print("Data loading failed.")
+                            bed_counts, bed_rejects = insert_rows(curr, db_df, reasons, bed_tables, pipeline)
+                        add_counts(counts, {'HospitalBedInformation': bed_counts})
+                        for index, row_reasons in bed_rejects.items():
+                            for reason in row_reasons:
+                                add_reject(rejects, index, reason)
+                    count_rejects(rejects)
+                    n_rejected += len(rejects)
 
+                    # Write out csv file that includes original rows that are invalid
+                    with phase('rejects'):
+                        write_rejects(chunk, rejects, rejects_path, append=n_rows > 0)
+                    n_rows += len(df)
 
-if __name__ == "__main__":
-    import sys
+                    # Commit the chunk together with how far the load got
+                    if checkpoint:
+                        with phase('checkpoint'):
+                            save_checkpoint(curr, 'hhs', content_hash, csv_file, n_rows, options, {
+                                'counts': counts,
+                                'rejected': n_rejected,
+                                'weeks': sorted(week.isoformat() for week in weeks),
+                                'staging_tables': {week.isoformat(): staging for week, staging in bed_tables.items()},
+                                'rejects_bytes': os.path.getsize(rejects_path),
+                            })
+                            conn.commit()
+
+                # Make the staged weeks visible, a short step that does not block readers
+                with phase('attach_partitions'):
+                    for week, staging in sorted(bed_tables.items()):
+                        attach_partition(curr, week, staging)
+
+                # Keep the weekly rollups in step with the rows of this load
+                if weeks:
+                    with phase('rollups'):
+                        refresh_rollups(curr, sorted(weeks))
 
-    if len(sys.argv) != 2:
-        print("Usage: python load_hhs.py <csv_file>")
-        sys.exit(1)
+                # Commit the changes
+                with phase('commit'):
+                    record_ingest(curr, 'hhs', csv_file, sum(table_counts['success'] for table_counts in counts.values()))
+                    if checkpoint:
+                        clear_checkpoint(curr, 'hhs', content_hash)
+                    conn.commit()
+                # Bring the dashboard's DuckDB exports up to date, if they are used
+                if analytics.enabled():
+                    with phase('analytics'):
+                        analytics.refresh(conn, 'hhs')
+                end_time = time.time()
+                print(end_time - start_time)
+
+                count('rows_read', n_rows)
+                set_value('inserted', {table: table_counts['success'] for table, table_counts in counts.items() if table in tables})
+                set_value('updated', {table: counts[table]['updated'] for table in DIMENSION_TABLES if table in tables})
+
+                print("Data loaded successfully.")
+                print(f"Total rows processed: {n_rows}")
+                for table, table_counts in counts.items():
+                    if table in DIMENSION_TABLES and table in tables:
+                        print(f"Successful {table} inserts: {table_counts['success']}, Updates: {table_counts['updated']}, Errors: {table_counts['errors']}")
+                    elif table in tables:
+                        print(f"Successful {table} inserts: {table_counts['success']}, Errors: {table_counts['errors']}")
+
+                return {'rows': n_rows, 'inserted': counts['HospitalBedInformation']['success'], 'rejected': n_rejected,
+                        'counts': counts}
+
+        except Exception as e:
+            print(f"Error: {e}")
+            # Rollback the transaction in case of an error
+            conn.rollback()
+            set_status('failed')
+            count('rows_read', n_rows)
+            print("Data loading failed.")
+            if raise_errors:
+                raise
+
+
+if __name__ == "__main__":
+    import argparse
 
-    csv_file = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Load a weekly HHS file into the database.")
+    parser.add_argument("csv_file", help="path to the HHS CSV file")
+    parser.add_argument("--bulk", action="store_true", help="load through COPY and set-based merges")
+    parser.add_argument("--chunksize", type=int, help="stream the file in chunks of this many rows")
+    parser.add_argument("--replace", action="store_true", help="replace the rows of the file's weeks that are already loaded")
+    parser.add_argument("--profile", metavar="FILE", help="write cProfile stats of the load to FILE")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="send the inserts in batches in pipeline mode, for high-latency connections")
+    parser.add_argument("--checkpoint", action="store_true",
+                        help="commit the file in chunks, resuming an interrupted load of it")
+    args = parser.parse_args()
 
     try:
-        with psycopg.connect(
-                host="pinniped.postgres.database.azure.com",
-                dbname=DB_USER,
-                user=DB_USER,
-                password=DB_PASSWORD
-        ) as conn:
-            load_hhs_data(csv_file, conn)
+        with psycopg.connect(get_conninfo()) as conn:
+            load_hhs_data(args.csv_file, conn, bulk=args.bulk, chunksize=args.chunksize, replace=args.replace,
+                          profile=args.profile, pipeline=args.pipeline, checkpoint=args.checkpoint)
     except ValueError as ve:
         print(ve)
     finally:
@@ -1,84 +1,239 @@
 import pandas as pd
 import numpy as np
 import psycopg
+import contextlib
+import hashlib
 import logging
 import sys
-from credentials import DB_USER, DB_PASSWORD
+import analytics
+import parse_cache
+from checkpoints import read_checkpoint, save_checkpoint, clear_checkpoint
+from db import get_conninfo, record_ingest, batch_insert_rows
+from hospital_keys import KeyMap, normalize_ccn
+from instrumentation import load_run, phase, count, count_rejects, set_value, set_status
 from logging_module import setup_logging
+from validation import missing, negative, apply_rules, add_reject, write_rejects
 
 
 setup_logging()
 
 
-def check_duplicate_ids(curr, table_name, facility_ids, date):
+# Rows failing any of these rules are rejected before they reach the database
+QUALITY_RULES = [
+    missing('facility_id'),
+    negative('hospital_overall_rating'),
+]
+
+# Attributes tracked by the validity intervals in HospitalQualityHistory
+QUALITY_ATTRIBUTES = ['hospital_overall_rating', 'emergency_services', 'hospital_type', 'hospital_ownership']
+
+
+def check_duplicate_ids(curr, table_name, hospital_ids, date):
     """
-    Check if there are duplicate entries for the given facility IDs and date
+    Check if there are duplicate entries for the given facilities and date
     in the specified table.
 
     Parameters:
     - curr: psycopg cursor
     - table_name: str, name of the table to check for duplicates
-    - facility_ids: int list, facility IDs to check for duplicates
+    - hospital_ids: int list, hospital ids of the facilities to check for duplicates
     - date: date, date to check for duplicates
 
     Returns:
-    - list, facility IDs with duplicates
+    - list, hospital ids with duplicates
     """
-    placeholders = ', '.join(['%s'] * len(facility_ids))
-    query = f"SELECT facility_id FROM {table_name} WHERE facility_id IN ({placeholders}) AND data_date = %s"
-    curr.execute(query, facility_ids + [date])
+    query = f"SELECT hospital_id FROM {table_name} WHERE hospital_id = ANY(%s) AND data_date = %s"
+    curr.execute(query, (hospital_ids, date))
     duplicates = [row[0] for row in curr.fetchall()]
     return duplicates
 
 
-def batch_insert_rows(curr, insert_query, rows, df):
+def attributes_hash(df):
     """
-    Perform batch inserts for a list of rows.
+    Fingerprint the tracked quality attributes of each facility.
+
+    Parameters:
+    - df: pandas df, with the QUALITY_ATTRIBUTES columns
+
+    Returns:
+    - pandas Series, md5 hex digest of each row's attributes
+    """
+    values = df[QUALITY_ATTRIBUTES].astype(object)
+    values['hospital_overall_rating'] = df['hospital_overall_rating'].astype(float)
+    joined = values.where(values.notna(), None).astype(str).agg('|'.join, axis=1)
+    return joined.map(lambda value: hashlib.md5(value.encode('utf-8')).hexdigest())
+
+
+def apply_quality_delta(curr, df, date):
+    """
+    Record a quality snapshot in HospitalQualityHistory by only writing the
+    facilities whose attributes differ from the open interval of the most
+    recent prior snapshot.
+
+    Changed facilities get their open interval closed at `date` and a new one
+    opened; new facilities get a new interval; facilities missing from the
+    snapshot have their interval closed; unchanged facilities are not touched.
+    Snapshots must be applied in date order.
 
     Parameters:
     - curr: psycopg cursor
-    - insert_query: str, SQL insert query
-    - rows: list of tuples, rows to be inserted
-    - df: pandas df, original df that was inputted 
+    - df: pandas df, one row per facility with hospital_id and QUALITY_ATTRIBUTES
+    - date: date, date of the snapshot
 
     Returns:
-    - int, number of successfully inserted rows
-    - int, number of failures for inserting rows
-    - int list, list that keeps track of indicies of the failed rows
+    - dict, number of 'new', 'changed', 'unchanged' and 'closed' facilities
     """
-    try:
-        # Start a new transaction
-        curr.execute('BEGIN')
-        curr.executemany(insert_query, rows)
-        # Commit the transaction
-        curr.execute('COMMIT')
-        return len(rows), 0, []
-
-    except psycopg.Error:
-        curr.execute('ROLLBACK')
-        num_rows_inserted = 0
-        num_rows_failed = 0
-        batch_invalid_ind = []
+    hashes = attributes_hash(df)
+    curr.execute("SELECT hospital_id, attributes_hash FROM HospitalQualityHistory WHERE valid_to IS NULL")
+    current = dict(curr.fetchall())
+
+    previous = df['hospital_id'].map(current)
+    is_new = previous.isna()
+    is_changed = ~is_new & (previous != hashes)
+    gone = set(current) - set(df['hospital_id'])
+    to_close = df.loc[is_changed, 'hospital_id'].tolist() + sorted(gone)
 
-        # Handle individual row insertions and log errors
-        for row in rows:
-            try:
-                curr.execute('BEGIN')
-                curr.execute(insert_query, row)
-                curr.execute('COMMIT')
-                num_rows_inserted += 1
-            except psycopg.Error as row_error:
-                num_rows_failed += 1
-                index = (df == row).all(axis=1).idxmax()
-                logging.error(f"Error inserting row {index} in the batch: {row_error}")
-                # Rollback the transaction for the specific row
-                curr.execute('ROLLBACK')
-                batch_invalid_ind.append(index)
+    if to_close:
+        curr.execute("UPDATE HospitalQualityHistory SET valid_to = %s WHERE valid_to IS NULL AND hospital_id = ANY(%s)",
+                     (date, to_close))
 
-        return num_rows_inserted, num_rows_failed, batch_invalid_ind
+    to_write = df.loc[is_new | is_changed, ['hospital_id'] + QUALITY_ATTRIBUTES].astype(object)
+    to_write = to_write.where(to_write.notna(), None)
+    with curr.copy(f"COPY HospitalQualityHistory (hospital_id, {', '.join(QUALITY_ATTRIBUTES)}, attributes_hash, valid_from) FROM STDIN") as copy:
+        for row, row_hash in zip(to_write.itertuples(index=False, name=None), hashes[is_new | is_changed]):
+            copy.write_row((*row, row_hash, date))
 
+    curr.execute("INSERT INTO QualitySnapshots (data_date) VALUES (%s)", (date,))
+    return {'new': int(is_new.sum()), 'changed': int(is_changed.sum()),
+            'unchanged': int((~is_new & ~is_changed).sum()), 'closed': len(gone)}
 
-def load_quality_data(csv_file, conn, date):
+
+def insert_quality_snapshot(curr, df, date):
+    """
+    Record a snapshot older than the latest one in HospitalQualityHistory,
+    between the snapshots before and after it.
+
+    The interval of a facility in effect on `date` is split there when the
+    snapshot changes its attributes or leaves it out, and the part from the
+    next snapshot on keeps the old attributes. Facilities the snapshot
+    changes or adds get an interval up to the next snapshot, or have their
+    interval starting there moved back to `date` if its attributes match.
+
+    Parameters:
+    - curr: psycopg cursor
+    - df: pandas df, one row per facility with hospital_id and QUALITY_ATTRIBUTES
+    - date: date, date of the snapshot, older than the latest one and not
+      in QualitySnapshots yet
+
+    Returns:
+    - dict, number of 'new', 'changed', 'unchanged' and 'closed' facilities
+    """
+    curr.execute("SELECT MIN(data_date) FROM QualitySnapshots WHERE data_date > %s", (date,))
+    next_date = curr.fetchone()[0]
+    hashes = attributes_hash(df)
+    curr.execute('''
+        SELECT hospital_id, history_id, attributes_hash FROM HospitalQualityHistory
+        WHERE valid_from <= %s AND (valid_to IS NULL OR valid_to > %s)''', (date, date))
+    covering = {hospital_id: (history_id, row_hash) for hospital_id, history_id, row_hash in curr.fetchall()}
+    curr.execute("SELECT hospital_id, history_id, attributes_hash FROM HospitalQualityHistory WHERE valid_from = %s",
+                 (next_date,))
+    starting = {hospital_id: (history_id, row_hash) for hospital_id, history_id, row_hash in curr.fetchall()}
+
+    previous = df['hospital_id'].map({hospital_id: row_hash for hospital_id, (_, row_hash) in covering.items()})
+    is_new = previous.isna()
+    is_changed = ~is_new & (previous != hashes)
+    gone = set(covering) - set(df['hospital_id'])
+
+    # Split the intervals in effect on date, the part from the next snapshot on keeping its attributes
+    to_split = [covering[hospital_id][0] for hospital_id in df.loc[is_changed, 'hospital_id'].tolist() + sorted(gone)]
+    if to_split:
+        columns = ', '.join(QUALITY_ATTRIBUTES)
+        curr.execute(f'''
+            INSERT INTO HospitalQualityHistory (hospital_id, {columns}, attributes_hash, valid_from, valid_to)
+            SELECT hospital_id, {columns}, attributes_hash, valid_from, %s FROM HospitalQualityHistory
+            WHERE history_id = ANY(%s)''', (date, to_split))
+        # The interval itself becomes the remainder, so an open one stays the only open one
+        curr.execute("DELETE FROM HospitalQualityHistory WHERE history_id = ANY(%s) AND valid_to <= %s",
+                     (to_split, next_date))
+        curr.execute("UPDATE HospitalQualityHistory SET valid_from = %s WHERE history_id = ANY(%s)",
+                     (next_date, to_split))
+
+    # The new attributes hold until the next snapshot, or as long as its interval if they match it
+    written = is_new | is_changed
+    extends = [hospital_id in starting and starting[hospital_id][1] == row_hash
+               for hospital_id, row_hash in zip(df.loc[written, 'hospital_id'], hashes[written])]
+    extended = [starting[hospital_id][0] for hospital_id in df.loc[written, 'hospital_id'][extends]]
+    if extended:
+        curr.execute("UPDATE HospitalQualityHistory SET valid_from = %s WHERE history_id = ANY(%s)", (date, extended))
+    inserted = [not extend for extend in extends]
+    to_write = df.loc[written, ['hospital_id'] + QUALITY_ATTRIBUTES][inserted].astype(object)
+    to_write = to_write.where(to_write.notna(), None)
+    with curr.copy(f"COPY HospitalQualityHistory (hospital_id, {', '.join(QUALITY_ATTRIBUTES)}, attributes_hash, valid_from, valid_to) FROM STDIN") as copy:
+        for row, row_hash in zip(to_write.itertuples(index=False, name=None), hashes[written][inserted]):
+            copy.write_row((*row, row_hash, date, next_date))
+
+    curr.execute("INSERT INTO QualitySnapshots (data_date) VALUES (%s)", (date,))
+    return {'new': int(is_new.sum()), 'changed': int(is_changed.sum()),
+            'unchanged': int((~is_new & ~is_changed).sum()), 'closed': len(gone)}
+
+
+def record_quality_snapshot(curr, df, date):
+    """
+    Record a snapshot in HospitalQualityHistory, after the latest one (see
+    apply_quality_delta) or between older ones (see insert_quality_snapshot).
+
+    Parameters:
+    - curr: psycopg cursor
+    - df: pandas df, one row per facility with hospital_id and QUALITY_ATTRIBUTES
+    - date: date, date of the snapshot
+
+    Returns:
+    - dict, number of 'new', 'changed', 'unchanged' and 'closed' facilities,
+      or None if a snapshot of that date is already recorded
+    """
+    curr.execute("SELECT EXISTS (SELECT 1 FROM QualitySnapshots WHERE data_date = %s)", (date,))
+    if curr.fetchone()[0]:
+        return None
+    latest = latest_snapshot(curr)
+    if latest is None or date > latest:
+        return apply_quality_delta(curr, df, date)
+    return insert_quality_snapshot(curr, df, date)
+
+
+def latest_snapshot(curr):
+    """
+    Returns:
+    - date, most recent snapshot recorded in HospitalQualityHistory, or None
+    """
+    curr.execute("SELECT MAX(data_date) FROM QualitySnapshots")
+    return curr.fetchone()[0]
+
+
+def rebuild_quality_history(conn):
+    """
+    Recompute HospitalQualityHistory from the full snapshots stored in
+    HospitalQualityInformation, oldest first, e.g. after rows were changed
+    outside the loader. Migration 13 does the same for snapshots loaded
+    before the history existed.
+
+    Parameters:
+    - conn: psycopg connection, connection to the PostgreSQL database
+    """
+    with conn.cursor() as curr:
+        curr.execute("TRUNCATE HospitalQualityHistory, QualitySnapshots")
+        curr.execute("SELECT DISTINCT data_date FROM HospitalQualityInformation ORDER BY data_date")
+        for (date,) in curr.fetchall():
+            curr.execute(f"SELECT hospital_id, {', '.join(QUALITY_ATTRIBUTES)} FROM HospitalQualityInformation WHERE data_date = %s", (date,))
+            df = pd.DataFrame(curr.fetchall(), columns=['hospital_id'] + QUALITY_ATTRIBUTES).drop_duplicates('hospital_id')
+            counts = apply_quality_delta(curr, df, date)
+            logging.info(f"Snapshot {date}: {counts['new']} new, {counts['changed']} changed, {counts['unchanged']} unchanged, {counts['closed']} closed")
+        record_ingest(curr, 'quality_history', None, None)
+    conn.commit()
+    analytics.refresh(conn, 'quality')
+
+
+def load_quality_data(csv_file, conn, date, rejects_path="invalid_data/quality.csv", delta=False, profile=None,
+                      pipeline=False, checkpoint=False, raise_errors=False):
     """
     Load quality data from a CSV file into a PostgreSQL database.
 
@@ -89,81 +244,212 @@ def load_quality_data(csv_file, conn, date):
     - csv_file: str, path to the CSV file containing quality data
     - conn: psycopg connection, connection to the PostgreSQL database
     - date: str, date in 'YYYY-MM-DD' format
+    - rejects_path: str, CSV file the rejected rows are written to
+      (default is invalid_data/quality.csv)
+    - delta: bool, only record the facilities that changed since the previous
+      snapshot in HospitalQualityHistory instead of also storing a full copy
+      in HospitalQualityInformation (default is False). In both modes the
+      snapshot is visible through the HospitalQualitySnapshots view.
+    - profile: str (optional), file to write cProfile stats of the load to
+    - pipeline: bool, queue the batches in psycopg pipeline mode so each one
+      costs a single round trip instead of about four, for remote databases
+      with high latency (default is False)
+    - checkpoint: bool, commit each batch of 500 rows with a checkpoint of
+      the load instead of keeping them all in one transaction, so loading
+      the file again after an interruption resumes after the last committed
+      batch (see checkpoints.py). The history is recorded in the final
+      transaction. Delta loads write a single statement per table and are
+      not checkpointed. (default is False)
+    - raise_errors: bool, re-raise the PostgreSQL error of a failed load
+      after rolling it back, instead of logging it and returning None
+      (default is False)
 
     Returns:
-    - None, but logs how many rows have been successfully inserted and how many
-      are not.
+    - dict, number of 'rows' read, 'inserted' and 'rejected', or None if the
+      load failed. Also logs how many rows have been successfully inserted
+      and how many are not. The per-phase metrics of the load are written to
+      load_metrics.jsonl (see instrumentation.py).
     """
-    # Read csv file
-    column_names = ["Facility ID", "Hospital overall rating", "Emergency Services", "Hospital Type", "Hospital Ownership"]
-    df = pd.read_csv(csv_file, dtype=object, usecols=column_names)
+    with load_run('quality', csv_file, conn, profile):
+        # Read csv file, keeping the raw rows for the rejects file so it is only parsed once
+        column_names = ["Facility ID", "Hospital Type", "Hospital Ownership", "Emergency Services", "Hospital overall rating"]
+        with phase('parse'):
+            raw_df = parse_cache.read_csv(csv_file)
+        count('rows_read', len(raw_df))
 
-    # Df pre-processing
-    df.columns = df.columns.str.lower().str.replace(" ", "_")
-    df.replace({np.nan: None, 'Not Available': 0}, inplace=True)
-    df['hospital_overall_rating'] = df['hospital_overall_rating'].astype(float)
-    df['emergency_services'] = df['emergency_services'].replace({'Yes': True, 'No': False})
-    date = pd.to_datetime(date).date()
-    df['data_date'] = date
+        # Df pre-processing
+        with phase('preprocess'):
+            df = raw_df[column_names].copy()
+            df.columns = df.columns.str.lower().str.replace(" ", "_")
+            df['facility_id'] = normalize_ccn(df['facility_id'])
+            df.replace({np.nan: None, 'Not Available': 0}, inplace=True)
+            df['hospital_overall_rating'] = df['hospital_overall_rating'].astype(float)
+            df['emergency_services'] = df['emergency_services'].replace({'Yes': True, 'No': False})
+            date = pd.to_datetime(date).date()
+            df['data_date'] = date
 
-    num_rows_inserted = 0
-    error_count = 0
+            reasons = apply_rules(df, QUALITY_RULES)
+            rejects = {}
+            for index, reason in reasons.dropna().items():
+                add_reject(rejects, index, reason)
+            df = df[reasons.isna()]
 
-    try:
-        with conn.cursor() as curr:
-            insert_query = '''
-                INSERT INTO HospitalQualityInformation (facility_id, hospital_type, hospital_ownership, emergency_services, hospital_overall_rating, data_date)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            '''
-
-            # Determine duplicates (by 'facility_id' and 'date').
-            #  - indices of rows that are duplicates will be kept for later writing out to csv file
-            #  - valid_df is the new df that we will look at, which DOES NOT include any duplicate rows
-            facility_ids = df['facility_id'].tolist()
-            duplicates = set(check_duplicate_ids(curr, 'HospitalQualityInformation', facility_ids, date))
-            invalid_ind = df['facility_id'].isin(duplicates).index[df['facility_id'].isin(duplicates)].tolist()
-            n_dups = len(invalid_ind)
-            valid_df = df[~df['facility_id'].isin(duplicates)]
-            rows_to_insert = [tuple(row) for row in valid_df.itertuples(index=False, name=None)]
-
-            # Inserts 500 rows at once to SQL
-            batch_size = 500
-            for i in range(0, len(rows_to_insert), batch_size):
-                batch = rows_to_insert[i:i + batch_size]
-                n_success, n_fail, new_invalid_ind = batch_insert_rows(curr, insert_query, batch, df)
-                num_rows_inserted += n_success
-                error_count += n_fail
-                invalid_ind.extend(new_invalid_ind)
-
-            conn.commit()
-
-            # Write out csv file that includes original rows that are invalid
-            with open("invalid_data/quality.csv", "w", encoding="utf-8") as f:
-                orig_df = pd.read_csv(csv_file, dtype=object)
-                f.write(orig_df.iloc[invalid_ind].to_csv(index=False, lineterminator='\r'))
-
-            logging.info("Data loaded successfully.")
-            logging.info(f"{num_rows_inserted} successful inserts out of {len(df)}, errors: ({n_dups} duplicates, {error_count} errors)")
+        num_rows_inserted = 0
+        error_count = 0
+        checkpoint = checkpoint and not delta
+        rows_done = 0
 
-    except psycopg.Error as e:
-        logging.error(f"Data loading failed due to PostgreSQL error: {e}")
-        conn.rollback()
+        try:
+            with conn.cursor() as curr:
+                if checkpoint:
+                    content_hash = parse_cache.content_hash(csv_file)
+                    options = {'date': date.isoformat()}
+                    saved = read_checkpoint(curr, 'quality', content_hash, options)
+                    if saved is not None:
+                        # The rows before rows_done are committed, with the rejects recorded for them
+                        rows_done, state = saved
+                        num_rows_inserted = state['inserted']
+                        error_count = state['errors']
+                        rejects = {index: reasons for index, reasons in rejects.items() if index >= rows_done}
+                        rejects.update({int(index): reasons for index, reasons in state['rejects'].items()})
+                        logging.info(f"Resuming the load of {csv_file} after row {rows_done}")
+
+                # Look up the integer keys the rows are stored under
+                with phase('hospital_keys'):
+                    hospital_ids = KeyMap().resolve(curr, df['facility_id'])
+                    df = df.drop(columns='facility_id')
+                    df.insert(0, 'hospital_id', hospital_ids)
+
+                insert_query = '''
+                    INSERT INTO HospitalQualityInformation (hospital_id, hospital_type, hospital_ownership, emergency_services, hospital_overall_rating, data_date)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                '''
+
+                # Determine duplicates (by 'hospital_id' and 'date').
+                #  - indices of rows that are duplicates will be kept for later writing out to csv file
+                #  - valid_df is the new df that we will look at, which DOES NOT include any duplicate rows
+                with phase('duplicate_check'):
+                    latest = latest_snapshot(curr)
+                    if delta:
+                        if latest is not None and date < latest:
+                            logging.error(f"Data loading failed: delta loads must be in date order, {date} is older than {latest}")
+                            conn.rollback()
+                            set_status('failed')
+                            return None
+                        duplicates = set(df['hospital_id']) if date == latest else set()
+                    else:
+                        # The rows committed before an interruption would count as duplicates of themselves
+                        hospital_ids = df.loc[df.index >= rows_done, 'hospital_id'].tolist()
+                        duplicates = set(check_duplicate_ids(curr, 'HospitalQualityInformation', hospital_ids, date))
+                is_duplicate = (df['hospital_id'].isin(duplicates) | df['hospital_id'].duplicated()) & (df.index >= rows_done)
+                for index in df.index[is_duplicate]:
+                    add_reject(rejects, index, 'duplicate_facility_date')
+                n_dups = sum('duplicate_facility_date' in reasons for reasons in rejects.values())
+                valid_df = df[~df.index.isin(list(rejects))]
+                pending_df = valid_df[valid_df.index >= rows_done]
+                rows_to_insert = [tuple(row) for row in pending_df.itertuples(index=False, name=None)]
+                row_indices = pending_df.index.tolist()
+
+                # Inserts 500 rows at once to SQL, each batch in a savepoint of the load's transaction,
+                # or in a transaction of its own that commits it with its checkpoint. Delta loads skip
+                # the full copy and only write HospitalQualityHistory below.
+                batch_size = 500
+                failed_ind = []
+                if not delta:
+                    if checkpoint:
+                        # Commit the hospital keys, so each batch's transaction block is a top-level
+                        # transaction and not a savepoint of the one the lookups opened
+                        conn.commit()
+                    insert_pipeline = conn.pipeline() if pipeline else contextlib.nullcontext()
+                    with phase('insert'), insert_pipeline as batch_pipeline:
+                        for i in range(0, len(rows_to_insert), batch_size):
+                            batch = rows_to_insert[i:i + batch_size]
+                            with conn.transaction() if checkpoint else contextlib.nullcontext():
+                                n_success, n_fail, new_invalid_ind = batch_insert_rows(curr, insert_query, batch, row_indices[i:i + batch_size], batch_pipeline)
+                                num_rows_inserted += n_success
+                                error_count += n_fail
+                                failed_ind.extend(new_invalid_ind)
+                                for index in new_invalid_ind:
+                                    add_reject(rejects, index, 'insert_error')
+                                if checkpoint:
+                                    rows_done = row_indices[min(i + batch_size, len(row_indices)) - 1] + 1
+                                    save_checkpoint(curr, 'quality', content_hash, csv_file, rows_done, options, {
+                                        'inserted': num_rows_inserted,
+                                        'errors': error_count,
+                                        'rejects': {index: reasons for index, reasons in rejects.items() if index < rows_done},
+                                    })
+
+                # Record the snapshot in the validity intervals of HospitalQualityHistory, also when it is
+                # older than the latest one. Delta loads of older snapshots were refused above.
+                history_counts = None
+                if len(valid_df) > 0:
+                    with phase('history'):
+                        history_counts = record_quality_snapshot(curr, valid_df.drop(index=failed_ind), date)
+                if history_counts is not None:
+                    set_value('history', history_counts)
+                    logging.info(f"History: {history_counts['new']} new, {history_counts['changed']} changed, "
+                                 f"{history_counts['unchanged']} unchanged, {history_counts['closed']} closed facilities")
+                    if delta:
+                        num_rows_inserted = history_counts['new'] + history_counts['changed']
+
+                with phase('commit'):
+                    record_ingest(curr, 'quality', csv_file, num_rows_inserted)
+                    if checkpoint:
+                        clear_checkpoint(curr, 'quality', content_hash)
+                    conn.commit()
+                # Bring the dashboard's DuckDB exports up to date, if they are used
+                if analytics.enabled():
+                    with phase('analytics'):
+                        analytics.refresh(conn, 'quality')
+                set_value('inserted', {'HospitalQualityHistory' if delta else 'HospitalQualityInformation': num_rows_inserted})
+                count_rejects(rejects)
+
+                # Write out csv file that includes original rows that are invalid
+                with phase('rejects'):
+                    write_rejects(raw_df, rejects, rejects_path)
+
+                logging.info("Data loaded successfully.")
+                logging.info(f"{num_rows_inserted} successful inserts out of {len(raw_df)}, errors: ({n_dups} duplicates, {error_count} errors, {len(reasons.dropna())} invalid)")
+
+                return {'rows': len(raw_df), 'inserted': num_rows_inserted, 'rejected': len(rejects)}
+
+        except psycopg.Error as e:
+            logging.error(f"Data loading failed due to PostgreSQL error: {e}")
+            conn.rollback()
+            set_status('failed')
+            if raise_errors:
+                raise
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        logging.error("Usage: python load-quality.py <date> <csv_file>")
-        sys.exit(1)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load a CMS quality snapshot into the database.")
+    parser.add_argument("date", nargs="?", help="date of the snapshot, YYYY-MM-DD")
+    parser.add_argument("csv_file", nargs="?", help="path to the quality CSV file")
+    parser.add_argument("--delta", action="store_true",
+                        help="only record the facilities that changed since the previous snapshot")
+    parser.add_argument("--profile", metavar="FILE", help="write cProfile stats of the load to FILE")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="send the inserts in batches in pipeline mode, for high-latency connections")
+    parser.add_argument("--checkpoint", action="store_true",
+                        help="commit the file in chunks, resuming an interrupted load of it")
+    parser.add_argument("--rebuild-history", action="store_true",
+                        help="recompute HospitalQualityHistory from the stored snapshots instead of loading a file")
+    args = parser.parse_args()
 
-    date, csv_file = str(sys.argv[1]), str(sys.argv[2])
+    if args.rebuild_history:
+        if args.date or args.csv_file:
+            parser.error("--rebuild-history takes no date or file")
+        with psycopg.connect(get_conninfo()) as conn:
+            rebuild_quality_history(conn)
+        sys.exit(0)
+    if not args.csv_file:
+        parser.error("a date and a file are required, unless --rebuild-history is given")
 
     try:
-        with psycopg.connect(
-            host="pinniped.postgres.database.azure.com",
-            dbname=DB_USER,
-            user=DB_USER,
-            password=DB_PASSWORD
-        ) as conn:
-            load_quality_data(csv_file, conn, date)
+        with psycopg.connect(get_conninfo()) as conn:
+            load_quality_data(args.csv_file, conn, args.date, delta=args.delta, profile=args.profile,
+                              pipeline=args.pipeline, checkpoint=args.checkpoint)
     except psycopg.Error as e:
         logging.error(f"PostgreSQL error: {e}")
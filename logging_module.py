@@ -1,15 +1,38 @@
-import logging
-from logging.handlers import RotatingFileHandler
-
-
-def setup_logging():
-    logging.basicConfig(level=logging.DEBUG)
-
-    # Create a file handler for both error and info messages
-    log_file = "log_output.txt"
-    file_handler = RotatingFileHandler(log_file, mode='w', encoding='utf-8')
-    file_handler.setLevel(logging.DEBUG)
-
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    logging.getLogger().addHandler(file_handler)
+import logging
+from logging.handlers import RotatingFileHandler
+
+
+def setup_logging():
+    logging.basicConfig(level=logging.DEBUG)
+
+    # Create a file handler for both error and info messages
+    log_file = "log_output.txt"
+    file_handler = RotatingFileHandler(log_file, mode='w', encoding='utf-8')
+    file_handler.setLevel(logging.DEBUG)
+
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    file_handler.setFormatter(formatter)
+    logging.getLogger().addHandler(file_handler)
+
+
+def setup_metrics_logging(metrics_file="load_metrics.jsonl"):
+    """
+    Send the records of the 'metrics' logger to a JSON Lines file, one
+    record per line and nothing else, appending across runs so they can be
+    compared. The records do not propagate to the root logger, so they stay
+    out of log_output.txt and the console. Safe to call more than once.
+
+    Parameters:
+    - metrics_file: str, file the records are appended to (default is load_metrics.jsonl)
+
+    Returns:
+    - logging.Logger, the 'metrics' logger
+    """
+    logger = logging.getLogger("metrics")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if not logger.handlers:
+        file_handler = logging.FileHandler(metrics_file, mode='a', encoding='utf-8')
+        file_handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(file_handler)
+    return logger
@@ -0,0 +1,572 @@
+import psycopg
+
+from db import get_conninfo
+
+
+# Versioned schema changes, applied in order by migrate. Each entry is
+# (version, description, statements). Applied migrations are never edited:
+# change the schema by appending a new one. The first migrations use
+# IF NOT EXISTS so databases created by hand from design_table_schema.ipynb
+# can be brought under migration as they are.
+MIGRATIONS = [
+    (1, "initial schema", [
+        """
+        CREATE TABLE IF NOT EXISTS Hospitals (
+            hospital_pk VARCHAR(255) PRIMARY KEY,
+            hospital_name VARCHAR(255) NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS HospitalLocations (
+            location_id SERIAL PRIMARY KEY,
+            hospital_fk VARCHAR(255) REFERENCES Hospitals(hospital_pk),
+            state CHAR(2),
+            address VARCHAR(255),
+            city VARCHAR(255),
+            zip VARCHAR(10),
+            fips_code VARCHAR(10),
+            geocoded_hospital_address VARCHAR(50)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS HospitalBedInformation (
+            bed_info_id SERIAL PRIMARY KEY,
+            hospital_fk VARCHAR(255) REFERENCES Hospitals(hospital_pk),
+            collection_week DATE,
+            all_adult_hospital_beds_7_day_avg FLOAT,
+            all_pediatric_inpatient_beds_7_day_avg FLOAT,
+            all_adult_hospital_inpatient_bed_occupied_7_day_coverage FLOAT,
+            all_pediatric_inpatient_bed_occupied_7_day_avg FLOAT,
+            total_icu_beds_7_day_avg FLOAT,
+            icu_beds_used_7_day_avg FLOAT,
+            inpatient_beds_used_covid_7_day_avg FLOAT,
+            staffed_icu_adult_patients_confirmed_covid_7_day_avg FLOAT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS HospitalQualityInformation (
+            quality_id SERIAL PRIMARY KEY,
+            facility_id VARCHAR(255),
+            hospital_overall_rating FLOAT CHECK (hospital_overall_rating >= 0),
+            emergency_services BOOLEAN,
+            hospital_type VARCHAR(255),
+            hospital_ownership VARCHAR(255),
+            data_date DATE
+        )
+        """,
+    ]),
+    (2, "quality history intervals", [
+        """
+        CREATE TABLE IF NOT EXISTS HospitalQualityHistory (
+            history_id SERIAL PRIMARY KEY,
+            facility_id VARCHAR(255),
+            hospital_overall_rating FLOAT CHECK (hospital_overall_rating >= 0),
+            emergency_services BOOLEAN,
+            hospital_type VARCHAR(255),
+            hospital_ownership VARCHAR(255),
+            attributes_hash CHAR(32),
+            valid_from DATE,
+            valid_to DATE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS QualitySnapshots (
+            data_date DATE PRIMARY KEY
+        )
+        """,
+        """
+        CREATE OR REPLACE VIEW HospitalQualitySnapshots AS
+        SELECT h.facility_id, h.hospital_overall_rating, h.emergency_services, h.hospital_type, h.hospital_ownership, s.data_date
+        FROM QualitySnapshots s
+        JOIN HospitalQualityHistory h ON h.valid_from <= s.data_date AND (h.valid_to IS NULL OR s.data_date < h.valid_to)
+        """,
+    ]),
+    (3, "ingest log", [
+        """
+        CREATE TABLE IF NOT EXISTS IngestLog (
+            ingest_id SERIAL PRIMARY KEY,
+            loader VARCHAR(50),
+            file_name VARCHAR(255),
+            rows_inserted INTEGER,
+            loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (4, "weekly bed rollups", [
+        """
+        CREATE TABLE IF NOT EXISTS WeeklyBedRollup (
+            collection_week DATE PRIMARY KEY,
+            record_count INTEGER,
+            beds_reported_count INTEGER,
+            covid_reported_count INTEGER,
+            all_adult_hospital_beds_7_day_avg FLOAT,
+            all_pediatric_inpatient_beds_7_day_avg FLOAT,
+            all_adult_hospital_inpatient_bed_occupied_7_day_coverage FLOAT,
+            all_pediatric_inpatient_bed_occupied_7_day_avg FLOAT,
+            total_icu_beds_7_day_avg FLOAT,
+            icu_beds_used_7_day_avg FLOAT,
+            inpatient_beds_used_covid_7_day_avg FLOAT,
+            staffed_icu_adult_patients_confirmed_covid_7_day_avg FLOAT,
+            all_cases_beds_used FLOAT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS WeeklyStateBedRollup (
+            collection_week DATE,
+            state CHAR(2),
+            record_count INTEGER,
+            beds_reported_count INTEGER,
+            covid_reported_count INTEGER,
+            all_adult_hospital_beds_7_day_avg FLOAT,
+            all_pediatric_inpatient_beds_7_day_avg FLOAT,
+            all_adult_hospital_inpatient_bed_occupied_7_day_coverage FLOAT,
+            all_pediatric_inpatient_bed_occupied_7_day_avg FLOAT,
+            total_icu_beds_7_day_avg FLOAT,
+            icu_beds_used_7_day_avg FLOAT,
+            inpatient_beds_used_covid_7_day_avg FLOAT,
+            staffed_icu_adult_patients_confirmed_covid_7_day_avg FLOAT,
+            all_cases_beds_used FLOAT,
+            PRIMARY KEY (collection_week, state)
+        )
+        """,
+    ]),
+    (5, "indexes and unique constraints for the loader and report queries", [
+        # Duplicate checks of both HHS load paths, and the joins of the quality panels
+        "ALTER TABLE HospitalBedInformation ADD CONSTRAINT hospitalbedinformation_hospital_week_key UNIQUE (hospital_fk, collection_week)",
+        # Rollup refreshes and the per-week panels
+        "CREATE INDEX hospitalbedinformation_week_idx ON HospitalBedInformation (collection_week)",
+        # Duplicate checks of the HHS loader and the state joins of the dashboard
+        "ALTER TABLE HospitalLocations ADD CONSTRAINT hospitallocations_hospital_fk_key UNIQUE (hospital_fk)",
+        # Duplicate checks of the quality loader and the history rebuild
+        "ALTER TABLE HospitalQualityInformation ADD CONSTRAINT hospitalqualityinformation_facility_date_key UNIQUE (facility_id, data_date)",
+        # At most one open interval per facility, which apply_quality_delta closes by facility_id
+        "CREATE UNIQUE INDEX hospitalqualityhistory_open_idx ON HospitalQualityHistory (facility_id) WHERE valid_to IS NULL",
+        # Interval lookups of the HospitalQualitySnapshots view
+        "CREATE INDEX hospitalqualityhistory_valid_from_idx ON HospitalQualityHistory (valid_from, valid_to)",
+    ]),
+    (6, "partition HospitalBedInformation by collection_week", [
+        # The existing rows are copied into one partition per week. The primary
+        # key has to include the partition key, and the week index is replaced
+        # by partition pruning.
+        "ALTER TABLE HospitalBedInformation RENAME TO HospitalBedInformation_unpartitioned",
+        "ALTER TABLE HospitalBedInformation_unpartitioned DROP CONSTRAINT hospitalbedinformation_pkey",
+        "ALTER TABLE HospitalBedInformation_unpartitioned DROP CONSTRAINT hospitalbedinformation_hospital_week_key",
+        "DROP INDEX hospitalbedinformation_week_idx",
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM HospitalBedInformation_unpartitioned WHERE collection_week IS NULL) THEN
+                RAISE EXCEPTION 'HospitalBedInformation has rows without collection_week, delete or fix them first';
+            END IF;
+        END $$
+        """,
+        """
+        CREATE TABLE HospitalBedInformation (
+            bed_info_id INTEGER NOT NULL DEFAULT nextval('hospitalbedinformation_bed_info_id_seq'),
+            hospital_fk VARCHAR(255) REFERENCES Hospitals(hospital_pk),
+            collection_week DATE NOT NULL,
+            all_adult_hospital_beds_7_day_avg FLOAT,
+            all_pediatric_inpatient_beds_7_day_avg FLOAT,
+            all_adult_hospital_inpatient_bed_occupied_7_day_coverage FLOAT,
+            all_pediatric_inpatient_bed_occupied_7_day_avg FLOAT,
+            total_icu_beds_7_day_avg FLOAT,
+            icu_beds_used_7_day_avg FLOAT,
+            inpatient_beds_used_covid_7_day_avg FLOAT,
+            staffed_icu_adult_patients_confirmed_covid_7_day_avg FLOAT,
+            CONSTRAINT hospitalbedinformation_pkey PRIMARY KEY (bed_info_id, collection_week),
+            CONSTRAINT hospitalbedinformation_hospital_week_key UNIQUE (hospital_fk, collection_week)
+        ) PARTITION BY RANGE (collection_week)
+        """,
+        """
+        DO $$
+        DECLARE
+            week DATE;
+        BEGIN
+            FOR week IN SELECT DISTINCT collection_week FROM HospitalBedInformation_unpartitioned LOOP
+                EXECUTE format('CREATE TABLE %I PARTITION OF HospitalBedInformation FOR VALUES FROM (%L) TO (%L)',
+                               'bedinfo_' || to_char(week, 'YYYY_MM_DD'), week, week + 1);
+            END LOOP;
+        END $$
+        """,
+        "INSERT INTO HospitalBedInformation SELECT * FROM HospitalBedInformation_unpartitioned",
+        "ALTER SEQUENCE hospitalbedinformation_bed_info_id_seq OWNED BY HospitalBedInformation.bed_info_id",
+        "DROP TABLE HospitalBedInformation_unpartitioned",
+    ]),
+    (7, "as-of join of bed rows and quality intervals", [
+        # Interval lookup of one facility, used when the bed rows are filtered
+        # down to a few hospitals or weeks
+        "CREATE INDEX hospitalqualityhistory_facility_valid_idx ON HospitalQualityHistory (facility_id, valid_from) INCLUDE (valid_to)",
+        # Each bed row with the quality attributes in effect in its
+        # collection_week. The intervals of a facility do not overlap, so every
+        # bed row matches at most one, however many snapshots are loaded. Rows
+        # of hospitals without a rating in effect that week are left out.
+        """
+        CREATE VIEW HospitalBedQuality AS
+        SELECT b.bed_info_id, b.hospital_fk, b.collection_week,
+               b.all_adult_hospital_beds_7_day_avg,
+               b.all_pediatric_inpatient_beds_7_day_avg,
+               b.all_adult_hospital_inpatient_bed_occupied_7_day_coverage,
+               b.all_pediatric_inpatient_bed_occupied_7_day_avg,
+               b.total_icu_beds_7_day_avg,
+               b.icu_beds_used_7_day_avg,
+               b.inpatient_beds_used_covid_7_day_avg,
+               b.staffed_icu_adult_patients_confirmed_covid_7_day_avg,
+               q.hospital_overall_rating, q.emergency_services, q.hospital_type, q.hospital_ownership,
+               q.valid_from AS quality_date
+        FROM HospitalBedInformation b
+        JOIN HospitalQualityHistory q ON q.facility_id = b.hospital_fk
+         AND q.valid_from <= b.collection_week AND (q.valid_to IS NULL OR b.collection_week < q.valid_to)
+        """,
+    ]),
+    (8, "fingerprint of the hospital dimension attributes", [
+        # Hash of the Hospitals and HospitalLocations attributes of a hospital,
+        # compared by the HHS loader to skip the hospitals that did not change.
+        # Must be computed like load_hhs.HOSPITAL_FINGERPRINT. Hospitals without
+        # a location are left NULL and rewritten by their next load.
+        "ALTER TABLE Hospitals ADD COLUMN fingerprint VARCHAR(32)",
+        """
+        UPDATE Hospitals h
+        SET fingerprint = md5(ROW(h.hospital_name::text, l.state::text, l.address::text, l.city::text,
+                                  l.zip::text, l.fips_code::text, l.geocoded_hospital_address::text)::text)
+        FROM HospitalLocations l
+        WHERE l.hospital_fk = h.hospital_pk
+        """,
+    ]),
+    (9, "ingest ledger", [
+        # One row per distinct file content and loader, written by
+        # ingest_daemon.py, which skips the files whose content is loaded
+        # and retries the failed ones once next_attempt_at has passed
+        """
+        CREATE TABLE IngestLedger (
+            ledger_id SERIAL PRIMARY KEY,
+            loader VARCHAR(50) NOT NULL,
+            content_hash CHAR(40) NOT NULL,
+            file_name VARCHAR(255) NOT NULL,
+            data_date DATE NOT NULL,
+            status VARCHAR(20) NOT NULL CHECK (status IN ('loading', 'loaded', 'failed', 'abandoned')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            rows_read INTEGER,
+            rows_inserted INTEGER,
+            rows_rejected INTEGER,
+            error TEXT,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            next_attempt_at TIMESTAMP,
+            CONSTRAINT ingestledger_loader_hash_key UNIQUE (loader, content_hash)
+        )
+        """,
+    ]),
+    (10, "coordinates of the hospital locations", [
+        # Parsed by the HHS loader from geocoded_hospital_address, a WKT
+        # 'POINT (<longitude> <latitude>)', like load_hhs.parse_points. NULL
+        # when the address is missing or not a valid point. Derived from
+        # geocoded_hospital_address, so not part of the fingerprint.
+        """
+        ALTER TABLE HospitalLocations
+            ADD COLUMN latitude DOUBLE PRECISION CHECK (latitude BETWEEN -90 AND 90),
+            ADD COLUMN longitude DOUBLE PRECISION CHECK (longitude BETWEEN -180 AND 180)
+        """,
+        r"""
+        UPDATE HospitalLocations l
+        SET longitude = p.point[1]::float8, latitude = p.point[2]::float8
+        FROM (SELECT location_id,
+                     regexp_match(geocoded_hospital_address,
+                                  '^\s*POINT\s*\(\s*(-?\d+(?:\.\d*)?)\s+(-?\d+(?:\.\d*)?)\s*\)\s*$', 'i') AS point
+              FROM HospitalLocations) p
+        WHERE p.location_id = l.location_id AND p.point IS NOT NULL
+          AND p.point[1]::float8 BETWEEN -180 AND 180 AND p.point[2]::float8 BETWEEN -90 AND 90
+        """,
+    ]),
+    (11, "checkpoints of interrupted loads", [
+        # One row per file content and loader while a checkpointed load is in
+        # progress (see checkpoints.py): the rows of the file before rows_done
+        # are committed, and state holds what the loader needs to carry on,
+        # e.g. its running counts. Deleted by the load's final transaction.
+        """
+        CREATE TABLE LoadCheckpoints (
+            loader VARCHAR(50) NOT NULL,
+            content_hash CHAR(40) NOT NULL,
+            file_name VARCHAR(255) NOT NULL,
+            rows_done INTEGER NOT NULL,
+            state JSONB NOT NULL,
+            started_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (loader, content_hash)
+        )
+        """,
+    ]),
+    (12, "integer surrogate keys of the hospitals", [
+        # Every normalized CCN (see hospital_keys.py) gets an integer id, which
+        # replaces the text keys of the fact tables. Hospitals and
+        # HospitalLocations keep hospital_pk and hospital_fk as their natural key.
+        """
+        CREATE TABLE HospitalKeys (
+            hospital_id SERIAL PRIMARY KEY,
+            ccn VARCHAR(255) NOT NULL,
+            CONSTRAINT hospitalkeys_ccn_key UNIQUE (ccn)
+        )
+        """,
+        # Like hospital_keys.normalize_ccn, dropped at the end of the migration
+        r"""
+        CREATE FUNCTION pg_temp.normalize_ccn(value TEXT) RETURNS TEXT LANGUAGE SQL IMMUTABLE AS $$
+            SELECT CASE WHEN v ~ '^\d{1,5}$' THEN lpad(v, 6, '0') ELSE NULLIF(v, '') END
+            FROM (SELECT regexp_replace(btrim(value), '^(\d+)\.0*$', '\1') AS v) s
+        $$
+        """,
+        # Keys that normalize to the same CCN would become one hospital and
+        # break the unique keys below, so they are listed for a manual merge
+        """
+        DO $$
+        DECLARE
+            collisions TEXT;
+        BEGIN
+            SELECT string_agg(format('%s (%s: %s)', ccn, source, keys), '; ' ORDER BY ccn, source) INTO collisions
+            FROM (
+                SELECT pg_temp.normalize_ccn(hospital_pk) AS ccn, 'Hospitals' AS source,
+                       string_agg(hospital_pk, ', ' ORDER BY hospital_pk) AS keys
+                FROM Hospitals GROUP BY 1 HAVING COUNT(*) > 1
+                UNION ALL
+                SELECT pg_temp.normalize_ccn(a.facility_id), 'HospitalQualityInformation',
+                       string_agg(DISTINCT a.facility_id, ', ' ORDER BY a.facility_id)
+                FROM HospitalQualityInformation a JOIN HospitalQualityInformation b
+                  ON pg_temp.normalize_ccn(a.facility_id) = pg_temp.normalize_ccn(b.facility_id)
+                 AND a.data_date = b.data_date AND a.facility_id <> b.facility_id
+                GROUP BY 1
+                UNION ALL
+                SELECT pg_temp.normalize_ccn(a.facility_id), 'HospitalQualityHistory',
+                       string_agg(DISTINCT a.facility_id, ', ' ORDER BY a.facility_id)
+                FROM HospitalQualityHistory a JOIN HospitalQualityHistory b
+                  ON pg_temp.normalize_ccn(a.facility_id) = pg_temp.normalize_ccn(b.facility_id)
+                 AND a.facility_id <> b.facility_id
+                 AND a.valid_from < COALESCE(b.valid_to, 'infinity') AND b.valid_from < COALESCE(a.valid_to, 'infinity')
+                GROUP BY 1
+            ) AS c;
+            IF collisions IS NOT NULL THEN
+                RAISE EXCEPTION 'Keys normalizing to the same CCN: %', collisions
+                    USING HINT = 'Merge the rows of each CCN onto one of its keys, then run the migrations again.';
+            END IF;
+        END
+        $$
+        """,
+        """
+        INSERT INTO HospitalKeys (ccn)
+        SELECT ccn FROM (
+            SELECT pg_temp.normalize_ccn(hospital_pk) FROM Hospitals
+            UNION SELECT pg_temp.normalize_ccn(facility_id) FROM HospitalQualityInformation
+            UNION SELECT pg_temp.normalize_ccn(facility_id) FROM HospitalQualityHistory
+        ) AS k (ccn)
+        WHERE ccn IS NOT NULL
+        ORDER BY ccn
+        """,
+        "ALTER TABLE Hospitals ADD COLUMN hospital_id INTEGER REFERENCES HospitalKeys (hospital_id)",
+        """
+        UPDATE Hospitals h SET hospital_id = k.hospital_id
+        FROM HospitalKeys k WHERE k.ccn = pg_temp.normalize_ccn(h.hospital_pk)
+        """,
+        "ALTER TABLE Hospitals ALTER COLUMN hospital_id SET NOT NULL",
+        "ALTER TABLE Hospitals ADD CONSTRAINT hospitals_hospital_id_key UNIQUE (hospital_id)",
+        "ALTER TABLE HospitalLocations ADD COLUMN hospital_id INTEGER REFERENCES Hospitals (hospital_id)",
+        """
+        UPDATE HospitalLocations l SET hospital_id = h.hospital_id
+        FROM Hospitals h WHERE h.hospital_pk = l.hospital_fk
+        """,
+        "ALTER TABLE HospitalLocations ADD CONSTRAINT hospitallocations_hospital_id_key UNIQUE (hospital_id)",
+        # The views are recreated below on the new columns
+        "DROP VIEW HospitalBedQuality",
+        "DROP VIEW HospitalQualitySnapshots",
+        # The unique key of the bed rows keeps its name, on the integer id
+        "ALTER TABLE HospitalBedInformation ADD COLUMN hospital_id INTEGER REFERENCES Hospitals (hospital_id)",
+        """
+        UPDATE HospitalBedInformation b SET hospital_id = h.hospital_id
+        FROM Hospitals h WHERE h.hospital_pk = b.hospital_fk
+        """,
+        "ALTER TABLE HospitalBedInformation DROP CONSTRAINT hospitalbedinformation_hospital_week_key",
+        "ALTER TABLE HospitalBedInformation DROP COLUMN hospital_fk",
+        "ALTER TABLE HospitalBedInformation ADD CONSTRAINT hospitalbedinformation_hospital_week_key UNIQUE (hospital_id, collection_week)",
+        # The loaders look hospitals up by their normalized hospital_pk from now on
+        "ALTER TABLE HospitalLocations DROP CONSTRAINT hospitallocations_hospital_fk_fkey",
+        """
+        UPDATE Hospitals SET hospital_pk = pg_temp.normalize_ccn(hospital_pk)
+        WHERE hospital_pk <> pg_temp.normalize_ccn(hospital_pk)
+        """,
+        """
+        UPDATE HospitalLocations SET hospital_fk = pg_temp.normalize_ccn(hospital_fk)
+        WHERE hospital_fk <> pg_temp.normalize_ccn(hospital_fk)
+        """,
+        "ALTER TABLE HospitalLocations ADD CONSTRAINT hospitallocations_hospital_fk_fkey FOREIGN KEY (hospital_fk) REFERENCES Hospitals (hospital_pk)",
+        # The quality facilities need not be HHS hospitals, so they reference HospitalKeys
+        "ALTER TABLE HospitalQualityInformation ADD COLUMN hospital_id INTEGER REFERENCES HospitalKeys (hospital_id)",
+        """
+        UPDATE HospitalQualityInformation q SET hospital_id = k.hospital_id
+        FROM HospitalKeys k WHERE k.ccn = pg_temp.normalize_ccn(q.facility_id)
+        """,
+        "ALTER TABLE HospitalQualityInformation DROP CONSTRAINT hospitalqualityinformation_facility_date_key",
+        "ALTER TABLE HospitalQualityInformation DROP COLUMN facility_id",
+        "ALTER TABLE HospitalQualityInformation ADD CONSTRAINT hospitalqualityinformation_hospital_date_key UNIQUE (hospital_id, data_date)",
+        "ALTER TABLE HospitalQualityHistory ADD COLUMN hospital_id INTEGER REFERENCES HospitalKeys (hospital_id)",
+        """
+        UPDATE HospitalQualityHistory q SET hospital_id = k.hospital_id
+        FROM HospitalKeys k WHERE k.ccn = pg_temp.normalize_ccn(q.facility_id)
+        """,
+        "DROP INDEX hospitalqualityhistory_open_idx",
+        "DROP INDEX hospitalqualityhistory_facility_valid_idx",
+        "ALTER TABLE HospitalQualityHistory DROP COLUMN facility_id",
+        "CREATE UNIQUE INDEX hospitalqualityhistory_open_idx ON HospitalQualityHistory (hospital_id) WHERE valid_to IS NULL",
+        "CREATE INDEX hospitalqualityhistory_hospital_valid_idx ON HospitalQualityHistory (hospital_id, valid_from) INCLUDE (valid_to)",
+        """
+        CREATE VIEW HospitalQualitySnapshots AS
+        SELECT h.hospital_id, h.hospital_overall_rating, h.emergency_services, h.hospital_type, h.hospital_ownership, s.data_date
+        FROM QualitySnapshots s
+        JOIN HospitalQualityHistory h ON h.valid_from <= s.data_date AND (h.valid_to IS NULL OR s.data_date < h.valid_to)
+        """,
+        """
+        CREATE VIEW HospitalBedQuality AS
+        SELECT b.bed_info_id, b.hospital_id, b.collection_week,
+               b.all_adult_hospital_beds_7_day_avg,
+               b.all_pediatric_inpatient_beds_7_day_avg,
+               b.all_adult_hospital_inpatient_bed_occupied_7_day_coverage,
+               b.all_pediatric_inpatient_bed_occupied_7_day_avg,
+               b.total_icu_beds_7_day_avg,
+               b.icu_beds_used_7_day_avg,
+               b.inpatient_beds_used_covid_7_day_avg,
+               b.staffed_icu_adult_patients_confirmed_covid_7_day_avg,
+               q.hospital_overall_rating, q.emergency_services, q.hospital_type, q.hospital_ownership,
+               q.valid_from AS quality_date
+        FROM HospitalBedInformation b
+        JOIN HospitalQualityHistory q ON q.hospital_id = b.hospital_id
+         AND q.valid_from <= b.collection_week AND (q.valid_to IS NULL OR b.collection_week < q.valid_to)
+        """,
+        "DROP FUNCTION pg_temp.normalize_ccn(TEXT)",
+    ]),
+    (13, "quality history of the snapshots loaded before it", [
+        # Databases loaded before migration 2 have their full snapshots in
+        # HospitalQualityInformation and no history. The intervals are built
+        # like load_quality.rebuild_quality_history does, one per run of
+        # consecutive snapshots with the same attributes, and the hash is
+        # spelled like load_quality.attributes_hash so later loads compare equal.
+        """
+        WITH snapshots AS (
+            SELECT data_date, row_number() OVER (ORDER BY data_date) AS n, lead(data_date) OVER (ORDER BY data_date) AS next_date
+            FROM (SELECT DISTINCT data_date FROM HospitalQualityInformation) AS d
+        ), facilities AS (
+            SELECT q.hospital_id, q.hospital_overall_rating, q.emergency_services, q.hospital_type, q.hospital_ownership,
+                   md5(concat_ws('|',
+                       CASE WHEN q.hospital_overall_rating IS NULL OR q.hospital_overall_rating = 'NaN' THEN 'nan'
+                            WHEN q.hospital_overall_rating = trunc(q.hospital_overall_rating)
+                            THEN trunc(q.hospital_overall_rating)::bigint::text || '.0'
+                            ELSE q.hospital_overall_rating::text END,
+                       CASE WHEN q.emergency_services THEN 'True' WHEN NOT q.emergency_services THEN 'False' ELSE 'None' END,
+                       COALESCE(q.hospital_type, 'None'),
+                       COALESCE(q.hospital_ownership, 'None'))) AS attributes_hash,
+                   s.data_date, s.n, s.next_date
+            FROM HospitalQualityInformation q JOIN snapshots s ON s.data_date = q.data_date
+        ), starts AS (
+            SELECT f.*, CASE WHEN lag(n) OVER w = n - 1 AND lag(attributes_hash) OVER w = attributes_hash
+                             THEN 0 ELSE 1 END AS starts_run
+            FROM facilities f
+            WINDOW w AS (PARTITION BY hospital_id ORDER BY n)
+        ), runs AS (
+            SELECT s.*, sum(starts_run) OVER (PARTITION BY hospital_id ORDER BY n) AS run FROM starts s
+        )
+        INSERT INTO HospitalQualityHistory (hospital_id, hospital_overall_rating, emergency_services, hospital_type,
+                                            hospital_ownership, attributes_hash, valid_from, valid_to)
+        SELECT hospital_id, hospital_overall_rating, emergency_services, hospital_type, hospital_ownership,
+               attributes_hash, MIN(data_date), (array_agg(next_date ORDER BY n DESC))[1]
+        FROM runs
+        WHERE NOT EXISTS (SELECT 1 FROM QualitySnapshots) AND NOT EXISTS (SELECT 1 FROM HospitalQualityHistory)
+        GROUP BY hospital_id, run, attributes_hash, hospital_overall_rating, emergency_services, hospital_type,
+                 hospital_ownership
+        """,
+        """
+        INSERT INTO QualitySnapshots (data_date)
+        SELECT DISTINCT data_date FROM HospitalQualityInformation
+        WHERE NOT EXISTS (SELECT 1 FROM QualitySnapshots)
+        """,
+    ]),
+]
+
+
+def applied_versions(curr):
+    """
+    Create the SchemaMigrations bookkeeping table if needed and read it.
+
+    Parameters:
+    - curr: psycopg cursor
+
+    Returns:
+    - set of int, versions already applied
+    """
+    curr.execute("""
+        CREATE TABLE IF NOT EXISTS SchemaMigrations (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR(255),
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""")
+    curr.execute("SELECT version FROM SchemaMigrations")
+    return {version for (version,) in curr.fetchall()}
+
+
+def migrate(conn, target=None):
+    """
+    Apply the pending migrations in version order, each in its own
+    transaction together with its SchemaMigrations row, so a failing
+    migration leaves the schema at the previous version.
+
+    Parameters:
+    - conn: psycopg connection
+    - target: int, last version to apply (default is None, which applies all)
+
+    Returns:
+    - int list, versions applied by this call
+    """
+    with conn.cursor() as curr:
+        done = applied_versions(curr)
+    conn.commit()
+
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+        with conn.cursor() as curr:
+            try:
+                for statement in statements:
+                    curr.execute(statement)
+                curr.execute("INSERT INTO SchemaMigrations (version, description) VALUES (%s, %s)",
+                             (version, description))
+            except Exception:
+                conn.rollback()
+                print(f"Migration {version} ({description}) failed.")
+                raise
+        conn.commit()
+        print(f"Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
+
+
+def print_status(conn):
+    """
+    Print every migration and whether it has been applied.
+
+    Parameters:
+    - conn: psycopg connection
+    """
+    with conn.cursor() as curr:
+        done = applied_versions(curr)
+    conn.commit()
+    for version, description, _ in MIGRATIONS:
+        print(f"{version:>4}  {'applied' if version in done else 'pending':<8} {description}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Create or upgrade the database schema.")
+    parser.add_argument("--target", type=int, help="last migration version to apply (default is the latest)")
+    parser.add_argument("--status", action="store_true", help="list the migrations and whether they are applied")
+    args = parser.parse_args()
+
+    with psycopg.connect(get_conninfo()) as conn:
+        if args.status:
+            print_status(conn)
+        elif not migrate(conn, target=args.target):
+            print("Schema is up to date.")
@@ -0,0 +1,282 @@
+"""
+Cache of parsed source files for the loaders.
+
+An entry holds either the text of every column, for the reads that keep the
+raw rows (the non-chunked loads write them out whole to their rejects
+file), or only the columns a streaming read asks for, stored with their
+parsed dtypes: float32 columns as Arrow float32, category columns as text
+returned as pandas categoricals, other columns as text. A file can have an
+entry of each kind.
+"""
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+# pyarrow is optional: without it every read parses the CSV as before
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+
+# Parsed source files, as uncompressed Arrow IPC files that are memory-mapped
+# when read, so only the pages of the columns used are loaded. Entries are
+# named after the source path and content, a changed file gets a new entry.
+CACHE_DIR = os.environ.get("PARSE_CACHE_DIR", ".parse_cache")
+
+# Rows parsed and written to a new entry at a time, unless the caller streams
+# the file in chunks of another size (see read_chunks)
+WRITE_CHUNK_ROWS = 50000
+
+# Content hashes of the files seen by this process, by (path, size, mtime)
+_hashes = {}
+
+
+def enabled():
+    """
+    Returns:
+    - bool, whether pyarrow is installed and reads go through the cache
+    """
+    return pa is not None
+
+
+def content_hash(csv_file):
+    """
+    Returns:
+    - str, sha1 hex digest of the file's bytes
+    """
+    stat = os.stat(csv_file)
+    key = (os.path.abspath(csv_file), stat.st_size, stat.st_mtime_ns)
+    if key not in _hashes:
+        digest = hashlib.sha1()
+        with open(csv_file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        _hashes[key] = digest.hexdigest()
+    return _hashes[key]
+
+
+def cache_prefix(csv_file):
+    """
+    Returns:
+    - str, path of the cache entries of a source file without the content part
+    """
+    path_hash = hashlib.sha1(os.path.abspath(csv_file).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(CACHE_DIR, f"{os.path.basename(csv_file)}-{path_hash}-")
+
+
+def entry_path(csv_file, dtypes=None, na_values=None):
+    """
+    Returns:
+    - str, path of the cache entry of a source file's current content, with
+      a part naming the dtypes and missing values of a typed entry
+    """
+    path = f"{cache_prefix(csv_file)}{content_hash(csv_file)[:16]}"
+    if dtypes is not None:
+        spec = json.dumps([{column: str(dtype) for column, dtype in dtypes.items()}, na_values], sort_keys=True)
+        path += f"-{hashlib.sha1(spec.encode('utf-8')).hexdigest()[:8]}"
+    return f"{path}.arrow"
+
+
+def arrow_type(dtype):
+    """
+    Returns:
+    - pyarrow DataType a column parsed as dtype is stored as
+    """
+    return pa.float32() if str(dtype) == 'float32' else pa.string()
+
+
+def write_entry(csv_file, path, chunksize=WRITE_CHUNK_ROWS, dtypes=None, na_values=None):
+    """
+    Parse a CSV file and store it at path: every column as text, the way
+    the loaders always have (pandas' missing values as nulls), or only the
+    columns of dtypes, typed. Category columns are stored as text and made
+    categorical when read. The file is parsed and written chunksize rows at
+    a time, one record batch each, so building an entry takes no more memory
+    than streaming the file. It is written under a temporary name and
+    renamed, so concurrent loads of the same file never read a partial
+    entry. Entries of older contents of the same source file are removed.
+    """
+    header = pd.read_csv(csv_file, dtype=object, nrows=0).columns
+    if dtypes is None:
+        columns, parse_dtypes = None, object
+        schema = pa.schema([(str(column), pa.string()) for column in header])
+    else:
+        columns = select_names(header, list(dtypes))
+        parse_dtypes = {column: str if dtypes[column] == 'category' else dtypes[column] for column in columns}
+        schema = pa.schema([(column, arrow_type(dtypes[column])) for column in columns])
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(temp_path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer, \
+            pd.read_csv(csv_file, dtype=parse_dtypes, usecols=columns, na_values=na_values,
+                        chunksize=chunksize) as chunks:
+        for chunk in chunks:
+            writer.write_batch(pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False))
+    os.replace(temp_path, path)
+
+    prefix = cache_prefix(csv_file)
+    current = path[:len(prefix) + 16]
+    for name in os.listdir(CACHE_DIR):
+        stale = os.path.join(CACHE_DIR, name)
+        if stale.startswith(prefix) and not stale.startswith(current) and stale.endswith(".arrow"):
+            os.remove(stale)
+
+
+def open_entry(csv_file, chunksize=WRITE_CHUNK_ROWS, dtypes=None, na_values=None):
+    """
+    Open the cache entry of a source file, parsing the file and adding it
+    first if it is not there yet.
+
+    Parameters:
+    - csv_file: str, path to the CSV file
+    - chunksize: int, rows per record batch of a new entry (default is
+      WRITE_CHUNK_ROWS)
+    - dtypes: dict (optional), column -> dtype of a typed entry (default is
+      None, the text of every column)
+    - na_values: dict (optional), column -> extra values read as missing in
+      a typed entry, like pd.read_csv's
+
+    Returns:
+    - pyarrow RecordBatchFileReader over the memory-mapped entry
+    """
+    path = entry_path(csv_file, dtypes, na_values)
+    if not os.path.exists(path):
+        write_entry(csv_file, path, chunksize, dtypes, na_values)
+    return pa.ipc.open_file(pa.memory_map(path))
+
+
+def read_table(csv_file):
+    """
+    Read a source file from the cache (see open_entry).
+
+    Parameters:
+    - csv_file: str, path to the CSV file
+
+    Returns:
+    - pyarrow Table, string columns backed by the memory-mapped cache entry
+    """
+    return open_entry(csv_file).read_all()
+
+
+def select_names(names, columns):
+    """
+    Returns:
+    - str list, the given columns in file order, like usecols does
+    """
+    missing = set(columns) - set(names)
+    if missing:
+        raise ValueError(f"Usecols do not match columns, columns expected but not found: {sorted(missing)}")
+    return [name for name in names if name in columns]
+
+
+def read_csv(csv_file, columns=None):
+    """
+    Read a CSV file like pd.read_csv(csv_file, dtype=object, usecols=columns),
+    from the cache when pyarrow is installed. Only the requested columns are
+    read from the cache entry.
+
+    Parameters:
+    - csv_file: str, path to the CSV file
+    - columns: str list (optional), columns to read (default is all of them)
+
+    Returns:
+    - pandas df, object columns holding the text of each field, None or NaN
+      for missing values
+    """
+    if not enabled():
+        return pd.read_csv(csv_file, dtype=object, usecols=columns)
+    table = read_table(csv_file)
+    if columns is not None:
+        table = table.select(select_names(table.column_names, columns))
+    return table.to_pandas()
+
+
+def read_chunks(csv_file, columns, chunksize, dtypes=None, na_values=None):
+    """
+    Iterate over a CSV file in chunks, like pd.read_csv(csv_file, dtype=object,
+    usecols=columns, chunksize=chunksize), or with dtype=dtypes and
+    na_values=na_values when dtypes are given, from the cache when pyarrow
+    is installed. A missing entry is written as the file is parsed, and the
+    chunks are converted from the record batches of the memory-mapped entry
+    one at a time, so memory stays flat like with the streaming reader.
+
+    Parameters:
+    - csv_file: str, path to the CSV file
+    - columns: str list, columns to read
+    - chunksize: int, number of rows per chunk
+    - dtypes: dict (optional), column -> dtype of each of the columns, str,
+      'category' or 'float32' (default is None, every column as text)
+    - na_values: dict (optional), column -> extra values read as missing,
+      only with dtypes
+
+    Returns:
+    - iterator of pandas df, chunks indexed by their row number in the file
+    """
+    if not enabled():
+        return pd.read_csv(csv_file, dtype=object if dtypes is None else dtypes, usecols=columns,
+                           na_values=na_values, chunksize=chunksize)
+    if dtypes is not None:
+        dtypes = {column: dtypes[column] for column in columns}
+    reader = open_entry(csv_file, chunksize, dtypes, na_values)
+    categories = [column for column, dtype in (dtypes or {}).items() if dtype == 'category']
+    return cached_chunks(reader, select_names(reader.schema.names, columns), chunksize, categories)
+
+
+def cached_chunks(reader, names, chunksize, categories=()):
+    """
+    Regroup the record batches of a cache entry into chunks of chunksize
+    rows, whatever size the entry was written with.
+
+    Parameters:
+    - reader: pyarrow RecordBatchFileReader, see open_entry
+    - names: str list, columns to read
+    - chunksize: int, number of rows per chunk
+    - categories: str list, columns to return as pandas categoricals
+      (default is none)
+
+    Yields:
+    - pandas df, chunks indexed by their row number in the file
+    """
+    pending, n_pending, start = [], 0, 0
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i).select(names)
+        pending.append(batch)
+        n_pending += batch.num_rows
+        while n_pending >= chunksize:
+            table = pa.Table.from_batches(pending)
+            chunk = table.slice(0, chunksize).to_pandas(categories=categories)
+            yield chunk.set_axis(pd.RangeIndex(start, start + chunksize))
+            rest = table.slice(chunksize)
+            pending, n_pending, start = rest.to_batches(), rest.num_rows, start + chunksize
+    if n_pending:
+        table = pa.Table.from_batches(pending)
+        yield table.to_pandas(categories=categories).set_axis(pd.RangeIndex(start, start + n_pending))
+
+
+if __name__ == "__main__":
+    import argparse
+    import glob
+    import shutil
+    import time
+
+    parser = argparse.ArgumentParser(description="Fill or clear the cache of parsed source files.")
+    parser.add_argument("paths", nargs="*", default=["hhs_data", "hospital_data"],
+                        help="CSV files or directories to cache (default is hhs_data and hospital_data)")
+    parser.add_argument("--clear", action="store_true", help="delete the cache")
+    args = parser.parse_args()
+
+    if args.clear:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+        print(f"Deleted {CACHE_DIR}.")
+    elif not enabled():
+        print("pyarrow is not installed, nothing to cache.")
+    else:
+        for path in args.paths:
+            for csv_file in sorted(glob.glob(os.path.join(path, "*.csv")) if os.path.isdir(path) else [path]):
+                start_time = time.perf_counter()
+                n_rows = read_table(csv_file).num_rows
+                print(f"{csv_file}: {n_rows} rows in {time.perf_counter() - start_time:.2f}s")
@@ -0,0 +1,164 @@
+import datetime
+
+import psycopg
+
+from db import get_conninfo, lock_hospitals, record_ingest
+from rollups import refresh_rollups
+
+
+# HospitalBedInformation is range-partitioned by collection_week with one
+# partition per week (see migration 6 in migrations.py), named after the week.
+# The name is kept short so the index names derived from it stay unique
+# within Postgres' 63 character limit.
+PARTITION_PREFIX = 'bedinfo_'
+
+
+def partition_name(week):
+    """
+    Returns:
+    - str, name of the HospitalBedInformation partition holding a week,
+      e.g. bedinfo_2022_09_23
+    """
+    return f"{PARTITION_PREFIX}{week:%Y_%m_%d}"
+
+
+def partition_exists(curr, week):
+    """
+    Returns:
+    - bool, whether the partition of a week exists
+    """
+    curr.execute("SELECT to_regclass(%s) IS NOT NULL", (partition_name(week),))
+    return curr.fetchone()[0]
+
+
+def week_bounds(week):
+    """
+    Returns:
+    - str, SQL literals of the lower (inclusive) and upper (exclusive) bounds
+      of the partition of a week
+    """
+    return f"DATE '{week.isoformat()}'", f"DATE '{(week + datetime.timedelta(days=1)).isoformat()}'"
+
+
+def create_staging_partition(curr, week, replace=False, suffix=''):
+    """
+    Create a standalone table shaped like HospitalBedInformation, with the
+    same indexes and a CHECK constraint matching the week's partition bounds,
+    for the loader to fill before attach_partition makes it visible. Readers
+    of HospitalBedInformation never see or wait on it while it is filled.
+
+    Parameters:
+    - curr: psycopg cursor
+    - week: date, collection week the table will hold
+    - replace: bool, the week's partition exists and will be replaced, so the
+      staging table gets a temporary name (default is False)
+    - suffix: str, appended to the name, for staging tables that are kept
+      across transactions and must not clash with another load's (default
+      is '')
+
+    Returns:
+    - str, name of the staging table
+    """
+    staging = partition_name(week) + ('_replacement' if replace else '') + suffix
+    lower, upper = week_bounds(week)
+    curr.execute(f'''
+        CREATE TABLE {staging} (
+            LIKE HospitalBedInformation INCLUDING DEFAULTS INCLUDING INDEXES,
+            CONSTRAINT {staging}_week_check CHECK (collection_week IS NOT NULL AND collection_week >= {lower} AND collection_week < {upper})
+        )''')
+    return staging
+
+
+def attach_partition(curr, week, staging):
+    """
+    Attach a filled staging table as the partition of its week, replacing
+    the existing partition of that week if there is one. The CHECK
+    constraint lets Postgres skip the validation scan, so this only takes
+    a SHARE UPDATE EXCLUSIVE lock on HospitalBedInformation, which does not
+    block readers. Attaches are serialized with other loads' hospital
+    writes (see db.lock_hospitals). Replacing a week also detaches the old
+    partition, which blocks readers until the commit.
+
+    Parameters:
+    - curr: psycopg cursor
+    - week: date, collection week of the staging table
+    - staging: str, table returned by create_staging_partition
+
+    Returns:
+    - int, number of rows in the attached partition, 0 if the staging table
+      was empty and dropped instead
+    """
+    curr.execute(f"SELECT COUNT(*) FROM {staging}")
+    n_rows = curr.fetchone()[0]
+    if n_rows == 0:
+        curr.execute(f"DROP TABLE {staging}")
+        return 0
+
+    lock_hospitals(curr)
+    name = partition_name(week)
+    if staging != name:
+        if partition_exists(curr, week):
+            curr.execute(f"ALTER TABLE HospitalBedInformation DETACH PARTITION {name}")
+            curr.execute(f"DROP TABLE {name}")
+        curr.execute(f"ALTER TABLE {staging} RENAME TO {name}")
+
+    lower, upper = week_bounds(week)
+    curr.execute(f"ALTER TABLE HospitalBedInformation ATTACH PARTITION {name} FOR VALUES FROM ({lower}) TO ({upper})")
+    return n_rows
+
+
+def drop_week(conn, week):
+    """
+    Remove every HospitalBedInformation row of a week by dropping its
+    partition, e.g. before reloading a bad file, and update the rollups.
+
+    Parameters:
+    - conn: psycopg connection
+    - week: date, collection week to drop
+    """
+    with conn.cursor() as curr:
+        if not partition_exists(curr, week):
+            print(f"No partition for {week}.")
+            return
+        name = partition_name(week)
+        curr.execute(f"ALTER TABLE HospitalBedInformation DETACH PARTITION {name}")
+        curr.execute(f"DROP TABLE {name}")
+        refresh_rollups(curr, [week])
+        record_ingest(curr, 'drop_week', name, 0)
+    conn.commit()
+    print(f"Dropped {name}.")
+
+
+def list_partitions(curr):
+    """
+    Returns:
+    - list of (partition name, bounds, rows) tuples, oldest week first
+    """
+    curr.execute('''
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'hospitalbedinformation'::regclass
+        ORDER BY c.relname''')
+    partitions = []
+    for name, bounds in curr.fetchall():
+        curr.execute(f"SELECT COUNT(*) FROM {name}")
+        partitions.append((name, bounds, curr.fetchone()[0]))
+    return partitions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or drop the weekly HospitalBedInformation partitions.")
+    parser.add_argument("--drop-week", type=datetime.date.fromisoformat, metavar="YYYY-MM-DD",
+                        help="drop the rows of a collection week")
+    args = parser.parse_args()
+
+    with psycopg.connect(get_conninfo()) as conn:
+        if args.drop_week:
+            drop_week(conn, args.drop_week)
+        else:
+            with conn.cursor() as curr:
+                for name, bounds, n_rows in list_partitions(curr):
+                    print(f"{name:<40}{bounds:<60}{n_rows:>8}")
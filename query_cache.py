@@ -0,0 +1,99 @@
+import threading
+from collections import OrderedDict
+
+
+class QueryCache:
+    """
+    Bounded LRU cache of query results, shared by every dashboard session.
+
+    Entries are keyed by the SQL text and its parameters and hold the
+    result as a DataFrame. Queries run on a backend (see report_runner),
+    Postgres or the DuckDB exports. The data only changes when a loader
+    commits, so the whole cache is dropped whenever the backend's load
+    version moves (see db.record_ingest). A result is only stored if it
+    was fetched at the version the entries belong to, so a load committed
+    while a query runs never leaves its older result cached.
+    """
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def check_version(self, backend):
+        """
+        Drop every entry if a load has been committed since the last check.
+        Call once per dashboard run, before the panels query.
+
+        Parameters:
+        - backend: report backend, e.g. report_runner.PostgresBackend
+        """
+        version = backend.load_version()
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+
+    def lookup(self, query, params=()):
+        """
+        Return a cached result without touching the backend.
+
+        Parameters:
+        - query: str, SQL query
+        - params: tuple, query parameters
+
+        Returns:
+        - pandas df, the result as returned by fetch, or None if the query
+          is not cached
+        """
+        key = (query, tuple(params))
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        return None
+
+    def fetch(self, backend, query, params=()):
+        """
+        Run a query, or return its cached result. On a miss the load
+        version is read before the query runs, and the result is only
+        stored if the entries still belong to that version afterwards.
+
+        Parameters:
+        - backend: report backend, e.g. report_runner.PostgresBackend
+        - query: str, SQL query
+        - params: tuple, query parameters
+
+        Returns:
+        - pandas df, the query result, shared with the other callers, so
+          not to be modified in place
+        """
+        key = (query, tuple(params))
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        version = backend.load_version()
+        result = backend.fetch(query, params)
+
+        with self.lock:
+            if version != self.version:
+                # A load was committed since check_version, or another run
+                # moved the cache to a newer load while this query ran
+                return result
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return result
+
+
+# Module-level so that it outlives Streamlit reruns, which re-execute Reporting.py but not its imports
+cache = QueryCache()
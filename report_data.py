@@ -0,0 +1,204 @@
+import struct
+import threading
+
+import numpy as np
+import pandas as pd
+from psycopg.pq import Format
+
+
+# Header of the binary COPY format: signature, flags and header extension length
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+HEADER = struct.Struct('>11sii')
+
+# Fixed-width types decoded straight into NumPy: type oid -> big-endian
+# wire dtype. date is sent as the number of days since POSTGRES_EPOCH.
+NUMPY_TYPES = {
+    16: np.dtype('?'),      # boolean
+    21: np.dtype('>i2'),    # smallint
+    23: np.dtype('>i4'),    # integer
+    20: np.dtype('>i8'),    # bigint
+    700: np.dtype('>f4'),   # real
+    701: np.dtype('>f8'),   # double precision
+    1082: np.dtype('>i4'),  # date
+}
+DATE_OID = 1082
+POSTGRES_EPOCH = np.datetime64('2000-01-01', 'D')
+
+# Text types, whose binary format is the UTF-8 text itself:
+# name, text, char(n) and varchar
+TEXT_OIDS = {19, 25, 1042, 1043}
+
+# Column names and type oids of the queries run so far, by SQL text
+_descriptions = {}
+_descriptions_lock = threading.Lock()
+
+
+def describe(conn, query, params=()):
+    """
+    Look up the columns of a query, by running it once with LIMIT 0. The
+    result is kept, so this only costs a round trip the first time a query
+    is seen.
+
+    Parameters:
+    - conn: psycopg connection
+    - query: str, SQL query
+    - params: tuple, query parameters
+
+    Returns:
+    - list of (column name, type oid) tuples
+    """
+    with _descriptions_lock:
+        if query in _descriptions:
+            return _descriptions[query]
+    with conn.cursor() as curr:
+        curr.execute(f"SELECT * FROM ({query}) AS q LIMIT 0", params)
+        description = [(column.name, column.type_code) for column in curr.description]
+    with _descriptions_lock:
+        _descriptions[query] = description
+    return description
+
+
+def field_positions(data, widths):
+    """
+    Find where every field of a binary COPY result starts.
+
+    When every column has a fixed width and no field is null, all rows have
+    the same size and the positions are computed with NumPy. Otherwise the
+    rows are walked once, reading only the field lengths.
+
+    Parameters:
+    - data: bytes, binary COPY output, header and trailer included
+    - widths: int list, width of each column's values, None if variable
+
+    Returns:
+    - int64 ndarray (rows, columns), offset of each field's value in data
+    - int64 ndarray (rows, columns), length of each field, -1 for nulls
+    """
+    if len(data) < HEADER.size + 2 or not data.startswith(COPY_SIGNATURE):
+        raise ValueError("Not a binary COPY result")
+    _, _, extension_length = HEADER.unpack_from(data)
+    start = HEADER.size + extension_length
+    # The data ends with a field count of -1
+    body_length = len(data) - 2 - start
+    n_columns = len(widths)
+
+    if None not in widths:
+        row_size = 2 + sum(4 + width for width in widths)
+        if body_length % row_size == 0:
+            row_dtype = np.dtype([('count', '>i2')] + [field for i, width in enumerate(widths)
+                                                       for field in ((f'length{i}', '>i4'), (f'value{i}', f'V{width}'))])
+            rows = np.frombuffer(data, dtype=row_dtype, count=body_length // row_size, offset=start)
+            if (rows['count'] == n_columns).all() and all((rows[f'length{i}'] == width).all()
+                                                          for i, width in enumerate(widths)):
+                offsets = np.array([row_dtype.fields[f'value{i}'][1] for i in range(n_columns)])
+                starts = start + np.arange(len(rows))[:, None] * row_size + offsets
+                return starts, np.broadcast_to(np.array(widths, dtype=np.int64), starts.shape)
+
+    starts, lengths = [], []
+    position = start
+    while True:
+        (count,) = struct.unpack_from('>h', data, position)
+        position += 2
+        if count == -1:
+            break
+        for _ in range(count):
+            (length,) = struct.unpack_from('>i', data, position)
+            position += 4
+            starts.append(position)
+            lengths.append(length)
+            position += max(length, 0)
+    return (np.array(starts, dtype=np.int64).reshape(-1, n_columns),
+            np.array(lengths, dtype=np.int64).reshape(-1, n_columns))
+
+
+def decode_column(data, starts, lengths, oid, conn):
+    """
+    Decode one column of a binary COPY result.
+
+    Parameters:
+    - data: bytes, binary COPY output
+    - starts, lengths: int64 ndarray, positions of the column's fields (see
+      field_positions)
+    - oid: int, type oid of the column
+    - conn: psycopg connection or adaptation context, whose loaders decode
+      the other types
+
+    Returns:
+    - ndarray, NumPy values for the fixed-width types (float64 with NaN for
+      integer columns holding nulls, NaT for null dates), objects otherwise
+    """
+    not_null = lengths >= 0
+    if oid in NUMPY_TYPES:
+        wire_dtype = NUMPY_TYPES[oid]
+        # Gather the bytes of every value with one fancy index, then reinterpret them
+        raw = np.frombuffer(data, dtype=np.uint8)
+        values = raw[starts[not_null][:, None] + np.arange(wire_dtype.itemsize)].reshape(-1).view(wire_dtype)
+        if oid == DATE_OID:
+            column = np.full(len(starts), np.datetime64('NaT'), dtype='datetime64[D]')
+            column[not_null] = POSTGRES_EPOCH + values.astype('timedelta64[D]')
+            return column
+        values = values.astype(wire_dtype.newbyteorder('='))
+        if not_null.all():
+            return values
+        if values.dtype.kind == 'b':
+            column = np.full(len(starts), None, dtype=object)
+        else:
+            column = np.full(len(starts), np.nan)
+        column[not_null] = values
+        return column
+
+    column = np.full(len(starts), None, dtype=object)
+    view = memoryview(data)
+    if oid in TEXT_OIDS:
+        for i in np.flatnonzero(not_null):
+            column[i] = str(view[starts[i]:starts[i] + lengths[i]], 'utf-8')
+    else:
+        loader = conn.adapters.get_loader(oid, Format.BINARY)(oid, conn)
+        for i in np.flatnonzero(not_null):
+            column[i] = loader.load(view[starts[i]:starts[i] + lengths[i]])
+    return column
+
+
+def fetch_frame(conn, query, params=()):
+    """
+    Run a query and return its result as columns, without building a Python
+    tuple per row. The result is streamed with COPY ... TO STDOUT in binary
+    format and each column is decoded in one go (see decode_column).
+    Aggregations and top-N limits belong in the query, so only the rows a
+    panel shows cross the network.
+
+    Parameters:
+    - conn: psycopg connection
+    - query: str, SQL query, with %s placeholders
+    - params: tuple, query parameters
+
+    Returns:
+    - pandas df, one column per query column
+    """
+    description = describe(conn, query, params)
+    with conn.cursor() as curr:
+        with curr.copy(f"COPY ({query}) TO STDOUT (FORMAT BINARY)", params) as copy:
+            data = b''.join(bytes(block) for block in copy)
+    return decode_frame(data, description, conn)
+
+
+def decode_frame(data, description, conn):
+    """
+    Decode a whole binary COPY result.
+
+    Parameters:
+    - data: bytes, binary COPY output, header and trailer included
+    - description: list of (column name, type oid) tuples (see describe)
+    - conn: psycopg connection or adaptation context, whose loaders decode
+      the types that are not in NUMPY_TYPES or TEXT_OIDS
+
+    Returns:
+    - pandas df, one column per described column (see decode_column)
+    """
+    widths = [NUMPY_TYPES[oid].itemsize if oid in NUMPY_TYPES else None for _, oid in description]
+    starts, lengths = field_positions(data, widths)
+    # Built by position, unnamed expressions can share a column name
+    frame = pd.DataFrame({i: decode_column(data, starts[:, i], lengths[:, i], oid, conn)
+                          for i, (_, oid) in enumerate(description)}, columns=range(len(description)))
+    frame.columns = [name for name, _ in description]
+    return frame
@@ -0,0 +1,109 @@
+# SQL behind the Reporting.py dashboard panels, one constant per query. The
+# weekly totals come from the rollups maintained by the HHS loader (see rollups.py).
+# Panels combining bed rows with quality ratings read the HospitalBedQuality
+# view, which pairs each bed row with the snapshot in effect in its week.
+# Aggregations and top-N limits are done here rather than in pandas, so the
+# panels only fetch the rows they plot (see report_data.fetch_frame).
+
+
+# display_weekly_records
+RECORDS_AT_WEEK = "SELECT COALESCE((SELECT record_count FROM WeeklyBedRollup WHERE collection_week = %s), 0)"
+
+RECORDS_PREVIOUS_WEEKS = """
+    SELECT collection_week, record_count FROM WeeklyBedRollup WHERE collection_week < %s
+    ORDER BY collection_week
+    """
+
+# display_bed_statistics
+BED_STATISTICS_AT_WEEK = """
+    SELECT ROUND(all_adult_hospital_beds_7_day_avg::numeric, 2),
+           ROUND(all_pediatric_inpatient_beds_7_day_avg::numeric, 2),
+           ROUND(all_adult_hospital_inpatient_bed_occupied_7_day_coverage::numeric, 2),
+           ROUND(all_pediatric_inpatient_bed_occupied_7_day_avg::numeric, 2),
+           ROUND(inpatient_beds_used_covid_7_day_avg::numeric, 2)
+    FROM WeeklyBedRollup WHERE collection_week = %s
+    """
+
+BED_STATISTICS_RECENT_WEEKS = """
+    SELECT collection_week,
+           ROUND(all_adult_hospital_beds_7_day_avg::numeric, 2),
+           ROUND(all_pediatric_inpatient_beds_7_day_avg::numeric, 2),
+           ROUND(all_adult_hospital_inpatient_bed_occupied_7_day_coverage::numeric, 2),
+           ROUND(all_pediatric_inpatient_bed_occupied_7_day_avg::numeric, 2),
+           ROUND(inpatient_beds_used_covid_7_day_avg::numeric, 2)
+    FROM WeeklyBedRollup
+    ORDER BY collection_week DESC LIMIT 4
+    """
+
+# display_quality_ratings
+QUALITY_RATINGS = """
+    SELECT hospital_overall_rating,
+    SUM(all_adult_hospital_inpatient_bed_occupied_7_day_coverage + all_pediatric_inpatient_bed_occupied_7_day_avg) /
+    SUM(all_adult_hospital_beds_7_day_avg + all_pediatric_inpatient_beds_7_day_avg) as fraction_of_beds_in_use
+    FROM HospitalBedQuality
+    GROUP BY hospital_overall_rating
+    """
+
+# display_total_bed_usage
+TOTAL_BED_USAGE = """
+    SELECT collection_week, all_cases_beds_used as all_cases, inpatient_beds_used_covid_7_day_avg as covid_cases
+    FROM WeeklyBedRollup WHERE collection_week <= %s
+    ORDER BY collection_week
+    """
+
+# emergency_services_comparison
+EMERGENCY_SERVICES_BY_STATE = """
+    SELECT hl.state, COUNT(*) AS count
+    FROM HospitalQualitySnapshots hq
+    JOIN HospitalLocations hl ON hl.hospital_id = hq.hospital_id
+    WHERE hq.emergency_services = TRUE
+    GROUP BY hl.state
+    ORDER BY count DESC, hl.state
+    LIMIT 20
+    """
+
+# bed_usage_by_ownership
+BED_USAGE_BY_OWNERSHIP = """
+    SELECT hospital_ownership, collection_week, SUM(all_adult_hospital_inpatient_bed_occupied_7_day_coverage + all_pediatric_inpatient_bed_occupied_7_day_avg) / SUM(all_adult_hospital_beds_7_day_avg + all_pediatric_inpatient_beds_7_day_avg) as fraction_of_beds_in_use
+    FROM HospitalBedQuality
+    WHERE hospital_ownership = %s
+    GROUP BY hospital_ownership, collection_week
+    ORDER BY collection_week
+    """
+
+# top_and_bottom_rating: the 10 states with the highest and the 10 with the
+# lowest average rating in a snapshot, a state can be in both when there
+# are fewer than 20
+STATE_RATING_EXTREMES = """
+    WITH state_ratings AS (
+        SELECT l.state, AVG(q.hospital_overall_rating) AS average_rating
+        FROM HospitalQualitySnapshots as q
+        INNER JOIN hospitallocations as l ON q.hospital_id = l.hospital_id
+        WHERE q.data_date = %s AND q.hospital_overall_rating IS NOT NULL AND l.state IS NOT NULL
+        GROUP BY l.state
+    ), ranked AS (
+        SELECT state, average_rating,
+               ROW_NUMBER() OVER (ORDER BY average_rating DESC, state) AS top_rank,
+               ROW_NUMBER() OVER (ORDER BY average_rating, state DESC) AS bottom_rank
+        FROM state_ratings
+    )
+    SELECT state, average_rating, top_rank <= 10 AS top, bottom_rank <= 10 AS bottom
+    FROM ranked
+    WHERE top_rank <= 10 OR bottom_rank <= 10
+    ORDER BY average_rating DESC, state
+    """
+
+# hospitals_near_location: every hospital with coordinates and its beds in the
+# latest loaded week, indexed in process by spatial.HospitalMap
+HOSPITAL_POINTS = """
+    SELECT h.hospital_pk, h.hospital_name, l.city, l.state, l.latitude, l.longitude, b.collection_week,
+           b.all_adult_hospital_beds_7_day_avg - b.all_adult_hospital_inpatient_bed_occupied_7_day_coverage AS adult_beds_free,
+           b.total_icu_beds_7_day_avg - b.icu_beds_used_7_day_avg AS icu_beds_free,
+           b.inpatient_beds_used_covid_7_day_avg AS covid_beds_used
+    FROM HospitalLocations l
+    JOIN Hospitals h ON h.hospital_id = l.hospital_id
+    LEFT JOIN HospitalBedInformation b ON b.hospital_id = l.hospital_id
+     AND b.collection_week = (SELECT MAX(collection_week) FROM WeeklyBedRollup)
+    WHERE l.latitude IS NOT NULL AND l.longitude IS NOT NULL
+    ORDER BY h.hospital_pk
+    """
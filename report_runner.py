@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg_pool import ConnectionPool
+
+from db import current_load_version, get_conninfo
+from query_cache import cache
+from report_data import fetch_frame
+
+
+# Upper bound on the database connections held by the dashboard, shared by
+# every browser session, and on the panel queries running at the same time
+MAX_CONNECTIONS = 8
+
+# Where the panel queries run: 'postgres', the database given by
+# db.get_conninfo, or 'duckdb', the Parquet exports of analytics.py, which
+# need no database server
+REPORT_BACKEND = os.environ.get("REPORT_BACKEND", "postgres")
+
+# Module-level, like the query cache, so they outlive Streamlit reruns
+executor = ThreadPoolExecutor(max_workers=MAX_CONNECTIONS, thread_name_prefix="report-query")
+pool = None
+pool_lock = threading.Lock()
+backend = None
+backend_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Open the dashboard's connection pool on first use.
+
+    Returns:
+    - ConnectionPool, between 1 and MAX_CONNECTIONS connections to the
+      database given by db.get_conninfo
+    """
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = ConnectionPool(get_conninfo(), min_size=1, max_size=MAX_CONNECTIONS, open=True)
+    return pool
+
+
+class PostgresBackend:
+    """
+    Runs the dashboard queries on pooled connections to Postgres.
+    """
+
+    def load_version(self):
+        """
+        Returns:
+        - int, number of committed loads (see db.current_load_version)
+        """
+        with get_pool().connection() as conn, conn.cursor() as curr:
+            return current_load_version(curr)
+
+    def fetch(self, query, params=()):
+        """
+        Run a dashboard query on a pooled connection.
+
+        Returns:
+        - pandas df, the query result (see report_data.fetch_frame)
+        """
+        with get_pool().connection() as conn:
+            return fetch_frame(conn, query, params)
+
+
+def get_backend():
+    """
+    Create the backend chosen by REPORT_BACKEND on first use.
+
+    Returns:
+    - PostgresBackend or analytics.DuckDBBackend
+    """
+    global backend
+    with backend_lock:
+        if backend is None:
+            if REPORT_BACKEND == 'duckdb':
+                from analytics import DuckDBBackend
+                backend = DuckDBBackend()
+            elif REPORT_BACKEND == 'postgres':
+                backend = PostgresBackend()
+            else:
+                raise ValueError(f"Unknown REPORT_BACKEND {REPORT_BACKEND!r}, expected 'postgres' or 'duckdb'")
+    return backend
+
+
+def check_version():
+    """
+    Drop the cached results if a load has been committed since the last
+    dashboard run (see QueryCache.check_version).
+    """
+    cache.check_version(get_backend())
+
+
+def timed_fetch(query, params=()):
+    """
+    Run a query through the cache, on the backend on a miss.
+
+    Parameters:
+    - query: str, SQL query
+    - params: tuple, query parameters
+
+    Returns:
+    - pandas df, the query result (see QueryCache.fetch)
+    - float, seconds taken
+    - bool, whether the result came from the cache
+    """
+    start_time = time.perf_counter()
+    result = cache.lookup(query, params)
+    cached = result is not None
+    if not cached:
+        result = cache.fetch(get_backend(), query, params)
+    return result, time.perf_counter() - start_time, cached
+
+
+def submit_queries(queries):
+    """
+    Start a panel's queries on the shared executor.
+
+    Parameters:
+    - queries: dict, query name -> (SQL query, parameters)
+
+    Returns:
+    - dict, query name -> Future of the timed_fetch result
+    """
+    return {name: executor.submit(timed_fetch, query, params) for name, (query, params) in queries.items()}
@@ -0,0 +1,107 @@
+import time
+
+import psycopg
+
+from db import get_conninfo, record_ingest
+
+
+# Rollup tables maintained by refresh_rollups, one row per week or per week and state
+ROLLUP_TABLES = ('WeeklyBedRollup', 'WeeklyStateBedRollup')
+
+# Columns of both rollups after the grouping keys, filled by ROLLUP_AGGREGATES
+ROLLUP_COLUMNS = """
+    record_count, beds_reported_count, covid_reported_count,
+    all_adult_hospital_beds_7_day_avg, all_pediatric_inpatient_beds_7_day_avg,
+    all_adult_hospital_inpatient_bed_occupied_7_day_coverage, all_pediatric_inpatient_bed_occupied_7_day_avg,
+    total_icu_beds_7_day_avg, icu_beds_used_7_day_avg, inpatient_beds_used_covid_7_day_avg,
+    staffed_icu_adult_patients_confirmed_covid_7_day_avg, all_cases_beds_used
+    """
+
+ROLLUP_AGGREGATES = """
+    COUNT(*),
+    COUNT(b.all_adult_hospital_beds_7_day_avg),
+    COUNT(b.inpatient_beds_used_covid_7_day_avg),
+    SUM(b.all_adult_hospital_beds_7_day_avg),
+    SUM(b.all_pediatric_inpatient_beds_7_day_avg),
+    SUM(b.all_adult_hospital_inpatient_bed_occupied_7_day_coverage),
+    SUM(b.all_pediatric_inpatient_bed_occupied_7_day_avg),
+    SUM(b.total_icu_beds_7_day_avg),
+    SUM(b.icu_beds_used_7_day_avg),
+    SUM(b.inpatient_beds_used_covid_7_day_avg),
+    SUM(b.staffed_icu_adult_patients_confirmed_covid_7_day_avg),
+    SUM(b.all_adult_hospital_inpatient_bed_occupied_7_day_coverage + b.all_pediatric_inpatient_bed_occupied_7_day_avg + b.icu_beds_used_7_day_avg)
+    """
+
+WEEKLY_ROLLUP_INSERT = f"""
+    INSERT INTO WeeklyBedRollup (collection_week, {ROLLUP_COLUMNS})
+    SELECT b.collection_week, {ROLLUP_AGGREGATES}
+    FROM HospitalBedInformation b
+    WHERE b.collection_week = ANY(%s)
+    GROUP BY b.collection_week
+    """
+
+STATE_ROLLUP_INSERT = f"""
+    INSERT INTO WeeklyStateBedRollup (collection_week, state, {ROLLUP_COLUMNS})
+    SELECT b.collection_week, l.state, {ROLLUP_AGGREGATES}
+    FROM HospitalBedInformation b
+    JOIN HospitalLocations l ON l.hospital_id = b.hospital_id
+    WHERE b.collection_week = ANY(%s) AND l.state IS NOT NULL
+    GROUP BY b.collection_week, l.state
+    """
+
+
+def refresh_rollups(curr, weeks=None):
+    """
+    Recompute the rollup rows of some weeks from HospitalBedInformation.
+    Call inside the load's transaction so the rollups change together with
+    the facts. Refreshes are serialized with a transaction-level advisory
+    lock, so concurrent loads of the same week each recompute it with the
+    rows the other one committed.
+
+    Parameters:
+    - curr: psycopg cursor
+    - weeks: list of dates to recompute (default is None, which recomputes
+      every week)
+    """
+    curr.execute("SELECT pg_advisory_xact_lock(hashtext('WeeklyBedRollup'))")
+    if weeks is None:
+        curr.execute("SELECT ARRAY(SELECT DISTINCT collection_week FROM HospitalBedInformation)")
+        weeks = curr.fetchone()[0]
+        for table in ROLLUP_TABLES:
+            curr.execute(f"DELETE FROM {table}")
+    else:
+        weeks = list(weeks)
+        for table in ROLLUP_TABLES:
+            curr.execute(f"DELETE FROM {table} WHERE collection_week = ANY(%s)", (weeks,))
+
+    curr.execute(WEEKLY_ROLLUP_INSERT, (weeks,))
+    curr.execute(STATE_ROLLUP_INSERT, (weeks,))
+
+
+def rebuild_rollups(conn):
+    """
+    Recompute both rollup tables from scratch, e.g. after rows were changed
+    or deleted outside the loaders. The rebuild is recorded in IngestLog so
+    the dashboard's cached query results are invalidated.
+
+    Parameters:
+    - conn: psycopg connection
+    """
+    start_time = time.time()
+    with conn.cursor() as curr:
+        refresh_rollups(curr)
+        curr.execute("SELECT COUNT(*) FROM WeeklyBedRollup")
+        n_weeks = curr.fetchone()[0]
+        record_ingest(curr, 'rollups', None, None)
+    conn.commit()
+    print(f"Rebuilt rollups for {n_weeks} weeks in {time.time() - start_time:.2f}s")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Recompute the weekly bed rollups from HospitalBedInformation.")
+    parser.parse_args()
+
+    with psycopg.connect(get_conninfo()) as conn:
+        rebuild_rollups(conn)
@@ -0,0 +1,215 @@
+import threading
+
+import numpy as np
+
+
+# Mean radius of the Earth, for great-circle distances
+EARTH_RADIUS_KM = 6371.0088
+
+# Radius of the first search of nearest, doubled until enough points are found
+NEAREST_START_KM = 25.0
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """
+    Great-circle distance from one point to many, all in radians.
+
+    Returns:
+    - float ndarray, distances in km
+    """
+    a = (np.sin((latitudes - latitude) / 2) ** 2
+         + np.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GridIndex:
+    """
+    Spatial index of points on a latitude/longitude grid.
+
+    The points are sorted by grid cell, and the start of every cell in that
+    order is kept in one array, so the points of a run of cells in a grid
+    row are one slice. A radius query reads the cells of the rows and
+    columns the circle can reach, and computes exact distances only for
+    their points.
+    """
+
+    def __init__(self, latitudes, longitudes, cell_degrees=1.0):
+        """
+        Parameters:
+        - latitudes, longitudes: float arrays, coordinates in degrees, points
+          with a NaN coordinate are never returned
+        - cell_degrees: float, size of the grid cells in degrees (default 1.0)
+        """
+        self.cell_degrees = cell_degrees
+        self.n_rows = int(np.ceil(180 / cell_degrees))
+        self.n_columns = int(np.ceil(360 / cell_degrees))
+
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        # Points without coordinates are left out of the index
+        located = np.flatnonzero(np.isfinite(latitudes) & np.isfinite(longitudes))
+        cells = self.grid_row(latitudes[located]) * self.n_columns + self.grid_column(longitudes[located])
+        # Positions of the points in cell order, and the start of every cell in that order
+        by_cell = np.argsort(cells, kind='stable')
+        self.order = located[by_cell]
+        self.cell_starts = np.searchsorted(cells[by_cell], np.arange(self.n_rows * self.n_columns + 1))
+        self.latitudes = np.radians(latitudes[self.order])
+        self.longitudes = np.radians(longitudes[self.order])
+
+    def __len__(self):
+        return len(self.order)
+
+    def grid_row(self, latitudes):
+        return np.clip(np.floor((np.asarray(latitudes) + 90) / self.cell_degrees).astype(np.int64), 0, self.n_rows - 1)
+
+    def grid_column(self, longitudes):
+        return np.minimum(np.floor((np.asarray(longitudes) + 180) % 360 / self.cell_degrees).astype(np.int64),
+                          self.n_columns - 1)
+
+    def candidates(self, latitude, longitude, radius_km):
+        """
+        Returns:
+        - int ndarray, positions in cell order of the points in the cells a
+          circle can reach, a superset of the points in the circle
+        """
+        angle = radius_km / EARTH_RADIUS_KM
+        if angle >= np.pi:
+            return np.arange(len(self))
+        lat_span = np.degrees(angle)
+        first_row, last_row = self.grid_row([latitude - lat_span, latitude + lat_span])
+
+        # Widest longitude span of the circle, unless it reaches over a pole
+        if latitude - lat_span <= -90 or latitude + lat_span >= 90 or np.sin(angle) >= np.cos(np.radians(latitude)):
+            lon_span = 180.0
+        else:
+            lon_span = np.degrees(np.arcsin(np.sin(angle) / np.cos(np.radians(latitude))))
+        # Longitudes of the circle as offsets east of the antimeridian, the east edge past 360 when it crosses it
+        west = (longitude - lon_span + 180) % 360
+        east = west + 2 * lon_span
+        first_column = min(int(west // self.cell_degrees), self.n_columns - 1)
+        if lon_span >= 180:
+            column_runs = [(0, self.n_columns - 1)]
+        elif east < 360:
+            column_runs = [(first_column, min(int(east // self.cell_degrees), self.n_columns - 1))]
+        else:
+            # A circle across the antimeridian covers the two ends of the rows
+            last_column = int((east - 360) // self.cell_degrees)
+            column_runs = ([(0, self.n_columns - 1)] if last_column >= first_column
+                           else [(first_column, self.n_columns - 1), (0, last_column)])
+
+        # One slice of the cell order per grid row and run of columns, concatenated without a Python loop
+        rows = np.arange(first_row, last_row + 1)[:, None] * self.n_columns
+        firsts, lasts = np.array(column_runs).T
+        starts = self.cell_starts[rows + firsts].ravel()
+        lengths = self.cell_starts[rows + lasts + 1].ravel() - starts
+        offsets = np.cumsum(lengths) - lengths
+        return np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+
+    def within(self, latitude, longitude, radius_km):
+        """
+        Find the points within a distance of a location.
+
+        Parameters:
+        - latitude, longitude: float, location in degrees
+        - radius_km: float, distance in km
+
+        Returns:
+        - int ndarray, positions of the points in the input arrays, nearest first
+        - float ndarray, their distances in km
+        """
+        candidates = self.candidates(latitude, longitude, radius_km)
+        distances = haversine_km(np.radians(latitude), np.radians(longitude),
+                                 self.latitudes[candidates], self.longitudes[candidates])
+        inside = distances <= radius_km
+        candidates, distances = candidates[inside], distances[inside]
+        by_distance = np.argsort(distances, kind='stable')
+        return self.order[candidates[by_distance]], distances[by_distance]
+
+    def nearest(self, latitude, longitude, k):
+        """
+        Find the k points nearest to a location. The cells around it are
+        searched within a radius starting at NEAREST_START_KM and doubling
+        until they hold k points. The k-th nearest of those bounds the
+        distance of the k nearest, which are then found with within.
+
+        Parameters:
+        - latitude, longitude: float, location in degrees
+        - k: int, number of points
+
+        Returns:
+        - int ndarray, positions of the points in the input arrays, nearest first
+        - float ndarray, their distances in km
+        """
+        k = min(k, len(self))
+        if k == 0:
+            return self.order[:0], np.zeros(0)
+        radius_km = NEAREST_START_KM
+        candidates = self.candidates(latitude, longitude, radius_km)
+        while len(candidates) < k:
+            radius_km *= 2
+            candidates = self.candidates(latitude, longitude, radius_km)
+        distances = haversine_km(np.radians(latitude), np.radians(longitude),
+                                 self.latitudes[candidates], self.longitudes[candidates])
+        positions, distances = self.within(latitude, longitude, np.partition(distances, k - 1)[k - 1])
+        return positions[:k], distances[:k]
+
+
+class HospitalMap:
+    """
+    Hospitals with coordinates and the beds of their latest week, as
+    returned by report_queries.HOSPITAL_POINTS, with a GridIndex over them.
+    """
+
+    def __init__(self, hospitals, cell_degrees=1.0):
+        """
+        Parameters:
+        - hospitals: pandas df, with 'latitude' and 'longitude' columns
+        - cell_degrees: float, size of the grid cells in degrees (default 1.0)
+        """
+        self.hospitals = hospitals
+        self.index = GridIndex(hospitals['latitude'].to_numpy(), hospitals['longitude'].to_numpy(), cell_degrees)
+
+    def rows(self, positions, distances):
+        result = self.hospitals.iloc[positions].reset_index(drop=True)
+        result.insert(0, 'distance_km', distances)
+        return result
+
+    def within(self, latitude, longitude, radius_km):
+        """
+        Returns:
+        - pandas df, hospitals within radius_km of the location with their
+          'distance_km', nearest first
+        """
+        return self.rows(*self.index.within(latitude, longitude, radius_km))
+
+    def nearest(self, latitude, longitude, k):
+        """
+        Returns:
+        - pandas df, the k hospitals nearest to the location with their
+          'distance_km', nearest first
+        """
+        return self.rows(*self.index.nearest(latitude, longitude, k))
+
+
+# Map of the last result passed to hospital_map. The query cache returns the
+# same DataFrame until a load is committed, so the index is built once per load.
+_last_map = None
+_last_map_lock = threading.Lock()
+
+
+def hospital_map(hospitals):
+    """
+    Build the HospitalMap of a query result, or reuse the one of the
+    previous call if it was given the same DataFrame.
+
+    Parameters:
+    - hospitals: pandas df, result of report_queries.HOSPITAL_POINTS
+
+    Returns:
+    - HospitalMap
+    """
+    global _last_map
+    with _last_map_lock:
+        if _last_map is None or _last_map.hospitals is not hospitals:
+            _last_map = HospitalMap(hospitals)
+        return _last_map
@@ -0,0 +1,61 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+
+import psycopg
+import pytest
+from psycopg.conninfo import make_conninfo
+
+# The modules live at the top of the repository, like the scripts import them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# load_quality sets up logging to log_output.txt in the working directory when
+# it is imported, so it is imported first from a scratch directory
+with tempfile.TemporaryDirectory() as log_dir:
+    working_dir = os.getcwd()
+    os.chdir(log_dir)
+    try:
+        import load_quality  # noqa: F401
+    finally:
+        os.chdir(working_dir)
+
+# Connection string of a Postgres server to create scratch databases on, the
+# tests that need a database are skipped without it
+ADMIN_CONNINFO = os.environ.get("TEST_DATABASE_URL")
+
+
+@pytest.fixture
+def database(request):
+    """
+    Yields:
+    - str, connection string of an empty scratch database named after the
+      test module
+    """
+    if not ADMIN_CONNINFO:
+        pytest.skip("TEST_DATABASE_URL is not set")
+
+    name = request.module.__name__.rpartition('.')[2]
+    with psycopg.connect(ADMIN_CONNINFO, autocommit=True) as admin:
+        admin.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+        admin.execute(f"CREATE DATABASE {name}")
+    try:
+        yield make_conninfo(ADMIN_CONNINFO, dbname=name)
+    finally:
+        with psycopg.connect(ADMIN_CONNINFO, autocommit=True) as admin:
+            admin.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+
+
+@pytest.fixture
+def conninfo(database):
+    """
+    Yields:
+    - str, connection string of the scratch database with every migration
+      applied
+    """
+    from migrations import migrate
+
+    with psycopg.connect(database) as conn, contextlib.redirect_stdout(io.StringIO()):
+        migrate(conn)
+    yield database
@@ -0,0 +1,173 @@
+import datetime
+import json
+import os
+
+import pandas as pd
+import psycopg
+import pytest
+
+import analytics
+import report_queries
+from load_hhs import load_hhs_data
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+pytest.importorskip("duckdb")
+
+HHS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'hhs_data')
+
+WEEKS = [datetime.date(2022, 9, 23), datetime.date(2022, 9, 30)]
+SNAPSHOTS = [datetime.date(2022, 1, 1), datetime.date(2022, 10, 1)]
+
+BED_COLUMNS = ['all_adult_hospital_beds_7_day_avg', 'all_pediatric_inpatient_beds_7_day_avg',
+               'all_adult_hospital_inpatient_bed_occupied_7_day_coverage',
+               'all_pediatric_inpatient_bed_occupied_7_day_avg', 'inpatient_beds_used_covid_7_day_avg']
+
+
+def bed_values(scale):
+    return dict(zip(BED_COLUMNS, [100.0 * scale, 20.0 * scale, 60.0 * scale, 10.0 * scale, 5.0 * scale]))
+
+
+def relations():
+    """
+    Returns:
+    - dict, relation -> pandas df with the columns the dashboard queries read,
+      for three hospitals (the third without coordinates) over two weeks and
+      two quality snapshots
+    """
+    hospitals = pd.DataFrame({'hospital_id': [1, 2, 3], 'hospital_pk': ['010001', '050002', '450003'],
+                              'hospital_name': ['A', 'B', 'C']})
+    locations = pd.DataFrame({'hospital_id': [1, 2, 3], 'city': ['Dothan', 'Fresno', 'Austin'],
+                              'state': ['AL', 'CA', 'TX'], 'latitude': [31.2, 36.7, None],
+                              'longitude': [-85.4, -119.8, None]})
+    beds = pd.DataFrame([{'hospital_id': hospital_id, 'collection_week': week, **bed_values(hospital_id),
+                          'total_icu_beds_7_day_avg': 10.0, 'icu_beds_used_7_day_avg': 4.0}
+                         for week in WEEKS for hospital_id in (1, 2, 3)])
+    rollup = pd.DataFrame([{'collection_week': week, 'record_count': 3, **bed_values(6),
+                            'all_cases_beds_used': 420.0} for week in WEEKS])
+    snapshots = pd.DataFrame({'data_date': [SNAPSHOTS[0]] * 3 + [SNAPSHOTS[1]] * 2,
+                              'hospital_id': [1, 2, 3, 1, 2], 'hospital_overall_rating': [3.0, 4.0, None, 2.0, 4.0],
+                              'emergency_services': [True, True, False, True, False],
+                              'hospital_type': 'Acute Care Hospitals',
+                              'hospital_ownership': ['Voluntary', 'Proprietary', 'Voluntary', 'Voluntary', 'Proprietary']})
+    bed_quality = beds.merge(snapshots[snapshots['data_date'] == SNAPSHOTS[0]].drop(columns='data_date'),
+                             on='hospital_id')
+    return {'Hospitals': hospitals, 'HospitalLocations': locations, 'WeeklyBedRollup': rollup,
+            'HospitalBedInformation': beds, 'HospitalBedQuality': bed_quality, 'HospitalQualitySnapshots': snapshots}
+
+
+def write_exports(path, frames, load_version=1):
+    """
+    Write Parquet exports and their manifest the way analytics.export does.
+    """
+    path.mkdir(exist_ok=True)
+    for relation, frame in frames.items():
+        pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), path / f"{relation}.parquet")
+    manifest = {'load_version': load_version,
+                'relations': {relation: {'rows': len(frame)} for relation, frame in frames.items()}}
+    (path / analytics.MANIFEST).write_text(json.dumps(manifest))
+
+
+@pytest.fixture
+def backend(tmp_path):
+    write_exports(tmp_path / 'analytics', relations())
+    return analytics.DuckDBBackend(str(tmp_path / 'analytics'))
+
+
+# Query, parameters, expected columns (None where the query leaves a column
+# unnamed and DuckDB names it after the expression) and number of rows
+QUERIES = {
+    'RECORDS_AT_WEEK': ((WEEKS[1],), [None], 1),
+    'RECORDS_PREVIOUS_WEEKS': ((WEEKS[1],), ['collection_week', 'record_count'], 1),
+    'BED_STATISTICS_AT_WEEK': ((WEEKS[0],), [None] * 5, 1),
+    'BED_STATISTICS_RECENT_WEEKS': ((), ['collection_week'] + [None] * 5, 2),
+    'QUALITY_RATINGS': ((), ['hospital_overall_rating', 'fraction_of_beds_in_use'], 3),
+    'TOTAL_BED_USAGE': ((WEEKS[1],), ['collection_week', 'all_cases', 'covid_cases'], 2),
+    'EMERGENCY_SERVICES_BY_STATE': ((), ['state', 'count'], 2),
+    'BED_USAGE_BY_OWNERSHIP': (('Voluntary',), ['hospital_ownership', 'collection_week', 'fraction_of_beds_in_use'], 2),
+    'STATE_RATING_EXTREMES': ((SNAPSHOTS[0],), ['state', 'average_rating', 'top', 'bottom'], 2),
+    'HOSPITAL_POINTS': ((), ['hospital_pk', 'hospital_name', 'city', 'state', 'latitude', 'longitude',
+                             'collection_week', 'adult_beds_free', 'icu_beds_free', 'covid_beds_used'], 2),
+}
+
+
+def test_every_dashboard_query_is_covered():
+    assert sorted(QUERIES) == sorted(name for name in vars(report_queries) if name.isupper())
+
+
+@pytest.mark.parametrize('name', sorted(QUERIES))
+def test_dashboard_query_on_duckdb(backend, name):
+    params, columns, n_rows = QUERIES[name]
+    df = backend.fetch(getattr(report_queries, name), params)
+    assert len(df.columns) == len(columns)
+    assert [column for column, expected in zip(df.columns, columns) if expected is not None] == \
+        [column for column in columns if column is not None]
+    assert len(df) == n_rows
+
+
+def test_dashboard_query_values_on_duckdb(backend):
+    assert backend.fetch(report_queries.RECORDS_AT_WEEK, (WEEKS[1],)).iloc[0, 0] == 3
+    # A week without rows counts none
+    assert backend.fetch(report_queries.RECORDS_AT_WEEK, (datetime.date(2022, 10, 7),)).iloc[0, 0] == 0
+    assert backend.fetch(report_queries.BED_STATISTICS_AT_WEEK, (WEEKS[0],)).iloc[0].tolist() == \
+        [600.0, 120.0, 360.0, 60.0, 30.0]
+
+    recent = backend.fetch(report_queries.BED_STATISTICS_RECENT_WEEKS)
+    assert pd.to_datetime(recent['collection_week']).dt.date.tolist() == WEEKS[::-1]
+
+    emergency = backend.fetch(report_queries.EMERGENCY_SERVICES_BY_STATE)
+    # Hospital 1 offers emergency services in both snapshots
+    assert emergency.values.tolist() == [['AL', 2], ['CA', 1]]
+
+    extremes = backend.fetch(report_queries.STATE_RATING_EXTREMES, (SNAPSHOTS[0],))
+    assert extremes['state'].tolist() == ['CA', 'AL']
+    assert extremes['top'].all() and extremes['bottom'].all()
+
+    points = backend.fetch(report_queries.HOSPITAL_POINTS)
+    assert points['hospital_pk'].tolist() == ['010001', '050002']
+    # Beds of the latest week, hospital 2 has 200 adult beds with 120 occupied
+    assert points['adult_beds_free'].tolist() == [40.0, 80.0]
+
+
+def test_backend_reads_refreshed_exports(tmp_path, backend):
+    frames = relations()
+    week = datetime.date(2022, 10, 7)
+    frames['WeeklyBedRollup'] = pd.concat([frames['WeeklyBedRollup'], pd.DataFrame(
+        [{'collection_week': week, 'record_count': 2, **bed_values(3), 'all_cases_beds_used': 210.0}])])
+    write_exports(tmp_path / 'analytics', frames, load_version=2)
+
+    assert backend.load_version() == 2
+    assert backend.fetch(report_queries.RECORDS_AT_WEEK, (week,)).iloc[0, 0] == 2
+    assert len(backend.fetch(report_queries.TOTAL_BED_USAGE, (week,))) == 3
+
+
+def test_backend_needs_exports(tmp_path):
+    with pytest.raises(RuntimeError, match='No analytics exports'):
+        analytics.DuckDBBackend(str(tmp_path))
+
+
+def test_reexport_after_a_load_picks_up_its_rows(conninfo, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(analytics, 'ANALYTICS_DIR', str(tmp_path / 'analytics'))
+    for week in WEEKS:
+        pd.read_csv(os.path.join(HHS_DIR, f"{week}-hhs-data.csv"), dtype=object).head(30) \
+            .to_csv(tmp_path / f"{week}-hhs-data.csv", index=False)
+
+    with psycopg.connect(conninfo) as conn:
+        assert load_hhs_data(str(tmp_path / f"{WEEKS[0]}-hhs-data.csv"), conn,
+                             rejects_path=str(tmp_path / 'rejects.csv')) is not None
+        exported = analytics.export(conn)
+        assert sorted(exported) == sorted(analytics.RELATIONS)
+        backend = analytics.DuckDBBackend(analytics.ANALYTICS_DIR)
+        version = backend.load_version()
+        assert backend.fetch(report_queries.RECORDS_AT_WEEK, (WEEKS[1],)).iloc[0, 0] == 0
+
+        # The loader refreshes the exports once the directory exists
+        result = load_hhs_data(str(tmp_path / f"{WEEKS[1]}-hhs-data.csv"), conn,
+                               rejects_path=str(tmp_path / 'rejects.csv'))
+        assert result['inserted'] > 0
+        assert backend.load_version() > version
+        assert backend.fetch(report_queries.RECORDS_AT_WEEK, (WEEKS[1],)).iloc[0, 0] == result['inserted']
+        for name, (params, _, _) in QUERIES.items():
+            postgres = pd.DataFrame(conn.execute(getattr(report_queries, name), params).fetchall())
+            assert len(backend.fetch(getattr(report_queries, name), params)) == len(postgres), name
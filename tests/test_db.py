@@ -0,0 +1,120 @@
+import contextlib
+
+import psycopg
+import pytest
+
+from db import batch_insert_rows
+
+INSERT_QUERY = "INSERT INTO t (x) VALUES (%s)"
+
+
+class FakeConnection:
+    """
+    Connection whose table is a list, with transaction blocks that undo the
+    rows appended in them when they fail.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.closed = False
+
+    @contextlib.contextmanager
+    def transaction(self):
+        saved = len(self.rows)
+        try:
+            yield
+        except psycopg.Error:
+            del self.rows[saved:]
+            raise
+
+
+class FakeCursor:
+    """
+    Cursor that appends the rows it is given and raises on the bad ones.
+    Inside a pipelined savepoint the error only surfaces at the next sync,
+    like psycopg's, and the statements until the rollback are skipped.
+    """
+
+    def __init__(self, bad_rows=(), fail_connection=False):
+        self.connection = FakeConnection()
+        self.bad_rows = set(bad_rows)
+        self.fail_connection = fail_connection
+        self.batches = []
+        self.savepoint = None
+        self.aborted = False
+        self.pending_error = None
+
+    def executemany(self, query, rows):
+        if self.aborted:
+            return
+        self.batches.append(list(rows))
+        for row in rows:
+            if row in self.bad_rows:
+                if self.fail_connection:
+                    self.connection.closed = True
+                error = psycopg.errors.CheckViolation(f"bad row {row}")
+                if self.savepoint is None:
+                    raise error
+                self.aborted, self.pending_error = True, error
+                return
+            self.connection.rows.append(row)
+
+    def execute(self, query):
+        if query == "ROLLBACK TO SAVEPOINT pipelined_block":
+            del self.connection.rows[self.savepoint:]
+            self.aborted = False
+        elif self.aborted:
+            return
+        elif query == "SAVEPOINT pipelined_block":
+            self.savepoint = len(self.connection.rows)
+        elif query == "RELEASE SAVEPOINT pipelined_block":
+            self.savepoint = None
+
+
+class FakePipeline:
+    def __init__(self, curr):
+        self.curr = curr
+
+    def sync(self):
+        error, self.curr.pending_error = self.curr.pending_error, None
+        if error is not None:
+            raise error
+
+
+@pytest.mark.parametrize('pipelined', [False, True], ids=['savepoints', 'pipeline'])
+def test_only_the_bad_row_is_rejected(pipelined):
+    rows = [(value,) for value in range(13)]
+    curr = FakeCursor(bad_rows=[(7,)])
+    pipeline = FakePipeline(curr) if pipelined else None
+
+    inserted, failed, failed_indices = batch_insert_rows(curr, INSERT_QUERY, rows, [100 + i for i in range(13)],
+                                                         pipeline)
+    assert (inserted, failed, failed_indices) == (12, 1, [107])
+    assert sorted(curr.connection.rows) == [row for row in rows if row != (7,)]
+    # The bad row is isolated by halving, not by retrying every row alone
+    assert len(curr.batches) <= 2 * 4 + 1
+
+
+def test_several_bad_rows():
+    rows = [(value,) for value in range(500)]
+    bad_rows = [(0,), (250,), (251,), (499,)]
+    curr = FakeCursor(bad_rows=bad_rows)
+
+    inserted, failed, failed_indices = batch_insert_rows(curr, INSERT_QUERY, rows, list(range(500)))
+    assert (inserted, failed) == (496, 4)
+    assert failed_indices == [0, 250, 251, 499]
+    assert sorted(curr.connection.rows) == [row for row in rows if row not in bad_rows]
+
+
+def test_a_clean_batch_is_inserted_at_once():
+    rows = [(value,) for value in range(10)]
+    curr = FakeCursor()
+    assert batch_insert_rows(curr, INSERT_QUERY, rows, list(range(10))) == (10, 0, [])
+    assert curr.batches == [rows]
+
+
+def test_a_lost_connection_is_raised():
+    curr = FakeCursor(bad_rows=[(3,)], fail_connection=True)
+    with pytest.raises(psycopg.Error):
+        batch_insert_rows(curr, INSERT_QUERY, [(value,) for value in range(8)], list(range(8)))
+    assert len(curr.batches) == 1
@@ -0,0 +1,50 @@
+import os
+
+import psycopg
+import pytest
+
+from benchmarks import fault_injection, synthetic
+from benchmarks.run_benchmarks import scratch_database
+
+# Rows of the HHS chunks, and committed rows to interrupt each file at
+CHUNKSIZE = 300
+KILL_AFTER = (500, 1000)
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    # A quarter of the hospitals of the benchmarks keeps the loads short
+    monkeypatch.setattr(synthetic, 'BASE_HOSPITALS', 1200)
+    return synthetic.generate(str(tmp_path / 'data'), weeks=2, snapshots=2, seed=3)
+
+
+def run(conninfo, files, work_dir, checkpoint, before_checkpoint=False):
+    os.makedirs(work_dir)
+    return fault_injection.run(conninfo, files, work_dir, checkpoint, KILL_AFTER, chunksize=CHUNKSIZE, bulk=True,
+                               before_checkpoint=before_checkpoint)
+
+
+@pytest.mark.parametrize('before_checkpoint', [False, True], ids=['committed', 'before_checkpoint'])
+def test_interrupted_loads_match_a_clean_load(conninfo, files, tmp_path, monkeypatch, before_checkpoint):
+    monkeypatch.chdir(tmp_path)
+    reference = run(conninfo, files, str(tmp_path / 'reference'), checkpoint=False)
+
+    with scratch_database(os.environ['TEST_DATABASE_URL'], 'test_fault_injection_interrupted') as interrupted_conninfo:
+        interrupted = run(interrupted_conninfo, files, str(tmp_path / 'interrupted'), checkpoint=True,
+                          before_checkpoint=before_checkpoint)
+
+        with psycopg.connect(conninfo) as reference_conn, psycopg.connect(interrupted_conninfo) as interrupted_conn:
+            for table in fault_injection.COMPARED_TABLES:
+                expected = fault_injection.table_digest(reference_conn, table)
+                assert expected[0] > 0, table
+                assert fault_injection.table_digest(interrupted_conn, table) == expected, table
+            # Every resumed load ran to the end and cleared its checkpoint
+            assert interrupted_conn.execute("SELECT COUNT(*) FROM LoadCheckpoints").fetchone()[0] == 0
+
+    for path, (expected, _) in reference.items():
+        result, interruptions = interrupted[path]
+        name = os.path.basename(path)
+        assert len(interruptions) == len(KILL_AFTER), name
+        assert result == expected, name
+        assert (tmp_path / 'interrupted' / f"{name}.rejects").read_bytes() == \
+            (tmp_path / 'reference' / f"{name}.rejects").read_bytes(), name
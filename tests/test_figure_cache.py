@@ -0,0 +1,75 @@
+import matplotlib
+
+matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt
+import pandas as pd
+
+from figure_cache import FigureCache, digest
+
+DPI = 20
+
+
+def draw_beds(df, title):
+    plt.plot(df['week'], df['beds'])
+    plt.title(title)
+
+
+def beds_frame(scale=1):
+    return pd.DataFrame({'week': [1, 2, 3], 'beds': [10.0 * scale, 12.5 * scale, 9.0 * scale]})
+
+
+def test_identical_frames_hit_the_cache():
+    cache = FigureCache()
+    image = cache.render(draw_beds, beds_frame(), 'Beds', dpi=DPI)
+    assert image.startswith(b'\x89PNG')
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    # A new DataFrame with the same content is the same figure
+    assert cache.render(draw_beds, beds_frame(), 'Beds', dpi=DPI) is image
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.render(draw_beds, beds_frame(2), 'Beds', dpi=DPI)
+    cache.render(draw_beds, beds_frame(), 'Other title', dpi=DPI)
+    cache.render(draw_beds, beds_frame(), 'Beds', format='svg', dpi=DPI)
+    assert (cache.hits, cache.misses) == (1, 4)
+    assert len(cache.entries) == 4
+    assert cache.size == sum(len(entry) for entry in cache.entries.values())
+
+
+def test_digest_tells_frames_apart():
+    assert digest(beds_frame()) == digest(beds_frame())
+    assert digest(beds_frame()) != digest(beds_frame(2))
+    assert digest(beds_frame()) != digest(beds_frame().astype({'beds': 'float32'}))
+    assert digest('ab', 'c') != digest('a', 'bc')
+
+
+def test_least_recently_used_entries_are_evicted_past_the_cap():
+    frames = {name: beds_frame(scale) for name, scale in (('a', 1), ('b', 2), ('c', 3))}
+    sizes = {name: len(FigureCache().render(draw_beds, frame, name, dpi=DPI)) for name, frame in frames.items()}
+
+    # Room for all three figures but one byte
+    cache = FigureCache(max_bytes=sum(sizes.values()) - 1)
+    cache.render(draw_beds, frames['a'], 'a', dpi=DPI)
+    cache.render(draw_beds, frames['b'], 'b', dpi=DPI)
+    cache.render(draw_beds, frames['a'], 'a', dpi=DPI)
+    cache.render(draw_beds, frames['c'], 'c', dpi=DPI)
+
+    # b was used least recently
+    assert cache.evictions == 1
+    assert cache.size == sizes['a'] + sizes['c'] <= cache.max_bytes
+    cache.render(draw_beds, frames['a'], 'a', dpi=DPI)
+    cache.render(draw_beds, frames['c'], 'c', dpi=DPI)
+    assert (cache.hits, cache.misses) == (3, 3)
+    cache.render(draw_beds, frames['b'], 'b', dpi=DPI)
+    assert cache.misses == 4
+    assert cache.evictions == 2
+
+
+def test_figures_larger_than_the_cache_are_not_kept():
+    cache = FigureCache(max_bytes=10)
+    image = cache.render(draw_beds, beds_frame(), 'Beds', dpi=DPI)
+    assert len(image) > 10
+    assert len(cache.entries) == 0 and cache.size == 0
+    cache.render(draw_beds, beds_frame(), 'Beds', dpi=DPI)
+    assert cache.misses == 2
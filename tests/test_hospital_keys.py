@@ -0,0 +1,134 @@
+import contextlib
+import io
+
+import pandas as pd
+import psycopg
+import pytest
+
+from hospital_keys import KeyMap, normalize_ccn
+from migrations import migrate
+
+
+def test_normalize_ccn():
+    values = pd.Series(['010001', '10001', ' 050002 ', '50002.0', '1.00', '123456', '12345F',
+                        'b3e0a0ab9c60a5a9c3e7b0f4c1a8f1d2', '', '   ', None, float('nan')], index=range(10, 22))
+    assert normalize_ccn(values).tolist() == ['010001', '010001', '050002', '050002', '000001', '123456', '12345F',
+                                              'b3e0a0ab9c60a5a9c3e7b0f4c1a8f1d2', None, None, None, None]
+    assert normalize_ccn(values).index.tolist() == list(range(10, 22))
+
+
+def test_normalize_ccn_of_numbers():
+    # Facility IDs read as numbers by pandas
+    assert normalize_ccn(pd.Series([10001.0, 330101.0, None])).tolist() == ['010001', '330101', None]
+    assert normalize_ccn(pd.Series([10001, 330101])).tolist() == ['010001', '330101']
+
+
+class FakeKeysCursor:
+    """
+    Cursor answering the HospitalKeys statements of KeyMap from a dict.
+    """
+
+    def __init__(self, ids=None):
+        self.ids = dict(ids or {})
+        self.statements = []
+
+    def execute(self, query, params=()):
+        query = ' '.join(query.split())
+        self.statements.append(query)
+        if query.startswith("INSERT INTO HospitalKeys"):
+            for ccn in params[0]:
+                self.ids.setdefault(ccn, len(self.ids) + 1)
+            self.rows = []
+        elif query.startswith("SELECT ccn, hospital_id FROM HospitalKeys WHERE"):
+            self.rows = [(ccn, self.ids[ccn]) for ccn in params[0] if ccn in self.ids]
+        elif query.startswith("SELECT ccn, hospital_id FROM HospitalKeys"):
+            self.rows = list(self.ids.items())
+        else:
+            self.rows = []
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_key_map_reads_the_keys_once_and_adds_new_ones_in_bulk():
+    curr = FakeKeysCursor({'010001': 1, '010002': 2})
+    keys = KeyMap()
+
+    ids = keys.resolve(curr, pd.Series(['010002', None, '010001', '010002'], index=[5, 6, 7, 8]))
+    assert ids.tolist() == [2, None, 1, 2]
+    assert ids.index.tolist() == [5, 6, 7, 8]
+    assert len(curr.statements) == 1
+
+    # Known keys cost no round trip
+    keys.resolve(curr, pd.Series(['010001']))
+    assert len(curr.statements) == 1
+
+    ids = keys.resolve(curr, pd.Series(['010003', '010001', '010004', '010003']))
+    assert ids.tolist() == [3, 1, 4, 3]
+    lock, insert, select = curr.statements[1:]
+    assert 'pg_advisory_xact_lock' in lock
+    assert insert.startswith("INSERT INTO HospitalKeys")
+    assert select.startswith("SELECT ccn, hospital_id FROM HospitalKeys WHERE")
+    assert keys.ids == {'010001': 1, '010002': 2, '010003': 3, '010004': 4}
+
+
+def test_key_map_on_the_database(conninfo):
+    with psycopg.connect(conninfo) as conn, conn.cursor() as curr:
+        first = KeyMap().resolve(curr, pd.Series(['010001', '010002', None]))
+        conn.commit()
+        # Another load sees the committed keys and adds its own
+        second = KeyMap().resolve(curr, pd.Series(['010002', '010003', '010001']))
+        assert second[0] == first[1] and second[2] == first[0]
+        assert len({first[0], first[1], second[1]}) == 3
+        assert first[2] is None
+        curr.execute("SELECT COUNT(*) FROM HospitalKeys")
+        assert curr.fetchone()[0] == 3
+
+
+def migrated_to_11(database):
+    with psycopg.connect(database) as conn, contextlib.redirect_stdout(io.StringIO()):
+        migrate(conn, target=11)
+
+
+def test_migration_12_normalizes_the_keys(database):
+    migrated_to_11(database)
+    with psycopg.connect(database) as conn:
+        conn.execute("INSERT INTO Hospitals (hospital_pk, hospital_name) VALUES ('50001', 'A'), ('050002', 'B')")
+        conn.execute("INSERT INTO HospitalLocations (hospital_fk, state) VALUES ('50001', 'CA'), ('050002', 'CA')")
+        conn.execute("""INSERT INTO HospitalQualityInformation (facility_id, data_date)
+                        VALUES ('50001', '2022-01-01'), ('050001', '2022-04-01')""")
+        conn.commit()
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert migrate(conn, target=12) == [12]
+        assert conn.execute("SELECT array_agg(hospital_pk ORDER BY hospital_pk) FROM Hospitals").fetchone()[0] == \
+            ['050001', '050002']
+        assert conn.execute("SELECT array_agg(hospital_fk ORDER BY hospital_fk) FROM HospitalLocations").fetchone()[0] == \
+            ['050001', '050002']
+        # Both snapshots of the facility are under one key
+        assert conn.execute("SELECT COUNT(DISTINCT hospital_id) FROM HospitalQualityInformation").fetchone()[0] == 1
+        assert conn.execute("SELECT COUNT(*) FROM HospitalKeys").fetchone()[0] == 2
+
+
+@pytest.mark.parametrize('statements, listed', [
+    (["INSERT INTO Hospitals (hospital_pk, hospital_name) VALUES ('050001', 'A'), ('50001', 'A'), ('060001', 'C')"],
+     '050001 (Hospitals: 050001, 50001)'),
+    (["""INSERT INTO HospitalQualityInformation (facility_id, data_date)
+         VALUES ('50001', '2022-01-01'), ('050001', '2022-01-01')"""],
+     '050001 (HospitalQualityInformation: 050001, 50001)'),
+    (["""INSERT INTO HospitalQualityHistory (facility_id, valid_from, valid_to)
+         VALUES ('7001', '2022-01-01', NULL), ('007001', '2021-01-01', '2022-04-01')"""],
+     '007001 (HospitalQualityHistory: 007001, 7001)'),
+], ids=['hospitals', 'quality', 'history'])
+def test_migration_12_lists_keys_normalizing_to_the_same_ccn(database, statements, listed):
+    migrated_to_11(database)
+    with psycopg.connect(database) as conn:
+        for statement in statements:
+            conn.execute(statement)
+        conn.commit()
+        with pytest.raises(psycopg.errors.RaiseException, match='same CCN') as error, \
+                contextlib.redirect_stdout(io.StringIO()):
+            migrate(conn)
+        assert listed in str(error.value)
+        assert '060001' not in str(error.value)
+        # The schema stays at the previous version
+        assert conn.execute("SELECT MAX(version) FROM SchemaMigrations").fetchone()[0] == 11
@@ -0,0 +1,150 @@
+import datetime
+import os
+import time
+
+import psycopg
+import pytest
+
+from ingest_daemon import finish_attempt, infer_load, ledger_entries, scan, start_attempt
+
+FILE_HASH = 'a' * 40
+
+
+class RecordingCursor:
+    """
+    Cursor that keeps the parameters of the statements it is given.
+    """
+
+    def __init__(self):
+        self.params = []
+
+    def execute(self, query, params=()):
+        self.params.append(params)
+
+
+def finish(attempt, **kwargs):
+    """
+    Returns:
+    - str, status returned by finish_attempt
+    - (status, rows, inserted, rejected, error, next_attempt_at) tuple
+      written to the ledger
+    """
+    curr = RecordingCursor()
+    status = finish_attempt(curr, 'hhs', FILE_HASH, attempt, **kwargs)
+    written = curr.params[-1]
+    assert written[-2:] == ('hhs', FILE_HASH)
+    return status, written[:6]
+
+
+def test_a_successful_attempt_is_loaded():
+    status, written = finish(3, result={'rows': 10, 'inserted': 8, 'rejected': 2})
+    assert status == 'loaded'
+    assert written == ('loaded', 10, 8, 2, None, None)
+
+
+@pytest.mark.parametrize('attempt, delay', [(1, 60), (2, 120), (3, 240), (6, 1920), (7, 3600), (9, 3600)])
+def test_failed_attempts_back_off_exponentially(attempt, delay):
+    before = datetime.datetime.now()
+    status, written = finish(attempt, error='connection lost', max_attempts=10)
+    after = datetime.datetime.now()
+    assert status == 'failed'
+    assert written[:5] == ('failed', None, None, None, 'connection lost')
+    assert before + datetime.timedelta(seconds=delay) <= written[5] <= after + datetime.timedelta(seconds=delay)
+
+
+def test_custom_retry_schedule():
+    before = datetime.datetime.now()
+    _, written = finish(3, error='boom', retry_base=1, retry_max=3)
+    assert before + datetime.timedelta(seconds=3) <= written[5] <= datetime.datetime.now() + datetime.timedelta(seconds=3)
+
+
+def test_the_last_attempt_is_abandoned():
+    assert finish(4, error='boom', max_attempts=5)[0] == 'failed'
+    status, written = finish(5, error='boom', max_attempts=5)
+    assert status == 'abandoned'
+    assert written == ('abandoned', None, None, None, 'boom', None)
+    assert finish(6, error='boom', max_attempts=5)[0] == 'abandoned'
+    # A success on the last attempt still counts
+    assert finish(5, result={'rows': 1}, max_attempts=5)[0] == 'loaded'
+
+
+@pytest.mark.parametrize('csv_file, load', [
+    ('hhs_data/2022-09-23-hhs-data.csv', ('hhs', '2022-09-23')),
+    ('/data/incoming/2021-01-01-hhs-data.csv', ('hhs', '2021-01-01')),
+    ('Hospital_General_Information-2021-07.csv', ('quality', '2021-07-01')),
+    ('hospital_data/Hospital_General_Information-2022-01.csv', ('quality', '2022-01-01')),
+    ('hhs_data/2022-09-23-hhs-data.csv.tmp', None),
+    ('hhs_data/2022-09-hhs-data.csv', None),
+    ('hospital_data/Hospital_General_Information.csv', None),
+    ('notes.csv', None),
+])
+def test_files_are_dispatched_by_name(csv_file, load):
+    assert infer_load(csv_file) == load
+
+
+def touch(path, age):
+    path.write_text("x\n")
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def test_scan_lists_settled_files_by_date(tmp_path, capsys):
+    hhs_dir, quality_dir = tmp_path / 'hhs', tmp_path / 'quality'
+    hhs_dir.mkdir()
+    quality_dir.mkdir()
+    late_week = touch(hhs_dir / '2022-09-30-hhs-data.csv', 60)
+    early_week = touch(hhs_dir / '2022-09-23-hhs-data.csv', 60)
+    snapshot = touch(quality_dir / 'Hospital_General_Information-2022-09.csv', 60)
+    touch(hhs_dir / '2022-10-07-hhs-data.csv', 1)  # still being copied
+    touch(hhs_dir / 'notes.csv', 60)
+
+    ignored = set()
+    loads = scan([str(hhs_dir), str(quality_dir)], settle=5, ignored=ignored)
+    assert loads == [(snapshot, 'quality', '2022-09-01'), (early_week, 'hhs', '2022-09-23'),
+                     (late_week, 'hhs', '2022-09-30')]
+    assert ignored == {str(hhs_dir / 'notes.csv')}
+    assert capsys.readouterr().out.count('notes.csv') == 1
+
+    # Unmatched names are reported once, settled files are picked up on a later scan
+    loads = scan([str(hhs_dir), str(quality_dir)], settle=0, ignored=ignored)
+    assert len(loads) == 4
+    assert 'notes.csv' not in capsys.readouterr().out
+
+
+def test_scan_accepts_glob_patterns(tmp_path):
+    week = touch(tmp_path / '2022-09-23-hhs-data.csv', 60)
+    touch(tmp_path / 'Hospital_General_Information-2022-09.csv', 60)
+    assert scan([str(tmp_path / '*-hhs-data.csv')], settle=5) == [(week, 'hhs', '2022-09-23')]
+    assert scan([str(tmp_path / 'missing' / '*.csv')], settle=5) == []
+
+
+def test_ledger_transitions(conninfo):
+    with psycopg.connect(conninfo, autocommit=True) as conn, conn.cursor() as curr:
+        def entry():
+            return ledger_entries(curr, [FILE_HASH])[('quality', FILE_HASH)]
+
+        assert start_attempt(curr, 'q.csv', 'quality', '2022-09-01', FILE_HASH) == 1
+        assert entry()[:2] == ('loading', 1)
+
+        assert finish_attempt(curr, 'quality', FILE_HASH, 1, error='boom', max_attempts=3) == 'failed'
+        status, attempts, next_attempt_at = entry()
+        assert (status, attempts) == ('failed', 1)
+        assert next_attempt_at > datetime.datetime.now()
+
+        # A retry, under another file name, clears the retry time
+        assert start_attempt(curr, 'renamed.csv', 'quality', '2022-09-01', FILE_HASH) == 2
+        assert entry() == ('loading', 2, None)
+        assert finish_attempt(curr, 'quality', FILE_HASH, 2, error='boom', max_attempts=3) == 'failed'
+        assert start_attempt(curr, 'renamed.csv', 'quality', '2022-09-01', FILE_HASH) == 3
+        assert finish_attempt(curr, 'quality', FILE_HASH, 3, error='boom', max_attempts=3) == 'abandoned'
+        assert entry() == ('abandoned', 3, None)
+
+        # The same content under the other loader is a separate entry
+        assert start_attempt(curr, 'h.csv', 'hhs', '2022-09-23', FILE_HASH) == 1
+        finish_attempt(curr, 'hhs', FILE_HASH, 1, result={'rows': 5, 'inserted': 4, 'rejected': 1})
+        assert ledger_entries(curr, [FILE_HASH])[('hhs', FILE_HASH)] == ('loaded', 1, None)
+        curr.execute("SELECT file_name, rows_read, rows_inserted, rows_rejected, error FROM IngestLedger "
+                     "WHERE loader = 'hhs'")
+        assert curr.fetchone() == ('h.csv', 5, 4, 1, None)
+        assert ledger_entries(curr, ['b' * 40]) == {}
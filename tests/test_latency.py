@@ -0,0 +1,78 @@
+import os
+
+import pytest
+from psycopg.conninfo import make_conninfo
+
+from benchmarks import synthetic
+from benchmarks.bench_latency import DelayProxy, sample_files, time_loads, upstream_address
+from benchmarks.run_benchmarks import scratch_database
+
+# Round-trip time added by the proxy, in ms, long enough for the waits on
+# the network to stand out from the noise of the load times
+RTT_MS = 25
+
+# Rows of the small and the large files. Pipelined loads should wait on the
+# network about as often for both, row-by-row ones once per row.
+SMALL_ROWS = 100
+LARGE_ROWS = 400
+
+# Most extra round trips the large files may cost over the small ones in
+# pipeline mode. Both fit in one batch, so it is only timing noise.
+ROUND_TRIP_SLACK = 20
+
+
+@pytest.fixture
+def admin_conninfo(database):
+    # Only for the skip without a server, each load gets a scratch database of its own
+    return os.environ['TEST_DATABASE_URL']
+
+
+@pytest.fixture
+def sample(tmp_path, monkeypatch):
+    """
+    Returns:
+    - dict, rows -> (HHS path, (date, quality path)) of the synthetic files
+    """
+    monkeypatch.setattr(synthetic, 'BASE_HOSPITALS', LARGE_ROWS)
+    return {rows: sample_files(str(tmp_path / f"rows_{rows}"), rows, seed=0) for rows in (SMALL_ROWS, LARGE_ROWS)}
+
+
+def load_seconds(admin_conninfo, files, pipeline, rtt, work_dir):
+    """
+    Returns:
+    - dict, loader name -> seconds to load the files through a proxy
+      adding rtt ms to every round trip, into a new database
+    """
+    with scratch_database(admin_conninfo, 'test_latency_load') as conninfo, \
+            DelayProxy(upstream_address(conninfo), rtt) as proxy:
+        proxied = make_conninfo(conninfo, host='127.0.0.1', hostaddr='', port=proxy.port)
+        seconds = time_loads(proxied, *files, pipeline, work_dir)
+    assert None not in seconds.values()
+    return seconds
+
+
+def round_trips(admin_conninfo, files, pipeline, work_dir):
+    """
+    Returns:
+    - dict, loader name -> number of round trips the loads waited on,
+      estimated from how much slower they get with RTT_MS added
+    """
+    fast = load_seconds(admin_conninfo, files, pipeline, 0, work_dir)
+    slow = load_seconds(admin_conninfo, files, pipeline, RTT_MS, work_dir)
+    return {loader: (slow[loader] - fast[loader]) * 1000 / RTT_MS for loader in fast}
+
+
+def test_pipelined_loads_do_not_wait_per_row(admin_conninfo, sample, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    small = round_trips(admin_conninfo, sample[SMALL_ROWS], True, str(tmp_path))
+    large = round_trips(admin_conninfo, sample[LARGE_ROWS], True, str(tmp_path))
+    for loader in ('hhs', 'quality'):
+        assert large[loader] - small[loader] < ROUND_TRIP_SLACK, (loader, small, large)
+        assert large[loader] < LARGE_ROWS / 4, (loader, large)
+
+
+def test_row_by_row_loads_wait_per_row(admin_conninfo, sample, tmp_path, monkeypatch):
+    # What pipeline mode saves: every HHS row waits on its own round trip
+    monkeypatch.chdir(tmp_path)
+    seconds = load_seconds(admin_conninfo, sample[SMALL_ROWS], False, RTT_MS, str(tmp_path))
+    assert seconds['hhs'] >= SMALL_ROWS * RTT_MS / 1000
@@ -0,0 +1,36 @@
+import os
+
+import pandas as pd
+import psycopg
+import pytest
+
+from load_hhs import load_hhs_data
+
+HHS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'hhs_data',
+                        '2022-09-23-hhs-data.csv')
+
+
+@pytest.mark.parametrize('options', [{}, {'bulk': True}, {'pipeline': True},
+                                     {'bulk': True, 'chunksize': 7, 'checkpoint': True}],
+                         ids=['rows', 'bulk', 'pipeline', 'checkpoint'])
+def test_rows_failing_the_dimension_rules_are_rejected(tmp_path, monkeypatch, conninfo, options):
+    monkeypatch.chdir(tmp_path)
+    df = pd.read_csv(HHS_FILE, dtype=object).head(20)
+    # Unseen hospitals without a name or a key
+    df.loc[3, 'hospital_name'] = ''
+    df.loc[5, 'hospital_pk'] = ''
+    df.to_csv(tmp_path / 'hhs.csv', index=False)
+
+    with psycopg.connect(conninfo) as conn:
+        result = load_hhs_data(str(tmp_path / 'hhs.csv'), conn, rejects_path=str(tmp_path / 'rejects.csv'), **options)
+        assert result is not None
+        assert result['inserted'] == 18
+        assert result['rejected'] == 2
+        assert result['counts']['Hospitals']['errors'] == 2
+        assert result['counts']['HospitalLocations']['errors'] == 2
+        assert conn.execute("SELECT COUNT(*) FROM Hospitals").fetchone()[0] == 18
+        assert conn.execute("SELECT COUNT(*) FROM HospitalBedInformation").fetchone()[0] == 18
+        assert conn.execute("SELECT COUNT(*) FROM HospitalBedInformation WHERE hospital_id IS NULL").fetchone()[0] == 0
+
+    rejects = pd.read_csv(tmp_path / 'rejects.csv', dtype=object)
+    assert sorted(rejects['reject_reason']) == ['missing_hospital_name', 'missing_hospital_pk']
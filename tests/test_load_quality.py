@@ -0,0 +1,232 @@
+import contextlib
+import datetime
+import io
+import os
+import random
+
+import pandas as pd
+import psycopg
+import pytest
+
+import parse_cache
+from load_quality import (QUALITY_ATTRIBUTES, apply_quality_delta, attributes_hash, load_quality_data,
+                          rebuild_quality_history, record_quality_snapshot)
+from migrations import migrate
+
+QUALITY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'hospital_data')
+
+DATES = [datetime.date(2021, month, 1) for month in (1, 3, 5, 7, 9, 11)]
+
+
+def add_keys(curr, n):
+    """
+    Returns:
+    - int list, hospital ids of n new HospitalKeys
+    """
+    curr.execute("INSERT INTO HospitalKeys (ccn) SELECT lpad(i::text, 6, '0') FROM generate_series(1, %s) AS i "
+                 "RETURNING hospital_id", (n,))
+    return [hospital_id for (hospital_id,) in curr.fetchall()]
+
+
+def snapshot(rows):
+    return pd.DataFrame(rows, columns=['hospital_id'] + QUALITY_ATTRIBUTES)
+
+
+def history(curr):
+    """
+    Returns:
+    - set of (hospital_id, attributes..., valid_from, valid_to) tuples
+    """
+    curr.execute(f"SELECT hospital_id, {', '.join(QUALITY_ATTRIBUTES)}, valid_from, valid_to FROM HospitalQualityHistory")
+    return set(curr.fetchall())
+
+
+def snapshots_view(curr):
+    """
+    Returns:
+    - dict, date -> sorted rows of HospitalQualitySnapshots on that date
+    """
+    curr.execute(f"SELECT data_date, hospital_id, {', '.join(QUALITY_ATTRIBUTES)} FROM HospitalQualitySnapshots")
+    view = {}
+    for date, *row in curr.fetchall():
+        view.setdefault(date, []).append(tuple(row))
+    return {date: sorted(rows, key=repr) for date, rows in view.items()}
+
+
+def reset_history(curr):
+    curr.execute("TRUNCATE HospitalQualityHistory, QualitySnapshots")
+
+
+def test_apply_quality_delta(conninfo):
+    with psycopg.connect(conninfo) as conn, conn.cursor() as curr:
+        a, b, c = add_keys(curr, 3)
+        jan, apr, jul = DATES[0], DATES[1], DATES[2]
+
+        counts = apply_quality_delta(curr, snapshot([(a, 3.0, True, 'Acute Care Hospitals', 'Proprietary'),
+                                                     (b, None, False, 'Critical Access Hospitals', None)]), jan)
+        assert counts == {'new': 2, 'changed': 0, 'unchanged': 0, 'closed': 0}
+
+        # b's rating appears, a is unchanged, c is new
+        counts = apply_quality_delta(curr, snapshot([(a, 3.0, True, 'Acute Care Hospitals', 'Proprietary'),
+                                                     (b, 2.0, False, 'Critical Access Hospitals', None),
+                                                     (c, 5.0, True, 'Acute Care Hospitals', 'Voluntary')]), apr)
+        assert counts == {'new': 1, 'changed': 1, 'unchanged': 1, 'closed': 0}
+
+        # a is left out of the snapshot
+        counts = apply_quality_delta(curr, snapshot([(b, 2.0, False, 'Critical Access Hospitals', None),
+                                                     (c, 4.0, True, 'Acute Care Hospitals', 'Voluntary')]), jul)
+        assert counts == {'new': 0, 'changed': 1, 'unchanged': 1, 'closed': 1}
+
+        assert history(curr) == {
+            (a, 3.0, True, 'Acute Care Hospitals', 'Proprietary', jan, jul),
+            (b, None, False, 'Critical Access Hospitals', None, jan, apr),
+            (b, 2.0, False, 'Critical Access Hospitals', None, apr, None),
+            (c, 5.0, True, 'Acute Care Hospitals', 'Voluntary', apr, jul),
+            (c, 4.0, True, 'Acute Care Hospitals', 'Voluntary', jul, None),
+        }
+        view = snapshots_view(curr)
+        assert [row[0] for row in view[jan]] == sorted([a, b], key=repr)
+        assert len(view[apr]) == 3 and len(view[jul]) == 2
+        curr.execute("SELECT array_agg(data_date ORDER BY data_date) FROM QualitySnapshots")
+        assert curr.fetchone()[0] == [jan, apr, jul]
+
+
+def random_snapshots(hospital_ids, seed):
+    """
+    Returns:
+    - dict, date -> snapshot df, with facilities that change, drop out and
+      come back from one snapshot to the next
+    """
+    rng = random.Random(seed)
+    state = {hospital_id: (rng.choice([1.0, 2.0, 3.0, None]), rng.choice([True, False]), 'Acute Care Hospitals',
+                           rng.choice(['Proprietary', 'Voluntary'])) for hospital_id in hospital_ids}
+    snapshots = {}
+    for date in DATES:
+        for hospital_id in rng.sample(hospital_ids, len(hospital_ids) // 4):
+            rating, emergency, kind, ownership = state[hospital_id]
+            state[hospital_id] = (rng.choice([1.0, 2.0, 3.0, 4.5, None]), emergency, kind, ownership)
+        present = [hospital_id for hospital_id in hospital_ids if rng.random() < 0.8]
+        snapshots[date] = snapshot([(hospital_id, *state[hospital_id]) for hospital_id in present])
+    return snapshots
+
+
+def expected_view(snapshots, dates):
+    return {date: sorted((tuple(row) for row in snapshots[date].astype(object)
+                          .where(snapshots[date].notna(), None).itertuples(index=False, name=None)), key=repr)
+            for date in dates}
+
+
+def test_snapshots_recorded_in_any_order_match_the_date_order(conninfo):
+    with psycopg.connect(conninfo) as conn, conn.cursor() as curr:
+        hospital_ids = add_keys(curr, 40)
+        snapshots = random_snapshots(hospital_ids, seed=7)
+
+        for date in DATES:
+            record_quality_snapshot(curr, snapshots[date], date)
+        in_order = history(curr)
+        assert snapshots_view(curr) == expected_view(snapshots, DATES)
+
+        orders = [DATES[::-1], [DATES[2], DATES[0], DATES[5], DATES[1], DATES[4], DATES[3]]]
+        orders += [random.Random(seed).sample(DATES, len(DATES)) for seed in range(4)]
+        for order in orders:
+            reset_history(curr)
+            for i, date in enumerate(order):
+                assert record_quality_snapshot(curr, snapshots[date], date) is not None
+                assert snapshots_view(curr) == expected_view(snapshots, order[:i + 1])
+            # The intervals are the same as if the snapshots came in date order
+            assert history(curr) == in_order
+            curr.execute("SELECT COUNT(*) FROM HospitalQualityHistory GROUP BY hospital_id, valid_from HAVING COUNT(*) > 1")
+            assert curr.fetchall() == []
+
+        # A snapshot already recorded is left alone
+        assert record_quality_snapshot(curr, snapshots[DATES[2]], DATES[2]) is None
+        assert history(curr) == in_order
+
+
+def test_snapshot_loaded_out_of_order_reaches_the_dashboard(conninfo, tmp_path, monkeypatch):
+    monkeypatch.setattr(parse_cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    files = {datetime.date(2021, 7, 1): 'Hospital_General_Information-2021-07.csv',
+             datetime.date(2022, 1, 1): 'Hospital_General_Information-2022-01.csv',
+             datetime.date(2022, 10, 1): 'Hospital_General_Information-2022-10.csv'}
+
+    def load(order):
+        with psycopg.connect(conninfo) as conn:
+            conn.execute("TRUNCATE HospitalQualityInformation, HospitalQualityHistory, QualitySnapshots")
+            conn.commit()
+            for date in order:
+                assert load_quality_data(os.path.join(QUALITY_DIR, files[date]), conn, date.isoformat(),
+                                         rejects_path=str(tmp_path / 'rejects.csv')) is not None
+            with conn.cursor() as curr:
+                curr.execute('''
+                    SELECT q.data_date, COUNT(*), COUNT(s.hospital_id) FROM HospitalQualityInformation q
+                    LEFT JOIN HospitalQualitySnapshots s ON s.hospital_id = q.hospital_id AND s.data_date = q.data_date
+                     AND s.hospital_overall_rating IS NOT DISTINCT FROM q.hospital_overall_rating
+                     AND s.hospital_type IS NOT DISTINCT FROM q.hospital_type
+                    GROUP BY q.data_date''')
+                matched = curr.fetchall()
+                return history(curr), matched
+
+    in_order, matched = load(sorted(files))
+    assert len(matched) == 3 and all(n_rows == n_matched for _, n_rows, n_matched in matched)
+    for order in ([datetime.date(2022, 10, 1), datetime.date(2021, 7, 1), datetime.date(2022, 1, 1)],
+                  [datetime.date(2022, 1, 1), datetime.date(2022, 10, 1), datetime.date(2021, 7, 1)]):
+        out_of_order, matched = load(order)
+        assert all(n_rows == n_matched for _, n_rows, n_matched in matched)
+        assert out_of_order == in_order
+
+
+def test_migration_13_builds_the_history_of_earlier_snapshots(database):
+    with psycopg.connect(database) as conn, contextlib.redirect_stdout(io.StringIO()):
+        migrate(conn, target=12)
+        with conn.cursor() as curr:
+            hospital_ids = add_keys(curr, 30)
+            snapshots = random_snapshots(hospital_ids, seed=3)
+            for date, df in snapshots.items():
+                df = df.astype(object).where(df.notna(), None)
+                curr.executemany(f'''
+                    INSERT INTO HospitalQualityInformation (hospital_id, {', '.join(QUALITY_ATTRIBUTES)}, data_date)
+                    VALUES (%s, %s, %s, %s, %s, %s)''', [(*row, date) for row in df.itertuples(index=False, name=None)])
+        conn.commit()
+        assert migrate(conn) == [13]
+
+        with conn.cursor() as curr:
+            migrated = history(curr)
+            curr.execute("SELECT hospital_id, valid_from, attributes_hash FROM HospitalQualityHistory")
+            migrated_hashes = set(curr.fetchall())
+            assert snapshots_view(curr) == expected_view(snapshots, DATES)
+        rebuild_quality_history(conn)
+        with conn.cursor() as curr:
+            assert history(curr) == migrated
+            curr.execute("SELECT hospital_id, valid_from, attributes_hash FROM HospitalQualityHistory")
+            # Hashed like attributes_hash, so the next load only writes real changes
+            assert set(curr.fetchall()) == migrated_hashes
+
+        # A database with a history is left as it is
+        conn.execute("DELETE FROM SchemaMigrations WHERE version = 13")
+        conn.execute("DELETE FROM HospitalQualityHistory WHERE valid_to IS NOT NULL")
+        conn.commit()
+        with conn.cursor() as curr:
+            remaining = history(curr)
+        migrate(conn)
+        with conn.cursor() as curr:
+            assert history(curr) == remaining
+
+
+@pytest.mark.parametrize('rating', [0.0, 1.0, 2.5, 4.0, None, float('nan')])
+def test_migration_13_hashes_like_attributes_hash(database, rating):
+    with psycopg.connect(database) as conn, contextlib.redirect_stdout(io.StringIO()):
+        migrate(conn, target=12)
+        with conn.cursor() as curr:
+            hospital_ids = add_keys(curr, 3)
+            rows = [(hospital_ids[0], rating, True, 'Acute Care Hospitals', 'Voluntary'),
+                    (hospital_ids[1], rating, None, None, 'Government - State'),
+                    (hospital_ids[2], rating, False, "Children's", None)]
+            curr.executemany(f'''
+                INSERT INTO HospitalQualityInformation (hospital_id, {', '.join(QUALITY_ATTRIBUTES)}, data_date)
+                VALUES (%s, %s, %s, %s, %s, '2022-01-01')''', rows)
+        conn.commit()
+        migrate(conn)
+        with conn.cursor() as curr:
+            curr.execute("SELECT hospital_id, attributes_hash FROM HospitalQualityHistory")
+            stored = dict(curr.fetchall())
+    assert [stored[row[0]] for row in rows] == attributes_hash(snapshot(rows)).tolist()
@@ -0,0 +1,131 @@
+import os
+import tracemalloc
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import parse_cache
+from load_hhs import BED_COLUMNS, CHUNK_DTYPES, read_hhs_chunks
+
+HHS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'hhs_data',
+                        '2022-09-23-hhs-data.csv')
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(parse_cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+
+
+def write_hhs_file(path, copies):
+    """
+    Write the rows of a real weekly file copies times over, one copy at a time.
+    """
+    df = pd.read_csv(HHS_FILE, dtype=object)
+    for copy in range(copies):
+        df.to_csv(path, mode='w' if copy == 0 else 'a', header=copy == 0, index=False)
+    return str(path)
+
+
+def assert_same(df, expected):
+    """
+    Compare two frames, the cache returning None where pandas has NaN.
+    """
+    pd.testing.assert_frame_equal(df.where(df.notna(), None), expected.where(expected.notna(), None))
+
+
+def streamed(csv_file, columns, chunksize):
+    return list(pd.read_csv(csv_file, dtype=object, usecols=columns, chunksize=chunksize))
+
+
+@pytest.mark.parametrize('chunksize', [71, 333, 5000, 100000])
+def test_chunks_match_the_streaming_reader(tmp_path, chunksize):
+    csv_file = write_hhs_file(tmp_path / 'hhs.csv', 1)
+    columns = list(CHUNK_DTYPES)
+    expected = streamed(csv_file, columns, chunksize)
+
+    for _ in range(2):  # cold, then warm cache
+        chunks = list(parse_cache.read_chunks(csv_file, columns, chunksize))
+        assert len(chunks) == len(expected)
+        for chunk, expected_chunk in zip(chunks, expected):
+            assert_same(chunk, expected_chunk)
+
+
+def test_chunks_of_an_entry_written_with_another_size(tmp_path):
+    csv_file = write_hhs_file(tmp_path / 'hhs.csv', 1)
+    columns = ['hospital_pk', 'collection_week', 'all_adult_hospital_beds_7_day_avg']
+    list(parse_cache.read_chunks(csv_file, columns, 700))
+
+    chunks = list(parse_cache.read_chunks(csv_file, columns, 1500))
+    for chunk, expected_chunk in zip(chunks, streamed(csv_file, columns, 1500), strict=True):
+        assert_same(chunk, expected_chunk)
+    assert_same(parse_cache.read_csv(csv_file, columns), pd.read_csv(csv_file, dtype=object, usecols=columns))
+
+
+@pytest.mark.parametrize('chunksize', [333, 100000])
+def test_typed_chunks_match_the_typed_streaming_reader(tmp_path, chunksize):
+    csv_file = write_hhs_file(tmp_path / 'hhs.csv', 1)
+    expected = list(pd.read_csv(csv_file, usecols=list(CHUNK_DTYPES), dtype=CHUNK_DTYPES, chunksize=chunksize,
+                                na_values={column: ['-999999', '-999999.0'] for column in BED_COLUMNS}))
+
+    for _ in range(2):  # cold, then warm cache
+        chunks = list(read_hhs_chunks(csv_file, chunksize))
+        assert len(chunks) == len(expected)
+        for chunk, expected_chunk in zip(chunks, expected):
+            assert chunk['state'].dtype == 'category'
+            assert (chunk[BED_COLUMNS].dtypes == 'float32').all()
+            # The categories of a chunk are in the order they were met
+            assert_same(chunk.astype({'state': object}), expected_chunk.astype({'state': object}))
+
+    # Only the loaded columns are stored, the bed metrics as float32
+    reader = parse_cache.open_entry(csv_file, dtypes=CHUNK_DTYPES,
+                                    na_values={column: ['-999999', '-999999.0'] for column in BED_COLUMNS})
+    assert sorted(reader.schema.names) == sorted(CHUNK_DTYPES)
+    assert {str(reader.schema.field(column).type) for column in BED_COLUMNS} == {'float'}
+    assert str(reader.schema.field('state').type) == 'string'
+
+
+def test_typed_and_text_entries_of_a_file(tmp_path):
+    csv_file = write_hhs_file(tmp_path / 'hhs.csv', 1)
+    parse_cache.read_csv(csv_file)
+    list(read_hhs_chunks(csv_file, 1000))
+    assert len(os.listdir(parse_cache.CACHE_DIR)) == 2
+
+    # A new content replaces the entries of both kinds
+    pd.read_csv(csv_file, dtype=object).head(50).to_csv(csv_file, index=False)
+    os.utime(csv_file, ns=(0, 0))
+    assert sum(len(chunk) for chunk in read_hhs_chunks(csv_file, 1000)) == 50
+    assert len(os.listdir(parse_cache.CACHE_DIR)) == 1
+
+
+def test_unknown_columns_raise_like_usecols(tmp_path):
+    csv_file = write_hhs_file(tmp_path / 'hhs.csv', 1)
+    with pytest.raises(ValueError, match='Usecols'):
+        parse_cache.read_chunks(csv_file, ['hospital_pk', 'no_such_column'], 100)
+
+
+def peak_memory(csv_file, chunksize):
+    """
+    Returns:
+    - int, peak bytes traced while streaming a file through read_hhs_chunks
+    """
+    tracemalloc.start()
+    try:
+        for _ in read_hhs_chunks(csv_file, chunksize):
+            pass
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_cold_cache_memory_stays_flat(tmp_path):
+    small = write_hhs_file(tmp_path / 'small.csv', 1)
+    large = write_hhs_file(tmp_path / 'large.csv', 8)
+
+    small_peak = peak_memory(small, 500)
+    large_peak = peak_memory(large, 500)
+    # Eight times the rows may not take eight times the memory to cache
+    assert large_peak < 2 * small_peak
+    # Warm reads stay flat as well
+    assert peak_memory(large, 500) < 2 * small_peak
@@ -0,0 +1,73 @@
+import pandas as pd
+
+from query_cache import QueryCache
+
+
+class FakeBackend:
+    """
+    Backend whose load version can be moved while a query runs.
+    """
+
+    def __init__(self):
+        self.version = 1
+        self.fetches = 0
+        self.during_fetch = None
+
+    def load_version(self):
+        return self.version
+
+    def fetch(self, query, params=()):
+        self.fetches += 1
+        result = pd.DataFrame({'version': [self.version]})
+        if self.during_fetch is not None:
+            self.during_fetch()
+        return result
+
+
+def test_fetch_caches_until_the_version_moves():
+    backend, cache = FakeBackend(), QueryCache()
+    cache.check_version(backend)
+    assert cache.fetch(backend, "SELECT 1")['version'][0] == 1
+    assert cache.fetch(backend, "SELECT 1")['version'][0] == 1
+    assert backend.fetches == 1
+
+    backend.version = 2
+    cache.check_version(backend)
+    assert cache.fetch(backend, "SELECT 1")['version'][0] == 2
+    assert backend.fetches == 2
+
+
+def test_result_of_a_query_overtaken_by_a_load_is_not_cached():
+    backend, cache = FakeBackend(), QueryCache()
+    cache.check_version(backend)
+
+    def commit_load():
+        # A load commits and another dashboard run sees it before the store
+        backend.version = 2
+        cache.check_version(backend)
+
+    backend.during_fetch = commit_load
+    assert cache.fetch(backend, "SELECT 1")['version'][0] == 1
+    backend.during_fetch = None
+
+    assert cache.lookup("SELECT 1") is None
+    assert cache.fetch(backend, "SELECT 1")['version'][0] == 2
+    assert cache.lookup("SELECT 1")['version'][0] == 2
+
+
+def test_result_fetched_after_an_unchecked_load_is_not_cached():
+    backend, cache = FakeBackend(), QueryCache()
+    cache.check_version(backend)
+    backend.version = 2
+
+    cache.fetch(backend, "SELECT 1")
+    assert cache.lookup("SELECT 1") is None
+
+
+def test_lru_eviction():
+    backend, cache = FakeBackend(), QueryCache(max_entries=2)
+    cache.check_version(backend)
+    for query in ("SELECT 1", "SELECT 2", "SELECT 3"):
+        cache.fetch(backend, query)
+    assert cache.lookup("SELECT 1") is None
+    assert cache.lookup("SELECT 3") is not None
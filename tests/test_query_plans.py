@@ -0,0 +1,84 @@
+import contextlib
+import io
+import re
+
+import psycopg
+import pytest
+
+from benchmarks import explain_queries, synthetic
+from load_hhs import load_hhs_data
+from load_quality import load_quality_data
+
+# Index each query is expected to be served by, once sequential scans are
+# ruled out. The HHS partitions are named after their week.
+EXPECTED_INDEXES = {
+    'load_hhs: existing keys': r'bedinfo_\w+_hospital_id_collection_week_key',
+    'load_quality: duplicate ids': r'hospitalqualityinformation_hospital_date_key',
+    'load_quality: close intervals': r'hospitalqualityhistory_open_idx',
+    'report: records at week': r'weeklybedrollup_pkey',
+    'report: records previous weeks': r'weeklybedrollup_pkey',
+    'report: bed statistics at week': r'weeklybedrollup_pkey',
+    'report: bed statistics recent weeks': r'weeklybedrollup_pkey',
+    'report: total bed usage': r'weeklybedrollup_pkey',
+    'report: emergency services by state': r'hospitalqualityhistory_valid_from_idx',
+    'report: state rating extremes': r'qualitysnapshots_pkey',
+}
+
+# Dashboard queries answered from the weekly rollup alone
+ROLLUP_QUERIES = ('report: records at week', 'report: records previous weeks', 'report: bed statistics at week',
+                  'report: bed statistics recent weeks', 'report: total bed usage')
+
+
+@pytest.fixture
+def plans(conninfo, tmp_path, monkeypatch):
+    """
+    Yields:
+    - dict, query name -> plan text of the loader and dashboard queries of
+      explain_queries, over two loaded weeks and snapshots
+    - dict, the sample parameters of the queries
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(synthetic, 'BASE_HOSPITALS', 300)
+    files = synthetic.generate(str(tmp_path / 'data'), weeks=2, snapshots=2)
+    with psycopg.connect(conninfo) as conn:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _, path, _ in files['hhs']:
+                assert load_hhs_data(path, conn, rejects_path=str(tmp_path / 'rejects.csv')) is not None
+            for date, path, _ in files['quality']:
+                assert load_quality_data(path, conn, date.isoformat(),
+                                         rejects_path=str(tmp_path / 'rejects.csv')) is not None
+        with conn.cursor() as curr:
+            curr.execute("ANALYZE")
+            # The tables are small enough for sequential scans to win, without them
+            # the planner shows which index it can use
+            curr.execute("SET enable_seqscan = off")
+            params = explain_queries.sample_parameters(curr)
+            plans = {}
+            for name, query, query_params in explain_queries.queries(params):
+                curr.execute(f"EXPLAIN {query}", query_params)
+                plans[name] = "\n".join(line for (line,) in curr.fetchall())
+        conn.rollback()
+    yield plans, params
+
+
+def test_queries_use_their_indexes(plans):
+    plans, _ = plans
+    for name, plan in plans.items():
+        assert 'Seq Scan' not in plan, f"{name}:\n{plan}"
+    for name, index in EXPECTED_INDEXES.items():
+        assert re.search(rf"(Index (Only )?Scan( Backward)? using|Bitmap Index Scan on) {index}", plans[name]), \
+            f"{name}:\n{plans[name]}"
+
+
+def test_weekly_panels_read_the_rollup(plans):
+    plans, _ = plans
+    for name in ROLLUP_QUERIES:
+        assert 'weeklybedrollup' in plans[name]
+        assert 'bedinfo' not in plans[name] and 'hospitalbedinformation' not in plans[name], f"{name}:\n{plans[name]}"
+
+
+def test_rollup_refresh_reads_the_partition_of_its_week(plans):
+    plans, params = plans
+    partition = f"bedinfo_{params['week']:%Y_%m_%d}"
+    for name in ('load_hhs: refresh weekly rollup', 'load_hhs: refresh state rollup'):
+        assert set(re.findall(r"(bedinfo_\d{4}_\d{2}_\d{2})\b", plans[name])) == {partition}, f"{name}:\n{plans[name]}"
@@ -0,0 +1,200 @@
+import datetime
+import os
+import struct
+import types
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import psycopg
+import pytest
+
+from report_data import COPY_SIGNATURE, decode_frame, fetch_frame
+
+# Adaptation context with psycopg's default loaders, in place of a connection
+CONTEXT = types.SimpleNamespace(adapters=psycopg.adapters, connection=None)
+
+POSTGRES_EPOCH = datetime.date(2000, 1, 1)
+
+
+def numeric_bytes(value):
+    """
+    Encode a Decimal in the binary format of numeric: digit count, weight of
+    the first base-10000 digit, sign, display scale, then the digits.
+    """
+    integer, _, fraction = format(abs(value), 'f').partition('.')
+    integer = integer.lstrip('0')
+    integer = integer.zfill(-(-len(integer) // 4) * 4)
+    padded_fraction = fraction.ljust(-(-len(fraction) // 4) * 4, '0')
+    digits = [int(group) for text in (integer, padded_fraction) for group in
+              (text[i:i + 4] for i in range(0, len(text), 4))]
+    weight = len(integer) // 4 - 1
+    while digits and digits[0] == 0:
+        digits.pop(0)
+        weight -= 1
+    while digits and digits[-1] == 0:
+        digits.pop()
+    if not digits:
+        weight = 0
+    sign = 0x4000 if value < 0 else 0
+    return struct.pack(f'>hhHh{len(digits)}h', len(digits), weight, sign, len(fraction), *digits)
+
+
+# Type oid -> binary encoder of a value
+ENCODERS = {
+    16: lambda value: struct.pack('?', value),
+    21: lambda value: struct.pack('>h', value),
+    23: lambda value: struct.pack('>i', value),
+    20: lambda value: struct.pack('>q', value),
+    700: lambda value: struct.pack('>f', value),
+    701: lambda value: struct.pack('>d', value),
+    1082: lambda value: struct.pack('>i', (value - POSTGRES_EPOCH).days),
+    25: lambda value: value.encode('utf-8'),
+    1043: lambda value: value.encode('utf-8'),
+    1700: numeric_bytes,
+}
+
+
+def copy_binary(rows, oids, header_extension=b''):
+    """
+    Build the output of COPY ... TO STDOUT (FORMAT BINARY) for some rows.
+    """
+    parts = [COPY_SIGNATURE, struct.pack('>ii', 0, len(header_extension)), header_extension]
+    for row in rows:
+        parts.append(struct.pack('>h', len(row)))
+        for value, oid in zip(row, oids):
+            if value is None:
+                parts.append(struct.pack('>i', -1))
+            else:
+                field = ENCODERS[oid](value)
+                parts.append(struct.pack('>i', len(field)) + field)
+    parts.append(struct.pack('>h', -1))
+    return b''.join(parts)
+
+
+def python_rows(frame):
+    """
+    Returns:
+    - list of row lists, with NumPy values as Python ones and every missing
+      value as None, to compare frames built in different ways
+    """
+    def convert(value):
+        if value is None or (not isinstance(value, (str, Decimal)) and pd.isna(value)):
+            return None
+        if isinstance(value, (np.datetime64, pd.Timestamp)):
+            return pd.Timestamp(value).date()
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+    return [[convert(value) for value in row] for row in frame.astype(object).itertuples(index=False)]
+
+
+def fetchall_frame(rows, description):
+    """
+    Returns:
+    - pandas df, the rows as a plain cursor.fetchall() would give them
+    """
+    return pd.DataFrame(rows, columns=[name for name, _ in description])
+
+
+def assert_decodes(rows, description, header_extension=b''):
+    data = copy_binary(rows, [oid for _, oid in description], header_extension)
+    frame = decode_frame(data, description, CONTEXT)
+    expected = fetchall_frame(rows, description)
+    assert list(frame.columns) == list(expected.columns)
+    assert python_rows(frame) == python_rows(expected)
+    return frame
+
+
+def test_fixed_width_columns_without_nulls():
+    description = [('flag', 16), ('small', 21), ('count', 23), ('big', 20), ('ratio', 701), ('week', 1082)]
+    rows = [(True, -3, 2_000_000_000, -2 ** 62, -0.5, datetime.date(2022, 9, 23)),
+            (False, 32767, -7, 5, 1e300, datetime.date(2000, 1, 1))]
+    frame = assert_decodes(rows, description)
+    assert frame['count'].dtype == np.int32
+    assert frame['ratio'].dtype == np.float64
+
+
+def test_real_values():
+    description = [('value', 700)]
+    data = copy_binary([(1.5,), (-0.25,), (None,)], [700])
+    frame = decode_frame(data, description, CONTEXT)
+    assert frame['value'].tolist()[:2] == [1.5, -0.25]
+    assert np.isnan(frame['value'][2])
+
+
+def test_nulls_in_every_type():
+    description = [('flag', 16), ('count', 23), ('ratio', 701), ('week', 1082), ('name', 25), ('rating', 1700)]
+    rows = [(None, 1, None, datetime.date(2022, 1, 1), None, Decimal('1.5')),
+            (True, None, 2.5, None, 'a', None),
+            (None, None, None, None, None, None)]
+    frame = assert_decodes(rows, description)
+    # Integer columns holding nulls become float with NaN, dates NaT
+    assert frame['count'].dtype == np.float64
+    assert frame['week'].isna().tolist() == [False, True, True]
+
+
+def test_dates_before_2000():
+    description = [('day', 1082)]
+    rows = [(datetime.date(1999, 12, 31),), (datetime.date(1970, 1, 1),), (datetime.date(1900, 3, 1),),
+            (datetime.date(2000, 1, 1),), (datetime.date(2038, 1, 19),)]
+    assert_decodes(rows, description)
+
+
+def test_numerics():
+    description = [('value', 1700)]
+    rows = [(Decimal('0'),), (Decimal('-12.345'),), (Decimal('0.0001'),), (Decimal('-0.5'),),
+            (Decimal('123456789.12345678'),), (Decimal('10000'),), (Decimal('-100000000'),), (Decimal('3.10'),), (None,)]
+    frame = assert_decodes(rows, description)
+    # The display scale is kept, like psycopg does
+    assert str(frame['value'][7]) == '3.10'
+
+
+def test_multibyte_and_empty_text():
+    description = [('city', 1043), ('note', 25)]
+    rows = [('Saint-Étienne', 'Ünïcödé'), ('東京', '🏥 beds'), ('', None), ('plain', '')]
+    frame = assert_decodes(rows, description)
+    assert frame['city'][2] == ''
+    assert frame['note'][2] is None
+
+
+def test_header_extension_is_skipped():
+    description = [('count', 23), ('name', 25)]
+    assert_decodes([(1, 'a'), (2, None)], description, header_extension=b'\x00\x01\x02\x03')
+
+
+def test_empty_result():
+    description = [('count', 23), ('name', 25)]
+    frame = decode_frame(copy_binary([], [23, 25]), description, CONTEXT)
+    assert list(frame.columns) == ['count', 'name']
+    assert len(frame) == 0
+
+
+def test_not_a_binary_copy():
+    with pytest.raises(ValueError):
+        decode_frame(b'count\n1\n', [('count', 23)], CONTEXT)
+
+
+# Connection string of a Postgres server, the comparison with psycopg's own
+# decoding is skipped without it
+ADMIN_CONNINFO = os.environ.get("TEST_DATABASE_URL")
+
+
+@pytest.mark.skipif(not ADMIN_CONNINFO, reason="TEST_DATABASE_URL is not set")
+def test_fetch_frame_matches_fetchall():
+    query = """
+        SELECT * FROM (VALUES
+            (1, 2.5::float8, -12.345::numeric, DATE '1999-12-31', 'Saint-Étienne'::text, TRUE, 10::bigint),
+            (NULL, NULL, 0.0001::numeric, DATE '1900-03-01', '東京 🏥', NULL, NULL),
+            (-3, -0.5, NULL, NULL, NULL, FALSE, -5),
+            (7, 1e300, -100000000, DATE '2022-09-23', '', TRUE, 0)
+        ) AS v (count, ratio, rating, day, name, flag, big)
+        WHERE count IS DISTINCT FROM %s
+        ORDER BY day NULLS LAST"""
+    with psycopg.connect(ADMIN_CONNINFO) as conn:
+        frame = fetch_frame(conn, query, (99,))
+        with conn.cursor() as curr:
+            curr.execute(query, (99,))
+            expected = pd.DataFrame(curr.fetchall(), columns=[column.name for column in curr.description])
+    assert list(frame.columns) == list(expected.columns)
+    assert python_rows(frame) == python_rows(expected)
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from spatial import GridIndex, HospitalMap, haversine_km
+
+
+def random_points(rng, n):
+    """
+    Returns:
+    - float ndarrays, latitudes and longitudes in degrees, spread over the
+      globe with some on cell edges, near the poles and the antimeridian
+    """
+    # Uniform on the sphere
+    latitudes = np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+    longitudes = rng.uniform(-180, 180, n)
+    edges = rng.integers(-89, 90, n // 4) + rng.choice([-1e-9, 0.0, 1e-9], n // 4)
+    edge_longitudes = rng.integers(-180, 180, n // 4) + rng.choice([-1e-9, 0.0, 1e-9], n // 4)
+    poles = rng.choice([-1, 1], n // 8) * rng.uniform(88, 90, n // 8)
+    antimeridian = rng.choice([-1, 1], n // 8) * rng.uniform(178, 180, n // 8)
+    latitudes = np.concatenate([latitudes, edges, poles, rng.uniform(-60, 60, n // 8),
+                                [90.0, -90.0, 0.0, 0.0]])
+    longitudes = np.concatenate([longitudes, edge_longitudes, rng.uniform(-180, 180, n // 8), antimeridian,
+                                 [0.0, 45.0, 180.0, -180.0]])
+    return latitudes, np.clip(longitudes, -180, 180)
+
+
+def brute_force(latitudes, longitudes, latitude, longitude):
+    """
+    Returns:
+    - float ndarray, distance in km from the location to every point, NaN
+      for points without coordinates
+    """
+    return haversine_km(np.radians(latitude), np.radians(longitude), np.radians(latitudes), np.radians(longitudes))
+
+
+def queries(rng, latitudes, longitudes, n):
+    """
+    Yields:
+    - (float, float), query locations: random, on the points themselves,
+      at the poles and on the antimeridian
+    """
+    for latitude, longitude in zip(*random_points(rng, n)):
+        yield latitude, longitude
+    for i in rng.choice(len(latitudes), n // 4):
+        if np.isfinite(latitudes[i]) and np.isfinite(longitudes[i]):
+            yield latitudes[i], longitudes[i]
+    yield from [(90.0, 0.0), (-90.0, 123.0), (89.9, -179.99), (0.0, 180.0), (0.0, -180.0), (-45.5, 179.5)]
+
+
+@pytest.fixture(params=[1.0, 0.25, 7.0], ids=['1deg', 'quarter', '7deg'])
+def cell_degrees(request):
+    return request.param
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(20220923)
+    return random_points(rng, 800)
+
+
+def test_within_matches_brute_force(points, cell_degrees):
+    latitudes, longitudes = points
+    index = GridIndex(latitudes, longitudes, cell_degrees)
+    rng = np.random.default_rng(1)
+    for latitude, longitude in queries(rng, latitudes, longitudes, 40):
+        distances = brute_force(latitudes, longitudes, latitude, longitude)
+        for radius_km in (0.0, 1.0, 80.0, 500.0, 3000.0, 12000.0, 25000.0):
+            positions, found = index.within(latitude, longitude, radius_km)
+            assert sorted(positions) == sorted(np.flatnonzero(distances <= radius_km))
+            assert np.array_equal(found, distances[positions])
+            assert (np.diff(found) >= 0).all()
+
+
+def test_nearest_matches_brute_force(points, cell_degrees):
+    latitudes, longitudes = points
+    index = GridIndex(latitudes, longitudes, cell_degrees)
+    rng = np.random.default_rng(2)
+    for latitude, longitude in queries(rng, latitudes, longitudes, 40):
+        distances = brute_force(latitudes, longitudes, latitude, longitude)
+        for k in (1, 5, 37, len(latitudes), len(latitudes) + 10):
+            positions, found = index.nearest(latitude, longitude, k)
+            expected = np.sort(distances)[:k]
+            assert len(positions) == min(k, len(latitudes))
+            # Ties may come in any order, the distances may not
+            assert np.array_equal(found, expected)
+            assert np.array_equal(found, distances[positions])
+            assert len(set(positions)) == len(positions)
+
+
+def test_missing_coordinates_are_never_returned(cell_degrees):
+    rng = np.random.default_rng(3)
+    latitudes, longitudes = random_points(rng, 200)
+    latitudes[::7] = np.nan
+    longitudes[3::11] = np.nan
+    located = np.isfinite(latitudes) & np.isfinite(longitudes)
+    index = GridIndex(latitudes, longitudes, cell_degrees)
+    assert len(index) == located.sum()
+
+    for latitude, longitude in queries(rng, latitudes, longitudes, 20):
+        distances = brute_force(latitudes, longitudes, latitude, longitude)
+        positions, _ = index.within(latitude, longitude, 25000.0)
+        assert sorted(positions) == sorted(np.flatnonzero(located))
+        for k in (3, len(latitudes)):
+            positions, found = index.nearest(latitude, longitude, k)
+            assert located[positions].all()
+            assert np.array_equal(found, np.sort(distances[located])[:k])
+
+
+def test_hospital_map_rows():
+    rng = np.random.default_rng(4)
+    latitudes, longitudes = random_points(rng, 100)
+    hospitals = pd.DataFrame({'hospital_pk': [f'{i:06d}' for i in range(len(latitudes))],
+                              'latitude': latitudes, 'longitude': longitudes})
+    hospitals.loc[[2, 50], 'latitude'] = None
+    hospital_map = HospitalMap(hospitals)
+
+    distances = brute_force(hospitals['latitude'].to_numpy(dtype=float), longitudes, 40.44, -79.94)
+    nearest = hospital_map.nearest(40.44, -79.94, len(hospitals) + 5)
+    assert len(nearest) == len(hospitals) - 2
+    assert list(nearest.columns) == ['distance_km', 'hospital_pk', 'latitude', 'longitude']
+    assert not nearest['latitude'].isna().any()
+    assert np.array_equal(nearest['distance_km'].to_numpy(), np.sort(distances[~np.isnan(distances)]))
+
+    within = hospital_map.within(40.44, -79.94, 2000.0)
+    expected = hospitals[distances <= 2000.0]
+    assert sorted(within['hospital_pk']) == sorted(expected['hospital_pk'])
+
+    assert len(HospitalMap(hospitals.iloc[:0]).nearest(0.0, 0.0, 3)) == 0
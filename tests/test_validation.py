@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+from validation import Rule, add_reject, apply_rules, missing, negative, write_rejects
+
+
+def test_missing_and_negative_rules():
+    df = pd.DataFrame({'beds': [1.0, -2.0, 0.0, np.nan], 'name': ['a', None, 'c', 'd']}, index=[10, 11, 12, 13])
+
+    reasons = apply_rules(df, [negative('beds')])
+    # NaN is neither negative nor, for this rule, a failure
+    assert reasons.tolist() == [None, 'negative_beds', None, None]
+    assert reasons.index.tolist() == [10, 11, 12, 13]
+
+    assert apply_rules(df, [missing('beds')]).tolist() == [None, None, None, 'missing_beds']
+    assert apply_rules(df, [missing('name')]).tolist() == [None, 'missing_name', None, None]
+
+
+def test_reasons_follow_the_rule_order():
+    df = pd.DataFrame({'beds': [-1.0, -1.0, 5.0], 'name': [None, 'b', None]})
+
+    # A row gets the reason of the first rule it fails
+    assert apply_rules(df, [missing('name'), negative('beds')]).tolist() == ['missing_name', 'negative_beds',
+                                                                               'missing_name']
+    assert apply_rules(df, [negative('beds'), missing('name')]).tolist() == ['negative_beds', 'negative_beds',
+                                                                               'missing_name']
+
+
+def test_custom_rules_and_valid_frames():
+    df = pd.DataFrame({'state': ['PA', 'XX', None]})
+    rule = Rule('state', lambda values: ~values.isin(['PA', 'OH']), 'unknown_state')
+    # A predicate returning NA for a row does not fail it
+    assert apply_rules(df, [missing('state'), rule]).tolist() == [None, 'unknown_state', 'missing_state']
+    assert apply_rules(df.iloc[:1], [rule]).isna().all()
+    assert apply_rules(df.iloc[:0], [rule]).empty
+
+
+def test_add_reject_keeps_each_reason_once():
+    rejects = {}
+    add_reject(rejects, 3, 'negative_beds')
+    add_reject(rejects, 3, 'insert_error')
+    add_reject(rejects, 3, 'negative_beds')
+    add_reject(rejects, 1, 'missing_name')
+    assert rejects == {3: ['negative_beds', 'insert_error'], 1: ['missing_name']}
+
+
+def test_rejects_file_has_the_original_rows_and_their_reasons(tmp_path):
+    raw_df = pd.DataFrame({'hospital_pk': ['010001', '010002', '010003', '010004'],
+                           'beds': ['12', '-3', '', '7']})
+    rejects = {2: ['missing_beds'], 1: ['negative_beds', 'insert_error']}
+    path = tmp_path / 'rejects.csv'
+
+    write_rejects(raw_df, rejects, path)
+    written = pd.read_csv(path, dtype=object, lineterminator='\r', keep_default_na=False)
+    assert written.columns.tolist() == ['hospital_pk', 'beds', 'reject_reason']
+    assert written.values.tolist() == [['010002', '-3', 'negative_beds;insert_error'],
+                                       ['010003', '', 'missing_beds']]
+
+    # Later chunks are appended without a second header
+    write_rejects(raw_df, {3: ['duplicate_bed_week']}, path, append=True)
+    written = pd.read_csv(path, dtype=object, lineterminator='\r', keep_default_na=False)
+    assert written['hospital_pk'].tolist() == ['010002', '010003', '010004']
+    assert written['reject_reason'].tolist()[-1] == 'duplicate_bed_week'
@@ -0,0 +1,88 @@
+import pandas as pd
+import numpy as np
+from collections import namedtuple
+
+
+# A validation rule flags the rows of `column` for which `predicate` (a function
+# taking the column as a pandas Series and returning a boolean mask) is True.
+Rule = namedtuple('Rule', ['column', 'predicate', 'reason'])
+
+
+def negative(column):
+    """
+    Build a rule rejecting rows where a numeric column is less than 0.
+
+    Parameters:
+    - column: str, name of the column to check
+
+    Returns:
+    - Rule, with reason code 'negative_<column>'
+    """
+    return Rule(column, lambda values: values.lt(0), f'negative_{column}')
+
+
+def missing(column):
+    """
+    Build a rule rejecting rows where a column is empty.
+
+    Parameters:
+    - column: str, name of the column to check
+
+    Returns:
+    - Rule, with reason code 'missing_<column>'
+    """
+    return Rule(column, lambda values: values.isna(), f'missing_{column}')
+
+
+def apply_rules(df, rules):
+    """
+    Evaluate a rule set over a whole DataFrame at once.
+
+    Rules are checked in order and a row gets the reason code of the first
+    rule it fails, like a chain of if/elif checks would.
+
+    Parameters:
+    - df: pandas df, typed data to validate
+    - rules: Rule list
+
+    Returns:
+    - pandas Series indexed like df, reason code of each invalid row and None
+      for valid rows
+    """
+    reasons = pd.Series(np.full(len(df), None, dtype=object), index=df.index)
+    for rule in rules:
+        failed = rule.predicate(df[rule.column]).fillna(False).astype(bool) & reasons.isna()
+        reasons[failed] = rule.reason
+    return reasons
+
+
+def add_reject(rejects, index, reason):
+    """
+    Record a reason code for a rejected row.
+
+    Parameters:
+    - rejects: dict, row index -> list of reason codes
+    - index: index of the rejected row
+    - reason: str, reason code
+    """
+    reasons = rejects.setdefault(index, [])
+    if reason not in reasons:
+        reasons.append(reason)
+
+
+def write_rejects(raw_df, rejects, path, append=False):
+    """
+    Write the original rows that were rejected, with a `reject_reason` column.
+
+    Parameters:
+    - raw_df: pandas df, rows as read from the source file
+    - rejects: dict, row index -> list of reason codes
+    - path: str, CSV file to write
+    - append: bool, add the rows to the end of an existing file without
+      repeating the header, e.g. when a file is processed in chunks (default is False)
+    """
+    rows = sorted(rejects)
+    out = raw_df.loc[rows].copy()
+    out['reject_reason'] = [';'.join(rejects[index]) for index in rows]
+    with open(path, "a" if append else "w", encoding="utf-8") as f:
+        f.write(out.to_csv(index=False, header=not append, lineterminator='\r'))